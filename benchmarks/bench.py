@@ -10,14 +10,16 @@ Use --json to emit machine-readable results instead.
 """
 
 import argparse
+import base64
 import json
 import timeit
+from array import array
 
 from fastbencode import _bencode_py
 
 try:
     from fastbencode import _bencode_rs
-except ModuleNotFoundError:
+except ImportError:
     _bencode_rs = None
 
 
@@ -32,9 +34,51 @@ def payloads():
             b"items": [{b"id": i, b"name": b"n" * 8} for i in range(200)],
         },
         "ints": list(range(-500, 500)),
+        "bigints": [(1 << 127) + i * 7919 for i in range(500)]
+        + [-(10**300) - i for i in range(100)],
+        "records": [
+            {b"id": i, b"ts": 1700000000 + i, b"host": b"h%03d" % (i % 100)}
+            for i in range(1000)
+        ],
     }
 
 
+RECORD_FIELDS = [b"id", b"ts", b"host"]
+
+
+def records_to_columns(module, encoded):
+    """Decode the records payload and copy it into columns by hand."""
+    records = module.bdecode(encoded)
+    return {
+        b"id": array("q", [r[b"id"] for r in records]),
+        b"ts": array("q", [r[b"ts"] for r in records]),
+        b"host": [r[b"host"] for r in records],
+    }
+
+
+def json_value(value):
+    """Convert a decoded value to types json.dumps accepts."""
+    if isinstance(value, bytes):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode("ascii")
+    elif isinstance(value, list):
+        return [json_value(v) for v in value]
+    elif isinstance(value, dict):
+        return {json_value(k): json_value(v) for k, v in value.items()}
+    return value
+
+
+def decode_then_dump(module, encoded):
+    """Convert encoded to JSON by decoding it and then dumping the result."""
+    return json.dumps(
+        json_value(module.bdecode(encoded)),
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
 def time_ms(fn, number, repeat):
     """Return the fastest per-call time in milliseconds over repeat runs."""
     best = min(timeit.repeat(fn, number=number, repeat=repeat))
@@ -42,14 +86,45 @@ def time_ms(fn, number, repeat):
 
 
 def measure(module, number, repeat):
-    """Time encode and decode of every payload for one implementation."""
+    """Time encode and decode of every payload for one implementation.
+
+    "trusted" is the time to decode with trusted=True, which skips the
+    canonical form checks, and "canonical" the time to re-encode it with
+    bcanonicalize. For the records payload, "columns" is the time
+    to decode it with bdecode_columns and "copy" the time to decode it and
+    then build the same columns from the result.
+
+    "to_json" is the time to convert a payload to JSON with bencode_to_json
+    and "dump_json" the time to decode it and dump it with json.dumps.
+    """
     result = {}
     for name, value in payloads().items():
         encoded = module.bencode(value)
         result[name] = {
             "encode": time_ms(lambda: module.bencode(value), number, repeat),
             "decode": time_ms(lambda: module.bdecode(encoded), number, repeat),
+            "trusted": time_ms(
+                lambda: module.bdecode(encoded, trusted=True), number, repeat
+            ),
+            "canonical": time_ms(
+                lambda: module.bcanonicalize(encoded), number, repeat
+            ),
+            "to_json": time_ms(
+                lambda: module.bencode_to_json(encoded), number, repeat
+            ),
+            "dump_json": time_ms(
+                lambda: decode_then_dump(module, encoded), number, repeat
+            ),
         }
+    encoded = module.bencode(payloads()["records"])
+    result["records"]["columns"] = time_ms(
+        lambda: module.bdecode_columns(encoded, [], RECORD_FIELDS),
+        number,
+        repeat,
+    )
+    result["records"]["copy"] = time_ms(
+        lambda: records_to_columns(module, encoded), number, repeat
+    )
     return result
 
 
@@ -85,11 +160,30 @@ def main():
 
     for name in impls:
         print(f"\n{name} (ms per call, lower is better)")
-        print(f"  {'payload':12s} {'encode':>9s} {'decode':>9s}")
+        print(
+            f"  {'payload':12s} {'encode':>9s} {'decode':>9s} {'trusted':>9s}"
+            f" {'canonical':>9s}"
+        )
         for payload, timings in results[name].items():
             print(
                 f"  {payload:12s} {timings['encode']:9.4f} "
-                f"{timings['decode']:9.4f}"
+                f"{timings['decode']:9.4f} {timings['trusted']:9.4f} "
+                f"{timings['canonical']:9.4f}"
+            )
+
+    print("\nrecords as columns (ms per call, lower is better)")
+    print(f"  {'impl':12s} {'copy':>9s} {'columns':>9s}")
+    for name in impls:
+        timings = results[name]["records"]
+        print(f"  {name:12s} {timings['copy']:9.4f} {timings['columns']:9.4f}")
+
+    print("\nbencode to JSON (ms per call, lower is better)")
+    print(f"  {'impl':8s} {'payload':12s} {'dump':>9s} {'to_json':>9s}")
+    for name in impls:
+        for payload, timings in results[name].items():
+            print(
+                f"  {name:8s} {payload:12s} {timings['dump_json']:9.4f} "
+                f"{timings['to_json']:9.4f}"
             )
 
     if "rust" in results and "python" in results:
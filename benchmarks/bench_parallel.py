@@ -0,0 +1,119 @@
+"""Benchmark multi-process encoding and decoding by number of workers.
+
+Times bencode_parallel and bdecode_parallel on a large list of records and
+a large dict, with a process pool of each requested size. Pools are started
+before timing, so process start-up is not included. Run with no arguments
+for a summary:
+
+    python benchmarks/bench_parallel.py
+
+Use --json to emit machine-readable results instead.
+"""
+
+import argparse
+import json
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+
+from fastbencode import bdecode, bencode
+from fastbencode.parallel import bdecode_parallel, bencode_parallel
+
+
+def payloads(items):
+    """Return named large structures to split up."""
+    return {
+        "records": [
+            {b"id": i, b"host": b"h%03d" % (i % 100), b"tags": [b"a", i]}
+            for i in range(items)
+        ],
+        "table": {b"key%08d" % i: [i, b"v" * 16] for i in range(items)},
+    }
+
+
+def time_s(fn, repeat):
+    """Return the fastest time of a single call in seconds."""
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def measure(workers, items, repeat):
+    """Time each payload serially and with each number of workers.
+
+    Worker count 0 stands for plain bencode and bdecode.
+    """
+    result = {}
+    for name, value in payloads(items).items():
+        encoded = bencode(value)
+        timings = {
+            0: {
+                "encode": time_s(lambda: bencode(value), repeat),
+                "decode": time_s(lambda: bdecode(encoded), repeat),
+            }
+        }
+        for n in workers:
+            with ProcessPoolExecutor(max_workers=n) as pool:
+                # Start the workers before timing.
+                list(pool.map(abs, range(n)))
+                timings[n] = {
+                    "encode": time_s(
+                        lambda: bencode_parallel(
+                            value, workers=n, executor=pool
+                        ),
+                        repeat,
+                    ),
+                    "decode": time_s(
+                        lambda: bdecode_parallel(
+                            encoded, workers=n, executor=pool
+                        ),
+                        repeat,
+                    ),
+                }
+        result[name] = {"size": len(encoded), "timings": timings}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--items", type=int, default=500000, help="items per payload"
+    )
+    parser.add_argument(
+        "--workers",
+        default="1,2,4,8",
+        help="comma-separated worker counts to try",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="timing runs to take the min of"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="emit results as JSON"
+    )
+    args = parser.parse_args()
+
+    workers = [int(n) for n in args.workers.split(",")]
+    results = measure(workers, args.items, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, result in results.items():
+        timings = result["timings"]
+        print(
+            f"\n{name}, {result['size']} bytes (s per call, lower is better)"
+        )
+        print(
+            f"  {'workers':>7s} {'encode':>9s} {'speedup':>8s} "
+            f"{'decode':>9s} {'speedup':>8s}"
+        )
+        for n, timing in timings.items():
+            label = "serial" if n == 0 else str(n)
+            enc = timings[0]["encode"] / timing["encode"]
+            dec = timings[0]["decode"] / timing["decode"]
+            print(
+                f"  {label:>7s} {timing['encode']:9.3f} {enc:7.2f}x "
+                f"{timing['decode']:9.3f} {dec:7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,8 @@
 
 """Wrapper around the bencode Rust and Python implementations."""
 
+from ._preserve import PreservedDict, PreservedList  # noqa: F401
+
 __version__ = (0, 3, 11)
 
 
@@ -24,11 +26,26 @@ Bencached: type
 try:
     from fastbencode._bencode_rs import (
         Bencached,
+        bcanonicalize,
         bdecode,
         bdecode_as_tuple,
+        bdecode_columns,
+        bdecode_file,
+        bdecode_frames,
+        bdecode_item_offsets,
+        bdecode_keys_utf8,
+        bdecode_path,
+        bdecode_paths,
+        bdecode_preserving,
         bdecode_utf8,
+        bdecode_with_digests,
+        bdump,
         bencode,
+        bencode_columns,
+        bencode_frame,
+        bencode_to_json,
         bencode_utf8,
+        bload,
     )
 except ModuleNotFoundError as e:
     import warnings
@@ -38,9 +55,24 @@ except ModuleNotFoundError as e:
     # Fall back to pure Python implementation
     from ._bencode_py import (  # noqa: F401
         Bencached,
+        bcanonicalize,
         bdecode,
         bdecode_as_tuple,
+        bdecode_columns,
+        bdecode_file,
+        bdecode_frames,
+        bdecode_item_offsets,
+        bdecode_keys_utf8,
+        bdecode_path,
+        bdecode_paths,
+        bdecode_preserving,
         bdecode_utf8,
+        bdecode_with_digests,
+        bdump,
         bencode,
+        bencode_columns,
+        bencode_frame,
+        bencode_to_json,
         bencode_utf8,
+        bload,
     )
@@ -17,56 +17,214 @@
 # Modifications copyright (C) 2021-2023 Jelmer Vernooĳ
 
 
+import base64
+import hashlib
+import json
+import mmap
+import os
+import stat
+import sys
+from array import array
 from collections.abc import Callable
 
+from ._bigint import MIN_LIMITED_DIGITS, decimal_to_int, int_to_decimal
+from ._preserve import PreservedDict, PreservedList
+
+# Encoded output is handed to file objects in pieces of roughly this size.
+WRITE_CHUNK_SIZE = 1 << 20
+
+# Size of the big-endian length header of a length-prefixed frame.
+FRAME_HEADER_SIZE = 4
+
+# Longest netstring length prefix we accept, in digits.
+MAX_NETSTRING_DIGITS = 20
+
+# Longest byte string length prefix we look for the ":" in, in digits.
+MAX_LENGTH_DIGITS = 20
+
+# The characters a byte string can start with.
+_DIGITS = [bytes([c]) for c in b"0123456789"]
+
 
 class BDecoder:
-    def __init__(self, yield_tuples=False, bytestring_encoding=None) -> None:
+    def __init__(
+        self,
+        yield_tuples=False,
+        bytestring_encoding=None,
+        preserve=False,
+        str_keys=False,
+        lenient=False,
+    ) -> None:
         """Constructor.
 
         :param yield_tuples: if true, decode "l" elements as tuples rather than
             lists.
+        :param preserve: if true, decode containers as PreservedList and
+            PreservedDict objects that remember their original encoding.
+        :param str_keys: if true, decode dict keys as interned UTF-8 str,
+            leaving other byte strings as bytes.
+        :param lenient: if true, accept dict keys in any order and repeated
+            keys, as handled by bcanonicalize.
         """
         self.yield_tuples = yield_tuples
         self.bytestring_encoding = bytestring_encoding
+        self.str_keys = str_keys
         self._max_depth = None
         self._depth = 0
-        decode_func = {}
-        decode_func[b"l"] = self.decode_list
-        decode_func[b"d"] = self.decode_dict
+        self._view_threshold = None
+        self._view = None
+        self._remaining = 0
+        self._trusted = False
+        self._parent = None
+        self._items_left = 0
+        self._duplicates = "error"
+        decode_func = dict.fromkeys(_DIGITS, self.decode_bytes)
+        if lenient:
+            decode_func[b"l"] = self.decode_list
+            decode_func[b"d"] = self.decode_lenient_dict
+        elif preserve:
+            decode_func[b"l"] = self.decode_preserved_list
+            decode_func[b"d"] = self.decode_preserved_dict
+        else:
+            decode_func[b"l"] = self.decode_list
+            decode_func[b"d"] = self.decode_dict
         decode_func[b"i"] = self.decode_int
-        decode_func[b"0"] = self.decode_bytes
-        decode_func[b"1"] = self.decode_bytes
-        decode_func[b"2"] = self.decode_bytes
-        decode_func[b"3"] = self.decode_bytes
-        decode_func[b"4"] = self.decode_bytes
-        decode_func[b"5"] = self.decode_bytes
-        decode_func[b"6"] = self.decode_bytes
-        decode_func[b"7"] = self.decode_bytes
-        decode_func[b"8"] = self.decode_bytes
-        decode_func[b"9"] = self.decode_bytes
+        self.decode_func = decode_func
+
+    def _counting(self, decode):
+        """Wrap decode to count the objects it creates towards max_items."""
+
+        def decode_counted(x, f):
+            self._items_left -= 1
+            if self._items_left < 0:
+                raise ValueError("more than max_items objects")
+            return decode(x, f)
+
+        return decode_counted
+
+    def _limiting_digits(self, decode, max_int_digits):
+        """Wrap decode to reject integers longer than max_int_digits."""
+
+        def decode_limited(x, f):
+            # Look no further than the longest integer allowed.
+            limit = f + max_int_digits + 3
+            if x.find(b"e", f + 1, limit) == -1 and len(x) > limit:
+                raise _too_many_int_digits()
+            n, end = decode(x, f)
+            if end - f - 2 - (x[f + 1 : f + 2] == b"-") > max_int_digits:
+                raise _too_many_int_digits()
+            return (n, end)
+
+        return decode_limited
+
+    def _limiting_length(self, string_bounds, max_string_length):
+        """Wrap string_bounds to reject strings over max_string_length."""
+
+        def string_bounds_limited(x, f):
+            # The length prefix is checked before looking for the contents.
+            colon = x.find(b":", f, f + MAX_LENGTH_DIGITS + 1)
+            if (
+                colon != -1
+                and x[f:colon].isdigit()
+                and int(x[f:colon]) > max_string_length
+            ):
+                raise ValueError("string is longer than max_string_length")
+            return string_bounds(x, f)
+
+        return string_bounds_limited
+
+    def _limit(
+        self, view_threshold, max_items, max_string_length, max_int_digits
+    ):
+        """Switch to decode functions that apply the given limits.
+
+        Calls without limits do not pay for checking them. _decode switches
+        back once the call is done.
+        """
+        decode_func = dict(self.decode_func)
+        if view_threshold is not None and not self.bytestring_encoding:
+            self._view_threshold = view_threshold
+            decode_func.update(dict.fromkeys(_DIGITS, self.decode_view))
+        if max_string_length is not None:
+            self._string_bounds = self._limiting_length(
+                self._string_bounds, max_string_length
+            )
+        if max_int_digits is not None:
+            decode_func[b"i"] = self._limiting_digits(
+                decode_func[b"i"], max_int_digits
+            )
+        if max_items is not None:
+            self._items_left = max_items
+            decode_func = {
+                c: self._counting(decode) for c, decode in decode_func.items()
+            }
+            self.decode_key = self._counting(self.decode_key)
         self.decode_func = decode_func
 
     def decode_int(self, x, f):
         f += 1
-        newf = x.index(b"e", f)
-        n = int(x[f:newf])
-        if x[f : f + 2] == b"-0":
-            raise ValueError
-        elif x[f : f + 1] == b"0" and newf != f + 1:
+        newf = x.find(b"e", f)
+        if newf == -1:
             raise ValueError
+        digits = x[f:newf]
+        # int() would also accept "+", "_" and whitespace.
+        if not digits.isdigit() and (
+            digits[:1] != b"-" or not digits[1:].isdigit()
+        ):
+            raise ValueError("invalid integer")
+        if len(digits) <= MIN_LIMITED_DIGITS:
+            n = int(digits)
+        else:
+            n = decimal_to_int(digits)
+        if not self._trusted:
+            if x[f : f + 2] == b"-0":
+                raise ValueError
+            elif x[f : f + 1] == b"0" and newf != f + 1:
+                raise ValueError
         return (n, newf + 1)
 
-    def decode_bytes(self, x, f):
-        colon = x.index(b":", f)
-        n = int(x[f:colon])
-        if x[f : f + 1] == b"0" and colon != f + 1:
+    def _string_bounds(self, x, f):
+        """Return the start and end offsets of the string encoded at f."""
+        colon = x.find(b":", f, f + MAX_LENGTH_DIGITS + 1)
+        if colon == -1:
+            raise ValueError
+        digits = x[f:colon]
+        # int() would also accept "-", "+" and whitespace.
+        if not digits.isdigit():
+            raise ValueError("invalid length")
+        n = int(digits)
+        if digits[:1] == b"0" and colon != f + 1 and not self._trusted:
             raise ValueError
         colon += 1
-        d = x[colon : colon + n]
+        if colon + n > len(x):
+            raise ValueError("stream underflow")
+        return (colon, colon + n)
+
+    def decode_bytes(self, x, f):
+        start, end = self._string_bounds(x, f)
+        d = x[start:end]
         if self.bytestring_encoding:
             d = d.decode(self.bytestring_encoding)
-        return (d, colon + n)
+        return (d, end)
+
+    def decode_view(self, x, f):
+        # Byte strings of at least view_threshold bytes become views of x.
+        start, end = self._string_bounds(x, f)
+        if end - start < self._view_threshold:
+            return (x[start:end], end)
+        if self._view is None:
+            self._view = memoryview(x).toreadonly()
+        return (self._view[start:end], end)
+
+    def decode_key(self, x, f):
+        # Dict keys are always materialised, never views.
+        start, end = self._string_bounds(x, f)
+        k = x[start:end]
+        if self.bytestring_encoding:
+            k = k.decode(self.bytestring_encoding)
+        elif self.str_keys:
+            k = sys.intern(k.decode("utf-8"))
+        return (k, end)
 
     def decode_list(self, x, f):
         if self._max_depth is not None and self._depth >= self._max_depth:
@@ -87,37 +245,700 @@ class BDecoder:
         self._depth += 1
         r, f = {}, f + 1
         lastkey = None
+        check_order = not self._trusted
         while x[f : f + 1] != b"e":
-            k, f = self.decode_bytes(x, f)
-            if lastkey is not None and lastkey >= k:
-                raise ValueError
-            lastkey = k
+            k, f = self.decode_key(x, f)
+            if check_order:
+                if lastkey is not None and lastkey >= k:
+                    raise ValueError
+                lastkey = k
             r[k], f = self.decode_func[x[f : f + 1]](x, f)
         self._depth -= 1
         return (r, f + 1)
 
-    def bdecode(self, x, max_depth=None):
+    def decode_lenient_dict(self, x, f):
+        if self._max_depth is not None and self._depth >= self._max_depth:
+            raise RecursionError("maximum bencode nesting depth exceeded")
+        self._depth += 1
+        r, f = {}, f + 1
+        while x[f : f + 1] != b"e":
+            k, f = self.decode_key(x, f)
+            v, f = self.decode_func[x[f : f + 1]](x, f)
+            if k in r:
+                if self._duplicates == "error":
+                    raise ValueError("duplicate dict key")
+                elif self._duplicates == "first":
+                    continue
+            r[k] = v
+        self._depth -= 1
+        return (r, f + 1)
+
+    def _decode_preserved(self, x, f, container, decode):
+        """Decode the container at f into container, recording its span."""
+        container._parent = self._parent
+        self._parent = container
+        try:
+            items, end = decode(x, f)
+        finally:
+            self._parent = container._parent
+        if self._view is None:
+            self._view = memoryview(x).toreadonly()
+        container._raw = self._view[f:end]
+        return items, end
+
+    def decode_preserved_list(self, x, f):
+        r = PreservedList()
+        items, f = self._decode_preserved(x, f, r, self.decode_list)
+        list.extend(r, items)
+        return (r, f)
+
+    def decode_preserved_dict(self, x, f):
+        r = PreservedDict()
+        items, f = self._decode_preserved(x, f, r, self.decode_dict)
+        dict.update(r, items)
+        return (r, f)
+
+    def skip_value(self, x, f):
+        """Return the offset just past the value at f without building it.
+
+        The value's syntax is still checked, including dict key order.
+        """
+        c = x[f : f + 1]
+        if c == b"i":
+            return self.decode_int(x, f)[1]
+        elif c.isdigit():
+            return self._string_bounds(x, f)[1]
+        elif c != b"l" and c != b"d":
+            raise ValueError
+        if self._max_depth is not None and self._depth >= self._max_depth:
+            raise RecursionError("maximum bencode nesting depth exceeded")
+        self._depth += 1
+        f += 1
+        lastkey = None
+        while x[f : f + 1] != b"e":
+            if c == b"d":
+                start, f = self._string_bounds(x, f)
+                k = x[start:f]
+                if lastkey is not None and lastkey >= k:
+                    raise ValueError
+                lastkey = k
+            f = self.skip_value(x, f)
+        self._depth -= 1
+        return f + 1
+
+    def bdecode_item_offsets(self, x, max_depth=None):
+        """Check x, which must encode a list or dict, and locate its items.
+
+        :return: the offsets of the items (of the keys, for a dict),
+            followed by the offset of the closing "e".
+        """
+        if not isinstance(x, bytes):
+            raise TypeError
+        c = x[:1]
+        if c != b"l" and c != b"d":
+            raise ValueError("value is not a list or dict")
+        if max_depth is not None and max_depth < 1:
+            raise RecursionError("maximum bencode nesting depth exceeded")
+        self._max_depth = max_depth
+        self._depth = 1
+        offsets = []
+        f = 1
+        lastkey = None
+        try:
+            while x[f : f + 1] != b"e":
+                offsets.append(f)
+                if c == b"d":
+                    start, f = self._string_bounds(x, f)
+                    k = x[start:f]
+                    if lastkey is not None and lastkey >= k:
+                        raise ValueError
+                    lastkey = k
+                f = self.skip_value(x, f)
+        except (IndexError, KeyError, OverflowError) as e:
+            raise ValueError(str(e))
+        if f + 1 != len(x):
+            raise ValueError
+        offsets.append(f)
+        return offsets
+
+    def _collect_paths(self, x, f, node, results):
+        """Decode the values below node in the path tree from the value at f.
+
+        Values that are not on any requested path are skipped over. Found
+        values are stored in results at the indices named by the tree.
+
+        :return: the offset just past the value at f, unless all paths have
+            been found, in which case scanning stops early.
+        """
+        if node.targets:
+            v, end = self.decode_func[x[f : f + 1]](x, f)
+            for target in node.targets:
+                results[target] = v
+            self._remaining -= len(node.targets)
+            if not node.children or not self._remaining:
+                return end
+        c = x[f : f + 1]
+        if c == b"d" and node.children:
+            if self._max_depth is not None and self._depth >= self._max_depth:
+                raise RecursionError("maximum bencode nesting depth exceeded")
+            self._depth += 1
+            f += 1
+            lastkey = None
+            while x[f : f + 1] != b"e":
+                k, f = self.decode_key(x, f)
+                if lastkey is not None and lastkey >= k:
+                    raise ValueError
+                lastkey = k
+                child = node.children.get(k)
+                if child is None:
+                    f = self.skip_value(x, f)
+                else:
+                    f = self._collect_paths(x, f, child, results)
+                    if not self._remaining:
+                        return f
+            self._depth -= 1
+            return f + 1
+        elif c == b"l" and node.children:
+            if self._max_depth is not None and self._depth >= self._max_depth:
+                raise RecursionError("maximum bencode nesting depth exceeded")
+            self._depth += 1
+            f += 1
+            i = 0
+            while x[f : f + 1] != b"e":
+                child = node.children.get(i)
+                if child is None:
+                    f = self.skip_value(x, f)
+                else:
+                    f = self._collect_paths(x, f, child, results)
+                    if not self._remaining:
+                        return f
+                i += 1
+            self._depth -= 1
+            return f + 1
+        return self.skip_value(x, f)
+
+    def bdecode_paths(self, x, paths, max_depth=None):
+        if not isinstance(x, bytes):
+            raise TypeError
+        paths = [tuple(path) for path in paths]
+        root = _PathNode()
+        for i, path in enumerate(paths):
+            root.insert(path, i)
+        results = [_MISSING] * len(paths)
+        self._max_depth = max_depth
+        self._depth = 0
+        self._remaining = len(paths)
+        try:
+            self._collect_paths(x, 0, root, results)
+        except (IndexError, KeyError, OverflowError) as e:
+            raise ValueError(str(e))
+        for path, result in zip(paths, results):
+            if result is _MISSING:
+                raise KeyError(path)
+        return results
+
+    def _decode_spans(self, x, f, node, spans):
+        """Decode the value at f, recording the spans of values on paths.
+
+        Containers below node in the path tree are decoded here so that
+        their children can be tracked; everything else is decoded as usual.
+        Spans are stored in spans at the indices named by the tree.
+        """
+        c = x[f : f + 1]
+        if node.children and (c == b"d" or c == b"l"):
+            if self._max_depth is not None and self._depth >= self._max_depth:
+                raise RecursionError("maximum bencode nesting depth exceeded")
+            self._depth += 1
+            pos = f + 1
+            if c == b"d":
+                r = {}
+                lastkey = None
+                while x[pos : pos + 1] != b"e":
+                    k, pos = self.decode_key(x, pos)
+                    if lastkey is not None and lastkey >= k:
+                        raise ValueError
+                    lastkey = k
+                    child = node.children.get(k)
+                    if child is None:
+                        r[k], pos = self.decode_func[x[pos : pos + 1]](x, pos)
+                    else:
+                        r[k], pos = self._decode_spans(x, pos, child, spans)
+            else:
+                r = []
+                while x[pos : pos + 1] != b"e":
+                    child = node.children.get(len(r))
+                    if child is None:
+                        v, pos = self.decode_func[x[pos : pos + 1]](x, pos)
+                    else:
+                        v, pos = self._decode_spans(x, pos, child, spans)
+                    r.append(v)
+                if self.yield_tuples:
+                    r = tuple(r)
+            self._depth -= 1
+            end = pos + 1
+        else:
+            r, end = self.decode_func[c](x, f)
+        for target in node.targets:
+            spans[target] = (f, end)
+        return (r, end)
+
+    def bdecode_with_digests(self, x, paths, algorithm="sha1", max_depth=None):
         if not isinstance(x, bytes):
             raise TypeError
+        # Fail on an unknown algorithm before doing any decoding.
+        hashlib.new(algorithm)
+        paths = [tuple(path) for path in paths]
+        root = _PathNode()
+        for i, path in enumerate(paths):
+            root.insert(path, i)
+        spans = [None] * len(paths)
         self._max_depth = max_depth
         self._depth = 0
         try:
-            r, l = self.decode_func[x[:1]](x, 0)  # noqa: E741
+            r, l = self._decode_spans(x, 0, root, spans)  # noqa: E741
         except (IndexError, KeyError, OverflowError) as e:
             raise ValueError(str(e))
         if l != len(x):  # noqa: E741
             raise ValueError
+        digests = []
+        with memoryview(x) as view:
+            for path, span in zip(paths, spans):
+                if span is None:
+                    raise KeyError(path)
+                digests.append(
+                    hashlib.new(algorithm, view[span[0] : span[1]]).digest()
+                )
+        return (r, digests)
+
+    def bdecode_path(self, x, path, max_depth=None):
+        return self.bdecode_paths(x, [path], max_depth)[0]
+
+    def _seek(self, x, f, path):
+        """Return the offset of the value at path below the value at f.
+
+        Only the entries before the one on the path are checked in each
+        container passed through.
+
+        :raises KeyError: if there is no value at path.
+        """
+        for key in path:
+            c = x[f : f + 1]
+            if c == b"d" and isinstance(key, bytes):
+                found = False
+            elif c == b"l" and isinstance(key, int):
+                i = 0
+            else:
+                raise KeyError(path)
+            if self._max_depth is not None and self._depth >= self._max_depth:
+                raise RecursionError("maximum bencode nesting depth exceeded")
+            self._depth += 1
+            f += 1
+            lastkey = None
+            while x[f : f + 1] != b"e":
+                if c == b"d":
+                    k, f = self.decode_key(x, f)
+                    if lastkey is not None and lastkey >= k:
+                        raise ValueError
+                    lastkey = k
+                    found = k == key
+                else:
+                    found = i == key
+                    i += 1
+                if found:
+                    break
+                f = self.skip_value(x, f)
+            else:
+                if not x[f : f + 1]:
+                    raise ValueError("stream underflow")
+                raise KeyError(path)
+        return f
+
+    def _decode_column_value(self, x, f, columns, i):
+        c = x[f : f + 1]
+        if c == b"i":
+            v, f = self.decode_int(x, f)
+            if columns[i] is None:
+                columns[i] = array("q")
+            elif not isinstance(columns[i], array):
+                raise ValueError("column mixes integers and byte strings")
+            try:
+                columns[i].append(v)
+            except OverflowError:
+                raise OverflowError("integer field values must fit in 64 bits")
+        elif c.isdigit():
+            start, f = self._string_bounds(x, f)
+            if columns[i] is None:
+                columns[i] = []
+            elif not isinstance(columns[i], list):
+                raise ValueError("column mixes integers and byte strings")
+            columns[i].append(x[start:f])
+        else:
+            raise ValueError("field values must be integers or byte strings")
+        return f
+
+    def bdecode_columns(self, x, path, fields, max_depth=None, numpy=False):
+        """Decode the fields of a list of dicts into one column per field.
+
+        Integer fields become array("q") columns and byte string fields
+        lists of bytes. If numpy is true, they become NumPy int64 and object
+        arrays instead.
+
+        :raises KeyError: if there is no value at path, or a dict in the
+            list lacks one of fields.
+        """
+        if not isinstance(x, bytes):
+            raise TypeError
+        path = tuple(path)
+        _check_path(path)
+        fields = list(fields)
+        for field in fields:
+            if not isinstance(field, bytes):
+                raise TypeError("field names must be bytes")
+        index = {field: i for i, field in enumerate(fields)}
+        if len(index) != len(fields):
+            raise ValueError("duplicate field names")
+        columns = [None] * len(fields)
+        self._max_depth = max_depth
+        self._depth = 0
+        f = self._seek(x, 0, path)
+        if x[f : f + 1] != b"l":
+            raise ValueError("value at path is not a list")
+        if self._max_depth is not None and self._depth >= self._max_depth:
+            raise RecursionError("maximum bencode nesting depth exceeded")
+        self._depth += 1
+        f += 1
+        n = 0
+        while x[f : f + 1] != b"e":
+            if x[f : f + 1] != b"d":
+                raise ValueError("list item is not a dict")
+            if self._max_depth is not None and self._depth >= self._max_depth:
+                raise RecursionError("maximum bencode nesting depth exceeded")
+            self._depth += 1
+            f += 1
+            lastkey = None
+            seen = 0
+            while x[f : f + 1] != b"e":
+                k, f = self.decode_key(x, f)
+                if lastkey is not None and lastkey >= k:
+                    raise ValueError
+                lastkey = k
+                i = index.get(k)
+                if i is None:
+                    f = self.skip_value(x, f)
+                else:
+                    f = self._decode_column_value(x, f, columns, i)
+                    seen += 1
+            if seen != len(fields):
+                for field, column in zip(fields, columns):
+                    if column is None or len(column) == n:
+                        raise KeyError(field)
+            self._depth -= 1
+            f += 1
+            n += 1
+        result = {}
+        for field, column in zip(fields, columns):
+            if column is None:
+                column = array("q")
+            if numpy:
+                import numpy as np
+
+                if isinstance(column, array):
+                    column = np.frombuffer(column, dtype="int64")
+                else:
+                    # The "S" dtype would strip trailing NUL bytes and pad
+                    # every value to the longest one.
+                    column = np.array(column, dtype=object)
+            result[field] = column
+        return result
+
+    def bcanonicalize(self, x, duplicates="error", max_depth=None):
+        """Re-encode x in canonical form.
+
+        Dict keys may be in any order, and numbers and length prefixes may
+        have leading zeros. Keys are sorted and numbers written without
+        leading zeros in the result.
+
+        :param duplicates: what to do with a key that appears more than once
+            in a dict: "error" to raise ValueError, or "first" or "last" to
+            keep that occurrence.
+        """
+        if not isinstance(x, bytes):
+            raise TypeError
+        if duplicates not in ("error", "first", "last"):
+            raise ValueError("duplicates must be 'error', 'first' or 'last'")
+        self._duplicates = duplicates
+        try:
+            return bencode(self._decode(x, max_depth, trusted=True))
+        finally:
+            self._duplicates = "error"
+
+    def bencode_to_json(self, x, binary="base64", lines=False, max_depth=None):
+        """Convert x to JSON.
+
+        Byte strings, including dict keys, become JSON strings if they are
+        valid UTF-8 and are otherwise encoded as binary says.
+
+        :param binary: "base64" or "hex".
+        :param lines: if true, x may hold any number of concatenated values,
+            which are written as JSON Lines.
+        """
+        if not isinstance(x, bytes):
+            raise TypeError
+        if binary not in ("base64", "hex"):
+            raise ValueError("binary must be 'base64' or 'hex'")
+        if not lines:
+            return _json_dumps(self._decode(x, max_depth), binary)
+        self._max_depth = max_depth
+        self._depth = 0
+        out = []
+        f = 0
+        while f < len(x):
+            try:
+                v, f = self.decode_func[x[f : f + 1]](x, f)
+            except (IndexError, KeyError, OverflowError) as e:
+                raise ValueError(str(e))
+            if f > len(x):
+                raise ValueError("stream underflow")
+            out.append(_json_dumps(v, binary) + b"\n")
+        return b"".join(out)
+
+    def bdecode(
+        self,
+        x,
+        max_depth=None,
+        view_threshold=None,
+        trusted=False,
+        max_size=None,
+        max_items=None,
+        max_string_length=None,
+        max_int_digits=None,
+    ):
+        if not isinstance(x, bytes):
+            raise TypeError
+        if max_size is not None and len(x) > max_size:
+            raise ValueError("input is larger than max_size")
+        return self._decode(
+            x,
+            max_depth,
+            view_threshold,
+            trusted=trusted,
+            max_items=max_items,
+            max_string_length=max_string_length,
+            max_int_digits=max_int_digits,
+        )
+
+    def _decode(
+        self,
+        x,
+        max_depth=None,
+        view_threshold=None,
+        start=0,
+        end=None,
+        trusted=False,
+        max_items=None,
+        max_string_length=None,
+        max_int_digits=None,
+    ):
+        """Decode x, which may be bytes or an mmap object.
+
+        :param view_threshold: if not None, byte strings at least this long
+            are returned as read-only memoryview slices of x instead of
+            copies.
+        :param start: offset of the value in x.
+        :param end: offset the value must end at; defaults to the end of x.
+        :param trusted: if true, skip the checks that x is in canonical form
+            (no leading zeros or negative zero, sorted dict keys). Only use
+            this for data known to have been produced by bencode.
+        :param max_items: if not None, the most objects to create, counting
+            dict keys, values and containers.
+        :param max_string_length: if not None, the longest byte string
+            allowed.
+        :param max_int_digits: if not None, the most digits allowed in an
+            integer, not counting a "-".
+        """
+        self._max_depth = max_depth
+        self._depth = 0
+        self._trusted = trusted
+        limited = not (
+            view_threshold is None
+            and max_items is None
+            and max_string_length is None
+            and max_int_digits is None
+        )
+        if limited:
+            decode_func = self.decode_func
+            self._limit(
+                view_threshold, max_items, max_string_length, max_int_digits
+            )
+        try:
+            r, l = self.decode_func[x[start : start + 1]](x, start)  # noqa: E741
+        except (IndexError, KeyError, OverflowError) as e:
+            raise ValueError(str(e))
+        finally:
+            self._view = None
+            self._trusted = False
+            if limited:
+                self._view_threshold = None
+                self.decode_func = decode_func
+                vars(self).pop("decode_key", None)
+                vars(self).pop("_string_bounds", None)
+        if l != (len(x) if end is None else end):  # noqa: E741
+            raise ValueError
         return r
 
 
-_decoder = BDecoder()
-bdecode = _decoder.bdecode
+_MISSING = object()
+
+
+def _json_string(s, binary):
+    try:
+        return s.decode("utf-8")
+    except UnicodeDecodeError:
+        if binary == "hex":
+            return s.hex()
+        return base64.b64encode(s).decode("ascii")
+
+
+def _json_value(x, binary):
+    if isinstance(x, bytes):
+        return _json_string(x, binary)
+    elif isinstance(x, list):
+        return [_json_value(v, binary) for v in x]
+    elif isinstance(x, dict):
+        r = {
+            _json_string(k, binary): _json_value(v, binary)
+            for k, v in x.items()
+        }
+        # A key that is not UTF-8 may have become the same string as
+        # another key.
+        if len(r) != len(x):
+            raise ValueError("dict keys collide once converted to JSON")
+        return r
+    return x
+
+
+def _json_dumps(x, binary):
+    return json.dumps(
+        _json_value(x, binary), ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _too_many_int_digits():
+    return ValueError("integer has more than max_int_digits digits")
+
+
+class _PathNode:
+    """A node in a tree of key paths to decode.
+
+    :ivar children: maps dict keys (bytes) and list indices (int) to the
+        nodes below this one.
+    :ivar targets: indices of the requested paths that end at this node.
+    """
+
+    __slots__ = ["children", "targets"]
+
+    def __init__(self) -> None:
+        self.children = {}
+        self.targets = []
+
+    def insert(self, path, target):
+        _check_path(path)
+        node = self
+        for key in path:
+            node = node.children.setdefault(key, _PathNode())
+        node.targets.append(target)
+
+
+def _check_path(path):
+    """Check the elements of path are dict keys or list indices."""
+    for key in path:
+        if not isinstance(key, (bytes, int)) or isinstance(key, bool):
+            raise TypeError("path elements must be bytes or int")
+        if isinstance(key, int) and key < 0:
+            raise TypeError("list indices in paths must not be negative")
+
+
+def _decoding(name, **options: object):
+    """Return a function calling BDecoder method name on a new decoder.
+
+    Decoders hold state for the call in progress, so each call gets its
+    own rather than sharing one with other threads or earlier calls.
+    """
+    method = getattr(BDecoder, name)
+
+    def decode(*args, **kwargs: object):
+        return method(BDecoder(**options), *args, **kwargs)
+
+    decode.__name__ = name
+    decode.__doc__ = method.__doc__
+    return decode
+
+
+def _sharing(**options: object):
+    """Return a bdecode function that shares a decoder between plain calls.
 
-_tuple_decoder = BDecoder(True)
-bdecode_as_tuple = _tuple_decoder.bdecode
+    A call passing only x leaves no state on the decoder that another call
+    relies on, so those calls skip creating one. Calls with options get a
+    new decoder each, as with _decoding.
+    """
+    shared = BDecoder(**options).bdecode
 
+    def bdecode(x, *args, **kwargs: object):
+        if args or kwargs:
+            return BDecoder(**options).bdecode(x, *args, **kwargs)
+        return shared(x)
+
+    bdecode.__doc__ = BDecoder.bdecode.__doc__
+    return bdecode
+
+
+bdecode = _sharing()
+bdecode_path = _decoding("bdecode_path")
+bdecode_paths = _decoding("bdecode_paths")
+bdecode_with_digests = _decoding("bdecode_with_digests")
+bencode_to_json = _decoding("bencode_to_json")
+bdecode_columns = _decoding("bdecode_columns")
+bdecode_item_offsets = _decoding("bdecode_item_offsets")
+bdecode_as_tuple = _sharing(yield_tuples=True)
+bdecode_keys_utf8 = _sharing(str_keys=True)
+bcanonicalize = _decoding("bcanonicalize", lenient=True)
+bdecode_preserving = _decoding("bdecode", preserve=True)
 _utf8_decoder = BDecoder(bytestring_encoding="utf-8")
-bdecode_utf8 = _utf8_decoder.bdecode
+
+
+def bdecode_utf8(
+    x,
+    max_depth=None,
+    trusted=False,
+    max_size=None,
+    max_items=None,
+    max_string_length=None,
+    max_int_digits=None,
+):
+    """Decode x, returning byte strings as UTF-8 str.
+
+    Unlike bdecode this has no view_threshold, as str values cannot be
+    views of x.
+    """
+    if (
+        max_depth is None
+        and not trusted
+        and max_items is None
+        and max_string_length is None
+        and max_int_digits is None
+    ):
+        decoder = _utf8_decoder
+    else:
+        decoder = BDecoder(bytestring_encoding="utf-8")
+    return decoder.bdecode(
+        x,
+        max_depth,
+        trusted=trusted,
+        max_size=max_size,
+        max_items=max_items,
+        max_string_length=max_string_length,
+        max_int_digits=max_int_digits,
+    )
 
 
 class Bencached:
@@ -141,6 +962,9 @@ class BEncoder:
             dict: self.encode_dict,
             bool: self.encode_bool,
             str: self.encode_str,
+            PreservedList: self.encode_preserved_list,
+            PreservedDict: self.encode_preserved_dict,
+            memoryview: self.encode_memoryview,
         }
 
     def encode_bencached(self, x, r):
@@ -177,6 +1001,24 @@ class BEncoder:
         r.append(b"e")
         self._depth -= 1
 
+    def encode_memoryview(self, x, r):
+        # As returned by bdecode with view_threshold. Casting checks that
+        # the view is contiguous, and makes its length count bytes.
+        self.encode_bytes(x.cast("B"), r)
+
+    def encode_preserved_list(self, x, r):
+        # Containers unchanged since decoding are copied out as they were.
+        if x._raw is not None:
+            r.append(x._raw)
+        else:
+            self.encode_list(x, r)
+
+    def encode_preserved_dict(self, x, r):
+        if x._raw is not None:
+            r.append(x._raw)
+        else:
+            self.encode_dict(x, r)
+
     def encode_str(self, x, r):
         if self.bytestring_encoding is None:
             raise TypeError(
@@ -189,8 +1031,14 @@ class BEncoder:
         self.encode_func[type(x)](x, r)
 
 
+# Ints of this size or more are converted by int_to_decimal.
+_LARGE_INT = 1 << 2000
+
+
 def int_to_bytes(n):
-    return b"%d" % n
+    if -_LARGE_INT < n < _LARGE_INT:
+        return b"%d" % n
+    return int_to_decimal(n)
 
 
 def bencode(x, max_depth=None):
@@ -207,3 +1055,187 @@ def bencode_utf8(x, max_depth=None):
     encoder._max_depth = max_depth
     encoder.encode(x, r)
     return b"".join(r)
+
+
+def bencode_columns(columns):
+    """Bencode a list of dicts from a mapping of field names to columns.
+
+    This is the reverse of bdecode_columns: row i of the output has the
+    i-th value of each column. Columns may be any sequences, including
+    array.array and NumPy arrays.
+    """
+    fields = sorted(columns.items())
+    keys = []
+    values = []
+    for name, column in fields:
+        if not isinstance(name, bytes):
+            raise TypeError("field names must be bytes")
+        keys.append(b"%d:%s" % (len(name), name))
+        # Convert array.array and NumPy values to Python ints and bytes.
+        values.append(column.tolist() if hasattr(column, "tolist") else column)
+    if len({len(column) for column in values}) > 1:
+        raise ValueError("columns differ in length")
+    r = [b"l"]
+    encoder = BEncoder()
+    for row in zip(*values):
+        r.append(b"d")
+        for key, value in zip(keys, row):
+            r.append(key)
+            encoder.encode(value, r)
+        r.append(b"e")
+    r.append(b"e")
+    return b"".join(r)
+
+
+def _map_file(fp):
+    """Map the file behind fp read-only into memory.
+
+    Only regular files are mapped. Other file objects (e.g. pipes, or
+    io.BytesIO) have their remaining contents read instead.
+
+    :return: a tuple of the data and the offset of fp's position in it,
+        or None as the offset if the data was read.
+    """
+    try:
+        fileno = fp.fileno()
+    except (AttributeError, OSError):
+        return (fp.read(), None)
+    st = os.fstat(fileno)
+    if not stat.S_ISREG(st.st_mode):
+        return (fp.read(), None)
+    offset = fp.tell()
+    if st.st_size <= offset:
+        # Empty files cannot be mapped.
+        return (fp.read(), None)
+    return (mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), offset)
+
+
+def bload(fp, max_depth=None, view_threshold=None):
+    """Decode the bencoded value stored in the rest of the file fp.
+
+    Regular files are memory-mapped rather than read, so decoding does not
+    need a copy of the whole file in memory. Either way, fp is left at the
+    end of the file.
+
+    :param view_threshold: if not None, byte strings at least this long
+        are returned as read-only memoryview slices of the mapping rather
+        than copied. The mapping stays alive as long as any view does.
+    """
+    data, offset = _map_file(fp)
+    if offset is None:
+        return BDecoder()._decode(data, max_depth, view_threshold)
+    try:
+        r = BDecoder()._decode(data, max_depth, view_threshold, start=offset)
+        # Leave fp after the value, as reading it would have.
+        fp.seek(len(data))
+        return r
+    finally:
+        try:
+            data.close()
+        except BufferError:
+            # Views were returned, and keep the mapping alive.
+            pass
+
+
+def bdecode_file(path, max_depth=None, view_threshold=None):
+    """Decode the bencoded value stored in the file at path.
+
+    See bload for the meaning of view_threshold.
+    """
+    with open(path, "rb") as fp:
+        return bload(fp, max_depth, view_threshold)
+
+
+def bdump(x, fp, max_depth=None):
+    """Bencode x and write it to the binary file fp in chunks."""
+    r = []
+    encoder = BEncoder()
+    encoder._max_depth = max_depth
+    encoder.encode(x, r)
+    chunk = []
+    size = 0
+    for piece in r:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= WRITE_CHUNK_SIZE:
+            fp.write(b"".join(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        fp.write(b"".join(chunk))
+
+
+def bencode_frame(x, max_depth=None, netstring=False):
+    """Bencode x as a single frame for message transport.
+
+    By default the frame has a 4-byte big-endian length header. If
+    netstring is true, it is framed as a netstring ("<length>:<data>,").
+    """
+    # Leave a slot for the header, filled in once the length is known.
+    r = [b""]
+    encoder = BEncoder()
+    encoder._max_depth = max_depth
+    encoder.encode(x, r)
+    length = sum(map(len, r))
+    if netstring:
+        r[0] = b"%d:" % length
+        r.append(b",")
+    else:
+        try:
+            r[0] = length.to_bytes(FRAME_HEADER_SIZE, "big")
+        except OverflowError:
+            raise OverflowError("frame too large")
+    return b"".join(r)
+
+
+def _frame_bounds(x, pos, netstring):
+    """Locate the payload of the frame at pos.
+
+    :return: the start and end offsets of the payload, or None if the frame
+        is not complete yet.
+    """
+    if not netstring:
+        if len(x) - pos < FRAME_HEADER_SIZE:
+            return None
+        start = pos + FRAME_HEADER_SIZE
+        end = start + int.from_bytes(x[pos:start], "big")
+        if end > len(x):
+            return None
+        return (start, end)
+
+    colon = x.find(b":", pos, pos + MAX_NETSTRING_DIGITS + 1)
+    if colon == -1:
+        if len(x) - pos > MAX_NETSTRING_DIGITS:
+            raise ValueError("netstring length too long")
+        return None
+    digits = x[pos:colon]
+    if not digits.isdigit() or (digits[:1] == b"0" and len(digits) > 1):
+        raise ValueError("invalid netstring length")
+    start = colon + 1
+    end = start + int(digits)
+    if end >= len(x):
+        return None
+    if x[end : end + 1] != b",":
+        raise ValueError('netstring not terminated by ","')
+    return (start, end)
+
+
+def bdecode_frames(x, max_depth=None, netstring=False):
+    """Decode the complete frames at the start of x.
+
+    :return: a tuple of the list of decoded values and the number of bytes
+        of x they took up. Any incomplete frame after them is left for the
+        caller to complete with more data.
+    """
+    if not isinstance(x, bytes):
+        raise TypeError
+    decoder = BDecoder()
+    values = []
+    consumed = 0
+    while True:
+        bounds = _frame_bounds(x, consumed, netstring)
+        if bounds is None:
+            return (values, consumed)
+        start, end = bounds
+        values.append(decoder._decode(x, max_depth, start=start, end=end))
+        consumed = end + 1 if netstring else end
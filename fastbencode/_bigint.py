@@ -0,0 +1,157 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Conversion of very large ints to and from decimal digits.
+
+int() and str() take time quadratic in the number of digits on older
+Pythons. The functions here split numbers in halves instead, which takes
+sub-quadratic time. They are shared by the Python and Rust
+implementations, and apply the interpreter's limit on the number of
+digits (see sys.set_int_max_str_digits) the same way int() and str() do.
+"""
+
+import decimal
+import sys
+
+# CPython does not allow a digit limit lower than this, so shorter numbers
+# never need checking.
+MIN_LIMITED_DIGITS = 640
+
+# Numbers with more digits than this are converted by splitting them.
+SPLIT_DIGITS = 5000
+
+# Roughly SPLIT_DIGITS, in bits.
+SPLIT_BITS = 16600
+
+_LOG10_2 = 0.30102999566398120
+
+
+def _max_str_digits():
+    get_limit = getattr(sys, "get_int_max_str_digits", None)
+    return get_limit() if get_limit is not None else 0
+
+
+def check_decimal_digits(digits):
+    """Check a decimal byte string, with an optional "-", is within the limit.
+
+    This raises the same ValueError as int() would, for callers that copy
+    the digits without converting them.
+    """
+    count = len(digits) - (digits[:1] == b"-")
+    limit = _max_str_digits()
+    if limit and count > limit:
+        raise ValueError(
+            f"Exceeds the limit ({limit} digits) for integer string "
+            f"conversion: value has {count} digits; use "
+            "sys.set_int_max_str_digits() to increase the limit"
+        )
+
+
+def decimal_to_int(digits):
+    """Convert a decimal byte string, with an optional "-", to an int.
+
+    The caller must check that digits is well formed.
+    """
+    check_decimal_digits(digits)
+    negative = digits[:1] == b"-"
+    if negative:
+        digits = digits[1:]
+    if len(digits) <= SPLIT_DIGITS:
+        n = int(digits)
+    else:
+        n = _split_decimal_to_int(digits)
+    return -n if negative else n
+
+
+def _split_decimal_to_int(digits):
+    powers = {}
+
+    def power_of_ten(k):
+        result = powers.get(k)
+        if result is None:
+            result = powers[k] = 10**k
+        return result
+
+    def convert(start, end):
+        if end - start <= SPLIT_DIGITS:
+            return int(digits[start:end])
+        mid = (start + end) // 2
+        return convert(start, mid) * power_of_ten(end - mid) + convert(
+            mid, end
+        )
+
+    return convert(0, len(digits))
+
+
+def int_to_decimal(n):
+    """Convert an int to its decimal representation as bytes."""
+    limit = _max_str_digits()
+    magnitude = abs(n)
+    bits = magnitude.bit_length()
+    # A number of this many bits has more than (bits - 1) * log10(2)
+    # digits, so most numbers over the limit are caught before converting.
+    if limit and (bits - 1) * _LOG10_2 >= limit:
+        raise _too_many_digits(limit)
+    if bits <= SPLIT_BITS:
+        digits = b"%d" % magnitude
+    else:
+        digits = str(_split_int_to_decimal(magnitude, bits)).encode("ascii")
+        if limit and len(digits) > limit:
+            raise _too_many_digits(limit)
+    return b"-" + digits if n < 0 else digits
+
+
+def _too_many_digits(limit):
+    return ValueError(
+        f"Exceeds the limit ({limit} digits) for integer string conversion; "
+        "use sys.set_int_max_str_digits() to increase the limit"
+    )
+
+
+def _split_int_to_decimal(n, bits):
+    # Build a Decimal from the high and low halves of n's bits. Decimal
+    # multiplication of large numbers is sub-quadratic, and converting the
+    # result to a string is linear.
+    D = decimal.Decimal
+    powers = {}
+
+    def power_of_two(w):
+        result = powers.get(w)
+        if result is None:
+            if w <= SPLIT_BITS:
+                result = D(2) ** w
+            else:
+                half = w >> 1
+                result = power_of_two(half) * power_of_two(w - half)
+            powers[w] = result
+        return result
+
+    def convert(n, w):
+        if w <= SPLIT_BITS:
+            return D(n)
+        half = w >> 1
+        high = n >> half
+        low = n - (high << half)
+        return convert(low, half) + convert(high, w - half) * power_of_two(
+            half
+        )
+
+    with decimal.localcontext() as ctx:
+        ctx.prec = decimal.MAX_PREC
+        ctx.Emax = decimal.MAX_EMAX
+        ctx.Emin = decimal.MIN_EMIN
+        ctx.traps[decimal.Inexact] = True
+        return convert(n, bits)
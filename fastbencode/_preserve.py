@@ -0,0 +1,105 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Containers that remember their encoding, as built by bdecode_preserving.
+
+These are shared by the Python and Rust implementations.
+"""
+
+
+def _touch(node):
+    """Mark node and the containers it was decoded inside as modified.
+
+    A modified container always has modified ancestors, so this stops at
+    the first one that was already modified.
+    """
+    while node is not None and node._raw is not None:
+        node._raw = None
+        node = node._parent
+
+
+def _mutator(base, name):
+    method = getattr(base, name)
+
+    def mutate(self, *args, **kwargs: object):
+        _touch(self)
+        return method(self, *args, **kwargs)
+
+    mutate.__name__ = name
+    mutate.__doc__ = method.__doc__
+    return mutate
+
+
+class PreservedList(list):
+    """A list that remembers the bencoded bytes it was decoded from.
+
+    :ivar _raw: a read-only memoryview of the original encoding, or None
+        once this list or anything inside it has been modified.
+    :ivar _parent: the container this list was decoded inside, if any.
+    """
+
+    __slots__ = ["_raw", "_parent"]
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self._raw = None
+        self._parent = None
+
+    def __reduce__(self):
+        # The original encoding is a view that cannot be pickled or copied,
+        # so copies are encoded afresh.
+        return (PreservedList, (list(self),))
+
+    __setitem__ = _mutator(list, "__setitem__")
+    __delitem__ = _mutator(list, "__delitem__")
+    __iadd__ = _mutator(list, "__iadd__")
+    __imul__ = _mutator(list, "__imul__")
+    append = _mutator(list, "append")
+    clear = _mutator(list, "clear")
+    extend = _mutator(list, "extend")
+    insert = _mutator(list, "insert")
+    pop = _mutator(list, "pop")
+    remove = _mutator(list, "remove")
+    reverse = _mutator(list, "reverse")
+    sort = _mutator(list, "sort")
+
+
+class PreservedDict(dict):
+    """A dict that remembers the bencoded bytes it was decoded from.
+
+    :ivar _raw: a read-only memoryview of the original encoding, or None
+        once this dict or anything inside it has been modified.
+    :ivar _parent: the container this dict was decoded inside, if any.
+    """
+
+    __slots__ = ["_raw", "_parent"]
+
+    def __init__(self, *args, **kwargs: object) -> None:
+        super().__init__(*args, **kwargs)
+        self._raw = None
+        self._parent = None
+
+    def __reduce__(self):
+        return (PreservedDict, (dict(self),))
+
+    __setitem__ = _mutator(dict, "__setitem__")
+    __delitem__ = _mutator(dict, "__delitem__")
+    __ior__ = _mutator(dict, "__ior__")
+    clear = _mutator(dict, "clear")
+    pop = _mutator(dict, "pop")
+    popitem = _mutator(dict, "popitem")
+    setdefault = _mutator(dict, "setdefault")
+    update = _mutator(dict, "update")
@@ -0,0 +1,206 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Reading and writing bencoded values over asyncio streams."""
+
+import asyncio
+
+from . import bdecode, bencode
+
+# Amount of data requested from a stream reader at a time.
+READ_CHUNK_SIZE = 1 << 16
+
+# Encoded output larger than this is written in pieces of this size, draining
+# the writer between them.
+WRITE_CHUNK_SIZE = 1 << 16
+
+_DIGITS = frozenset(b"0123456789")
+
+# Longest byte string length prefix we look for the ":" in, in digits.
+_MAX_LENGTH_DIGITS = 20
+
+
+class IncrementalDecoder:
+    """Split a byte stream into bencoded values as data arrives.
+
+    Only value boundaries are found while scanning: the position and
+    container depth are kept between calls to feed, so a value that
+    arrives in many small pieces is never re-scanned from its start.
+    Each complete value is then decoded with a single bdecode call, which
+    also does all validation.
+
+    :param max_size: if not None, the longest encoded value to accept. A
+        value over this raises ValueError as soon as that is known, rather
+        than being buffered.
+    """
+
+    def __init__(self, max_depth=None, max_size=None) -> None:
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._max_depth = max_depth
+        self._max_size = max_size
+        self._needed = 1
+        # Whether the next "e" in the stream is known to be part of the
+        # pending value, which is so inside an integer or a container, but
+        # not inside a byte string.
+        self._to_next_e = False
+
+    def feed(self, data):
+        """Add data to the stream and return the values it completes."""
+        self._buffer += data
+        values = []
+        while True:
+            end = self._scan()
+            if end is None:
+                return values
+            frame = bytes(self._buffer[:end])
+            del self._buffer[:end]
+            values.append(bdecode(frame, max_depth=self._max_depth))
+
+    @property
+    def pending(self):
+        """The bytes of a value that has not yet been completed."""
+        return bytes(self._buffer)
+
+    @property
+    def needed(self):
+        """The fewest further bytes that could complete the pending value.
+
+        Feeding no more than this never takes in data past the end of the
+        value, even though the value may need more.
+        """
+        return self._needed
+
+    def _scan(self):
+        """Scan complete tokens, returning the end of the first value.
+
+        Returns None if more data is needed, in which case the scan resumes
+        from the first incomplete token on the next call.
+        """
+        buf = self._buffer
+        pos = self._pos
+        # Bytes still needed by an incomplete token at pos.
+        partial = 0
+        in_int = in_string = False
+        while pos < len(buf):
+            c = buf[pos]
+            if c == ord("l") or c == ord("d"):
+                self._depth += 1
+                pos += 1
+                continue
+            elif c == ord("e") and self._depth:
+                self._depth -= 1
+                pos += 1
+            elif c == ord("i"):
+                end = buf.find(b"e", pos + 1)
+                if end == -1:
+                    # At least a digit, if there is none yet, and the "e".
+                    partial = 2 if buf[pos + 1 :] in (b"", b"-") else 1
+                    in_int = True
+                    break
+                pos = end + 1
+            elif c in _DIGITS:
+                in_string = True
+                colon = buf.find(b":", pos, pos + _MAX_LENGTH_DIGITS + 1)
+                if colon == -1:
+                    if len(buf) - pos > _MAX_LENGTH_DIGITS:
+                        raise ValueError("invalid length")
+                    # More digits would only make the string longer.
+                    digits = buf[pos:]
+                    partial = 1 + (int(digits) if digits.isdigit() else 0)
+                    break
+                end = colon + 1 + int(buf[pos:colon])
+                if self._max_size is not None and end > self._max_size:
+                    raise ValueError("value is larger than max_size")
+                if end > len(buf):
+                    partial = end - len(buf)
+                    break
+                in_string = False
+                pos = end
+            else:
+                raise ValueError(f"unknown object type identifier {chr(c)!r}")
+            if not self._depth:
+                self._pos = 0
+                self._needed = 1
+                self._to_next_e = False
+                return pos
+        if self._max_size is not None and len(buf) > self._max_size:
+            raise ValueError("value is larger than max_size")
+        self._pos = pos
+        # Each open container still needs its "e".
+        self._needed = max(partial + self._depth, 1)
+        self._to_next_e = not in_string and (in_int or self._depth > 0)
+        return None
+
+
+async def read_value(reader, max_depth=None, max_size=None):
+    """Read a single bencoded value from an asyncio.StreamReader.
+
+    Only the bytes that make up the value are consumed from reader, so
+    this can be freely mixed with other reads. As the reader cannot be
+    looked ahead in, that takes a read for about every "e" and every byte
+    string in the value; use iter_values for a stream of many values.
+
+    :param max_size: if not None, the longest encoded value to accept.
+    :raises asyncio.IncompleteReadError: if the stream ends mid-value.
+    """
+    decoder = IncrementalDecoder(max_depth, max_size)
+    while True:
+        if decoder._to_next_e:
+            try:
+                data = await reader.readuntil(b"e")
+            except asyncio.LimitOverrunError as e:
+                # None of the bytes searched so far is an "e".
+                data = await reader.readexactly(e.consumed)
+        else:
+            data = await reader.readexactly(decoder.needed)
+        values = decoder.feed(data)
+        if values:
+            return values[0]
+
+
+async def iter_values(reader, max_depth=None, max_size=None):
+    """Iterate over the bencoded values read from an asyncio.StreamReader.
+
+    Data is read in large chunks, so the stream should not be read from
+    elsewhere while iterating.
+
+    :param max_size: if not None, the longest encoded value to accept.
+    :raises asyncio.IncompleteReadError: if the stream ends mid-value.
+    """
+    decoder = IncrementalDecoder(max_depth, max_size)
+    while True:
+        data = await reader.read(READ_CHUNK_SIZE)
+        if not data:
+            break
+        for value in decoder.feed(data):
+            yield value
+    if decoder.pending:
+        raise asyncio.IncompleteReadError(decoder.pending, None)
+
+
+async def write_value(writer, x, max_depth=None):
+    """Bencode x and write it to an asyncio.StreamWriter.
+
+    Large outputs are written in chunks, waiting for the writer to drain
+    between them, so the transport's flow control applies to a single big
+    value as well as to many small ones.
+    """
+    view = memoryview(bencode(x, max_depth=max_depth))
+    for start in range(0, len(view), WRITE_CHUNK_SIZE):
+        writer.write(view[start : start + WRITE_CHUNK_SIZE])
+        await writer.drain()
@@ -0,0 +1,208 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Encoding and decoding very large lists and dicts in several processes.
+
+The items of the top-level list or dict are split into chunks that are
+encoded or decoded in a process pool. Encoded bytes are passed between
+processes in shared memory rather than being pickled.
+"""
+
+import bisect
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from multiprocessing import resource_tracker, shared_memory
+
+from . import bdecode, bdecode_item_offsets, bencode
+
+# Input is split into this many chunks per worker, so that workers that
+# finish early can pick up more.
+CHUNKS_PER_WORKER = 4
+
+# Decoding input smaller than this is not worth spreading over processes.
+MIN_DECODE_SIZE = 1 << 20
+
+# Encoding fewer items than this is not worth spreading over processes.
+MIN_ENCODE_ITEMS = 1 << 12
+
+# Windows frees a shared memory block as soon as no process has it open, so
+# there workers return encoded chunks as bytes instead.
+_SHARE_OUTPUT = os.name == "posix"
+
+
+def bdecode_parallel(x, workers=None, max_depth=None, executor=None):
+    """Decode a bencoded list or dict, splitting its items over processes.
+
+    The whole input is checked in this process first, without building
+    any objects. It is then copied into shared memory once, and chunks of
+    its items are decoded by the workers and joined up here.
+
+    :param workers: number of worker processes; defaults to the number of
+        CPUs.
+    :param executor: a concurrent.futures.ProcessPoolExecutor to use
+        instead of starting new worker processes. Its workers must not
+        have been started before the first call to this module.
+    """
+    if not isinstance(x, bytes):
+        raise TypeError
+    workers = workers or os.cpu_count() or 1
+    if (
+        (x[:1] != b"l" and x[:1] != b"d")
+        or workers == 1
+        or len(x) < MIN_DECODE_SIZE
+    ):
+        return bdecode(x, max_depth=max_depth)
+    offsets = bdecode_item_offsets(x, max_depth=max_depth)
+    if len(offsets) < 3:
+        return bdecode(x, max_depth=max_depth, trusted=True)
+    # Split the items into chunks of about the same encoded size.
+    chunks = min(workers * CHUNKS_PER_WORKER, len(offsets) - 1)
+    bounds = [offsets[0]]
+    for i in range(1, chunks):
+        target = offsets[0] + (offsets[-1] - offsets[0]) * i // chunks
+        bound = offsets[bisect.bisect_left(offsets, target)]
+        if bound > bounds[-1]:
+            bounds.append(bound)
+    bounds.append(offsets[-1])
+    kind = x[:1]
+    shm = shared_memory.SharedMemory(create=True, size=len(x))
+    try:
+        shm.buf[: len(x)] = x
+        tasks = [
+            (shm.name, kind, start, end, max_depth)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        with _pool(workers, executor) as pool:
+            parts = list(pool.map(_decode_chunk, tasks))
+        if kind == b"l":
+            result = []
+            for part in parts:
+                result.extend(part)
+        else:
+            result = {}
+            for part in parts:
+                result.update(part)
+    finally:
+        shm.close()
+        shm.unlink()
+    return result
+
+
+def bencode_parallel(x, workers=None, max_depth=None, executor=None):
+    """Bencode a list or dict, splitting its items over processes.
+
+    Chunks of the items are pickled to the workers, which return their
+    encoded bytes in shared memory to be joined up here. Dict items are
+    sorted before being split, so the result is the same as from bencode.
+
+    :param workers: number of worker processes; defaults to the number of
+        CPUs.
+    :param executor: a concurrent.futures.ProcessPoolExecutor to use
+        instead of starting new worker processes. Its workers must not
+        have been started before the first call to this module.
+    """
+    workers = workers or os.cpu_count() or 1
+    if (
+        type(x) not in (list, tuple, dict)
+        or workers == 1
+        or len(x) < MIN_ENCODE_ITEMS
+    ):
+        return bencode(x, max_depth=max_depth)
+    if isinstance(x, dict):
+        for k in x:
+            if not isinstance(k, bytes):
+                raise TypeError("dict keys must be bytes")
+        kind = b"d"
+        items = sorted(x.items(), key=lambda item: item[0])
+    else:
+        kind = b"l"
+        items = x
+    size = -(-len(items) // (workers * CHUNKS_PER_WORKER))
+    with _pool(workers, executor) as pool:
+        futures = [
+            pool.submit(_encode_chunk, (kind, items[i : i + size], max_depth))
+            for i in range(0, len(items), size)
+        ]
+        wait(futures)
+    # Take charge of every block that was written before raising any error,
+    # so that none are left behind.
+    blocks = []
+    parts = []
+    try:
+        for future in futures:
+            if future.exception() is not None:
+                continue
+            result = future.result()
+            if isinstance(result, bytes):
+                part = memoryview(result)
+            else:
+                block = shared_memory.SharedMemory(name=result)
+                blocks.append(block)
+                size = int.from_bytes(block.buf[:8], "little")
+                part = block.buf[8 : 8 + size]
+            # Leave out the "l" or "d" and "e" around each chunk.
+            parts.append(part[1:-1])
+            part.release()
+        for future in futures:
+            future.result()
+        return b"".join([kind, *parts, b"e"])
+    finally:
+        for part in parts:
+            part.release()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def _pool(workers, executor):
+    if _SHARE_OUTPUT:
+        # Workers must share our resource tracker. Otherwise each starts its
+        # own, which removes the blocks the worker used when it exits.
+        resource_tracker.ensure_running()
+    if executor is not None:
+        return nullcontext(executor)
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _decode_chunk(task):
+    name, kind, start, end, max_depth = task
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        with shm.buf[start:end] as items:
+            # The input was checked before being split up.
+            data = b"".join((kind, items, b"e"))
+    finally:
+        shm.close()
+    return bdecode(data, max_depth=max_depth, trusted=True)
+
+
+def _encode_chunk(task):
+    kind, items, max_depth = task
+    data = bencode(
+        dict(items) if kind == b"d" else list(items), max_depth=max_depth
+    )
+    if not _SHARE_OUTPUT:
+        return data
+    # Shared memory blocks may be rounded up in size, so the length of the
+    # data is stored in front of it.
+    shm = shared_memory.SharedMemory(create=True, size=len(data) + 8)
+    try:
+        shm.buf[:8] = len(data).to_bytes(8, "little")
+        shm.buf[8 : 8 + len(data)] = data
+    finally:
+        shm.close()
+    return shm.name
@@ -1,7 +1,32 @@
 #![allow(non_snake_case)]
-use pyo3::exceptions::{PyRecursionError, PyTypeError, PyValueError};
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::{
+    PyAttributeError, PyBufferError, PyKeyError, PyOSError, PyOverflowError, PyRecursionError,
+    PyTypeError, PyUnicodeDecodeError, PyValueError,
+};
 use pyo3::prelude::*;
-use pyo3::types::{PyBytes, PyDict, PyInt, PyList, PyString, PyTuple};
+use pyo3::types::{
+    PyBool, PyBytes, PyDict, PyInt, PyList, PyMemoryView, PySlice, PyString, PyTuple,
+};
+use std::io::Write;
+
+// Encoded output is handed to file objects in pieces of this size, so
+// bdump never needs a second full copy of the output as a bytes object.
+const WRITE_CHUNK_SIZE: usize = 1 << 20;
+
+// Size of the big-endian length header of a length-prefixed frame.
+const FRAME_HEADER_SIZE: usize = 4;
+
+// Longest netstring length prefix we accept, in digits.
+const MAX_NETSTRING_DIGITS: usize = 20;
+
+// Longest byte string length prefix we look for the ':' in, in digits. This
+// is enough for any usize.
+const MAX_LENGTH_DIGITS: usize = 20;
+
+// Integers with at most this many digits are never subject to the
+// interpreter's int max_str_digits limit. See fastbencode/_bigint.py.
+const MIN_LIMITED_DIGITS: usize = 640;
 
 #[pyclass]
 struct Bencached {
@@ -21,13 +46,76 @@ impl Bencached {
     }
 }
 
+// The codec byte strings are decoded with, looked up once per Decoder.
+enum Encoding {
+    // Decoded straight from the input, without an intermediate bytes object.
+    Utf8,
+    Other(std::ffi::CString),
+}
+
+impl Encoding {
+    fn new(name: String) -> PyResult<Self> {
+        let normalized = name.to_ascii_lowercase().replace('_', "-");
+        if normalized == "utf-8" || normalized == "utf8" {
+            return Ok(Encoding::Utf8);
+        }
+        std::ffi::CString::new(name)
+            .map(Encoding::Other)
+            .map_err(|_| PyValueError::new_err("invalid encoding string"))
+    }
+}
+
+// Decode UTF-8 straight from data, failing as bytes.decode() would.
+fn utf8_str<'a>(py: Python<'_>, data: &'a [u8]) -> PyResult<&'a str> {
+    std::str::from_utf8(data).map_err(|e| match PyUnicodeDecodeError::new_utf8(py, data, e) {
+        Ok(exc) => PyErr::from_value(exc.into_any()),
+        Err(err) => err,
+    })
+}
+
+// Limits on the resources used to decode untrusted input. None means no
+// limit.
+#[derive(Default, Clone, Copy)]
+struct Limits {
+    // Size of the input, in bytes.
+    max_size: Option<usize>,
+    // Number of objects created, counting dict keys, values and containers.
+    max_items: Option<usize>,
+    // Length of each byte string, in bytes.
+    max_string_length: Option<usize>,
+    // Number of digits of each integer, not counting a '-'.
+    max_int_digits: Option<usize>,
+}
+
 #[pyclass]
 struct Decoder {
-    data: Vec<u8>,
+    // The object being decoded and a buffer export over it. Holding the
+    // export lets us read bytes, mmap objects etc. in place without copying.
+    source: Py<PyAny>,
+    buffer: PyBuffer<u8>,
     position: usize,
     yield_tuples: bool,
-    bytestring_encoding: Option<String>,
+    bytestring_encoding: Option<Encoding>,
+    // Decode dict keys as interned UTF-8 str, leaving values as bytes.
+    str_keys: bool,
     max_depth: Option<usize>,
+    // Number of containers entered outside of decode_object and skip_value,
+    // counted towards max_depth.
+    depth: usize,
+    // Byte strings at least this long are returned as read-only memoryview
+    // slices of the source rather than copied into new bytes objects.
+    view_threshold: Option<usize>,
+    view: Option<Py<PyAny>>,
+    spans: Option<SpanTracker>,
+    // Skip the canonical form checks (leading zeros, negative zero and dict
+    // key order) for input we produced ourselves.
+    trusted: bool,
+    // The PreservedList and PreservedDict types, when containers are to
+    // remember their original encoding.
+    preserve: Option<(Py<PyAny>, Py<PyAny>)>,
+    limits: Limits,
+    // Number of objects created so far, counted towards limits.max_items.
+    items: usize,
 }
 
 // A container being built up during iterative decoding.
@@ -36,10 +124,369 @@ enum Frame<'py> {
     Dict {
         dict: Bound<'py, PyDict>,
         pending_key: Option<Bound<'py, PyAny>>,
-        last_key: Option<Vec<u8>>,
+        // Bounds of the previous key in the input, for checking key order.
+        last_key: Option<(usize, usize)>,
     },
 }
 
+// A container being skipped over by Decoder::skip_value.
+enum SkipFrame {
+    List,
+    Dict {
+        awaiting_value: bool,
+        last_key: Option<(usize, usize)>,
+    },
+}
+
+// A value scanned by Decoder::canonical_nodes, referring to the input
+// rather than holding Python objects. Children are indices of other nodes.
+enum Node {
+    // Bounds of the digits.
+    Int(usize, usize),
+    // Bounds of the contents.
+    Bytes(usize, usize),
+    List(Vec<usize>),
+    // Bounds of each key and its value.
+    Dict(Vec<((usize, usize), usize)>),
+}
+
+// What bcanonicalize does with a key that appears more than once in a dict.
+#[derive(Clone, Copy)]
+enum Duplicates {
+    Error,
+    First,
+    Last,
+}
+
+impl Duplicates {
+    fn new(policy: &str) -> PyResult<Self> {
+        match policy {
+            "error" => Ok(Duplicates::Error),
+            "first" => Ok(Duplicates::First),
+            "last" => Ok(Duplicates::Last),
+            _ => Err(PyValueError::new_err(
+                "duplicates must be 'error', 'first' or 'last'",
+            )),
+        }
+    }
+}
+
+// Sort dict entries by key, keeping the entries for repeated keys that
+// duplicates asks for.
+fn sort_entries(
+    data: &[u8],
+    entries: &mut Vec<((usize, usize), usize)>,
+    duplicates: Duplicates,
+) -> PyResult<()> {
+    let key = |&((start, end), _): &((usize, usize), usize)| &data[start..end];
+    // The sort is stable, so repeated keys stay in input order.
+    entries.sort_by(|a, b| key(a).cmp(key(b)));
+    let mut repeated = false;
+    entries.dedup_by(|later, earlier| {
+        if key(later) != key(earlier) {
+            return false;
+        }
+        match duplicates {
+            Duplicates::Error => repeated = true,
+            Duplicates::First => {}
+            Duplicates::Last => earlier.1 = later.1,
+        }
+        true
+    });
+    if repeated {
+        return Err(PyValueError::new_err("duplicate dict key"));
+    }
+    Ok(())
+}
+
+// Write an integer with the given digits in canonical form, without
+// leading zeros or a negative zero.
+fn write_canonical_int(digits: &[u8], out: &mut Vec<u8>) {
+    let (negative, magnitude) = match digits.strip_prefix(b"-") {
+        Some(magnitude) => (true, magnitude),
+        None => (false, digits),
+    };
+    out.push(b'i');
+    match magnitude.iter().position(|&b| b != b'0') {
+        Some(first) => {
+            if negative {
+                out.push(b'-');
+            }
+            out.extend_from_slice(&magnitude[first..]);
+        }
+        None => out.push(b'0'),
+    }
+    out.push(b'e');
+}
+
+fn write_string(contents: &[u8], out: &mut Vec<u8>) {
+    write!(out, "{}:", contents.len()).unwrap();
+    out.extend_from_slice(contents);
+}
+
+// How bencode_to_json writes byte strings that are not valid UTF-8.
+#[derive(Clone, Copy)]
+enum Binary {
+    Base64,
+    Hex,
+}
+
+impl Binary {
+    fn new(policy: &str) -> PyResult<Self> {
+        match policy {
+            "base64" => Ok(Binary::Base64),
+            "hex" => Ok(Binary::Hex),
+            _ => Err(PyValueError::new_err("binary must be 'base64' or 'hex'")),
+        }
+    }
+
+    fn write(self, contents: &[u8], out: &mut Vec<u8>) {
+        match self {
+            Binary::Base64 => write_base64(contents, out),
+            Binary::Hex => write_hex(contents, out),
+        }
+    }
+}
+
+// A container being transcoded by Decoder::write_json.
+enum JsonFrame {
+    List,
+    Dict {
+        awaiting_value: bool,
+        last_key: Option<(usize, usize)>,
+        // Offset of the first key, and the keys that are not valid UTF-8.
+        start: usize,
+        binary_keys: Vec<(usize, usize)>,
+    },
+}
+
+const BASE64_ALPHABET: &[u8; 64] =
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+
+fn write_base64(contents: &[u8], out: &mut Vec<u8>) {
+    for chunk in contents.chunks(3) {
+        let n = chunk
+            .iter()
+            .enumerate()
+            .fold(0u32, |n, (i, &b)| n | ((b as u32) << (16 - 8 * i)));
+        for i in 0..4 {
+            if i <= chunk.len() {
+                out.push(BASE64_ALPHABET[((n >> (18 - 6 * i)) & 0x3f) as usize]);
+            } else {
+                out.push(b'=');
+            }
+        }
+    }
+}
+
+fn write_hex(contents: &[u8], out: &mut Vec<u8>) {
+    const DIGITS: &[u8; 16] = b"0123456789abcdef";
+    for &b in contents {
+        out.push(DIGITS[(b >> 4) as usize]);
+        out.push(DIGITS[(b & 0xf) as usize]);
+    }
+}
+
+// Write a byte string as a JSON string, escaped as json.dumps does with
+// ensure_ascii=False. Byte strings that are not valid UTF-8 are written
+// according to binary instead.
+fn write_json_string(contents: &[u8], binary: Binary, out: &mut Vec<u8>) {
+    out.push(b'"');
+    if std::str::from_utf8(contents).is_err() {
+        binary.write(contents, out);
+    } else {
+        let mut rest = contents;
+        while let Some(i) = rest
+            .iter()
+            .position(|&b| b < 0x20 || b == b'"' || b == b'\\')
+        {
+            out.extend_from_slice(&rest[..i]);
+            match rest[i] {
+                b'"' => out.extend_from_slice(b"\\\""),
+                b'\\' => out.extend_from_slice(b"\\\\"),
+                b'\n' => out.extend_from_slice(b"\\n"),
+                b'\r' => out.extend_from_slice(b"\\r"),
+                b'\t' => out.extend_from_slice(b"\\t"),
+                0x08 => out.extend_from_slice(b"\\b"),
+                0x0c => out.extend_from_slice(b"\\f"),
+                b => write!(out, "\\u{:04x}", b).unwrap(),
+            }
+            rest = &rest[i + 1..];
+        }
+        out.extend_from_slice(rest);
+    }
+    out.push(b'"');
+}
+
+// An element of a path into a decoded value: a dict key or a list index.
+#[derive(PartialEq)]
+enum PathKey {
+    Key(Vec<u8>),
+    Index(usize),
+}
+
+// Convert a Python sequence of bytes keys and int indices to a path.
+fn extract_path(path: &Bound<PyAny>) -> PyResult<Vec<PathKey>> {
+    path.try_iter()?
+        .map(|item| {
+            let item = item?;
+            if let Ok(key) = item.extract::<Bound<PyBytes>>() {
+                Ok(PathKey::Key(key.as_bytes().to_vec()))
+            } else if item.is_instance_of::<PyInt>() && !item.is_instance_of::<PyBool>() {
+                item.extract::<usize>()
+                    .map(PathKey::Index)
+                    .map_err(|_| PyTypeError::new_err("list indices in paths must not be negative"))
+            } else {
+                Err(PyTypeError::new_err("path elements must be bytes or int"))
+            }
+        })
+        .collect()
+}
+
+// A tree of requested paths into a value, stored as a flat list of nodes
+// so that they can be referred to by index. Node 0 is the root.
+struct PathTree {
+    nodes: Vec<PathNode>,
+}
+
+#[derive(Default)]
+struct PathNode {
+    children: Vec<(PathKey, usize)>,
+    // Indices of the requested paths that end at this node.
+    targets: Vec<usize>,
+}
+
+impl PathTree {
+    // Build a tree from a Python iterable of paths, also returning each
+    // path as a tuple for use in error messages.
+    fn from_paths<'py>(
+        py: Python<'py>,
+        paths: &Bound<'py, PyAny>,
+    ) -> PyResult<(Self, Vec<Bound<'py, PyTuple>>)> {
+        let mut tree = PathTree {
+            nodes: vec![PathNode::default()],
+        };
+        let mut path_objs = Vec::new();
+        for path in paths.try_iter()? {
+            let path = PyTuple::new(py, path?.try_iter()?.collect::<PyResult<Vec<_>>>()?)?;
+            tree.insert(extract_path(path.as_any())?, path_objs.len());
+            path_objs.push(path);
+        }
+        Ok((tree, path_objs))
+    }
+
+    fn insert(&mut self, path: Vec<PathKey>, target: usize) {
+        let mut node = 0;
+        for key in path {
+            let existing = self.nodes[node]
+                .children
+                .iter()
+                .find(|(k, _)| *k == key)
+                .map(|&(_, child)| child);
+            node = match existing {
+                Some(child) => child,
+                None => {
+                    let child = self.nodes.len();
+                    self.nodes.push(PathNode::default());
+                    self.nodes[node].children.push((key, child));
+                    child
+                }
+            };
+        }
+        self.nodes[node].targets.push(target);
+    }
+
+    fn child(&self, node: usize, matches: impl Fn(&PathKey) -> bool) -> Option<usize> {
+        self.nodes[node]
+            .children
+            .iter()
+            .find(|(k, _)| matches(k))
+            .map(|&(_, child)| child)
+    }
+}
+
+// A column of field values built by Decoder::decode_columns. Its type is
+// set by the first value.
+enum Column<'py> {
+    Empty,
+    Ints(Vec<i64>),
+    Bytes(Vec<Bound<'py, PyAny>>),
+}
+
+// Raw spans of the values at requested paths, recorded by
+// Decoder::decode_object as it goes.
+struct SpanTracker {
+    tree: PathTree,
+    spans: Vec<Option<(usize, usize)>>,
+}
+
+// The path tree node of the next value in the innermost container on stack,
+// given the nodes of the containers on it.
+fn span_node(
+    tree: &PathTree,
+    data: &[u8],
+    stack: &[Frame<'_>],
+    nodes: &[(Option<usize>, usize)],
+) -> Option<usize> {
+    let parent = match nodes.last() {
+        None => return Some(0),
+        Some(&(parent, _)) => parent?,
+    };
+    match stack.last()? {
+        Frame::List(items) => tree.child(parent, |k| *k == PathKey::Index(items.len())),
+        // The next value is a key rather than a value on a path.
+        Frame::Dict {
+            pending_key: None, ..
+        } => None,
+        Frame::Dict { last_key, .. } => {
+            let (start, end) = (*last_key)?;
+            let key = &data[start..end];
+            tree.child(
+                parent,
+                |k| matches!(k, PathKey::Key(name) if name.as_slice() == key),
+            )
+        }
+    }
+}
+
+// Import the container types built by bdecode_preserving, which are shared
+// with the Python implementation.
+fn preserved_types(py: Python<'_>) -> PyResult<(Bound<'_, PyAny>, Bound<'_, PyAny>)> {
+    let module = py.import("fastbencode._preserve")?;
+    Ok((
+        module.getattr("PreservedList")?,
+        module.getattr("PreservedDict")?,
+    ))
+}
+
+// Push a newly opened preserved container and where it starts onto stack,
+// linking it to the container it is inside so that changes to it can be
+// propagated upwards.
+fn open_preserved<'py>(
+    stack: &mut Vec<(Bound<'py, PyAny>, usize)>,
+    container: Bound<'py, PyAny>,
+    start: usize,
+) -> PyResult<()> {
+    if let Some((parent, _)) = stack.last() {
+        container.setattr("_parent", parent)?;
+    }
+    stack.push((container, start));
+    Ok(())
+}
+
+fn too_many_int_digits() -> PyErr {
+    PyValueError::new_err("integer has more than max_int_digits digits")
+}
+
+// View the contents of a contiguous buffer export as a byte slice.
+fn buffer_bytes(buffer: &PyBuffer<u8>) -> &[u8] {
+    let len = buffer.len_bytes();
+    if len == 0 {
+        return &[];
+    }
+    unsafe { std::slice::from_raw_parts(buffer.buf_ptr() as *const u8, len) }
+}
+
 impl<'py> Frame<'py> {
     fn into_value(self, py: Python<'py>, yield_tuples: bool) -> PyResult<Bound<'py, PyAny>> {
         match self {
@@ -58,25 +505,41 @@ impl<'py> Frame<'py> {
 #[pymethods]
 impl Decoder {
     #[new]
-    #[pyo3(signature = (s, yield_tuples=None, bytestring_encoding=None, max_depth=None))]
+    #[pyo3(signature = (s, yield_tuples=None, bytestring_encoding=None, max_depth=None, view_threshold=None, trusted=false))]
     fn new(
-        s: &Bound<PyBytes>,
+        s: &Bound<PyAny>,
         yield_tuples: Option<bool>,
         bytestring_encoding: Option<String>,
         max_depth: Option<usize>,
-    ) -> Self {
-        Decoder {
-            data: s.as_bytes().to_vec(),
+        view_threshold: Option<usize>,
+        trusted: bool,
+    ) -> PyResult<Self> {
+        let buffer = PyBuffer::<u8>::get(s)?;
+        if !buffer.is_c_contiguous() {
+            return Err(PyTypeError::new_err("buffer is not contiguous"));
+        }
+        Ok(Decoder {
+            source: s.clone().unbind(),
+            buffer,
             position: 0,
             yield_tuples: yield_tuples.unwrap_or(false),
-            bytestring_encoding,
+            bytestring_encoding: bytestring_encoding.map(Encoding::new).transpose()?,
+            str_keys: false,
             max_depth,
-        }
+            depth: 0,
+            view_threshold,
+            view: None,
+            spans: None,
+            trusted,
+            preserve: None,
+            limits: Limits::default(),
+            items: 0,
+        })
     }
 
     fn decode<'py>(&mut self, py: Python<'py>) -> PyResult<Bound<'py, PyAny>> {
         let result = self.decode_object(py)?;
-        if self.position < self.data.len() {
+        if self.position < self.data().len() {
             return Err(PyValueError::new_err("junk in stream"));
         }
         Ok(result)
@@ -87,13 +550,19 @@ impl Decoder {
     // overflowing the native stack.
     fn decode_object<'py>(&mut self, py: Python<'py>) -> PyResult<Bound<'py, PyAny>> {
         let mut stack: Vec<Frame<'py>> = Vec::new();
+        // When recording spans, the path tree node and start of each
+        // container on the stack.
+        let mut span_nodes: Vec<(Option<usize>, usize)> = Vec::new();
+        // When preserving, the container object and start of each container
+        // on the stack.
+        let mut preserved: Vec<(Bound<'py, PyAny>, usize)> = Vec::new();
 
         loop {
-            if self.position >= self.data.len() {
+            if self.position >= self.data().len() {
                 return Err(PyValueError::new_err("stream underflow"));
             }
 
-            let next_byte = self.data[self.position];
+            let next_byte = self.data()[self.position];
 
             // When the innermost container is a dict awaiting a key, that key
             // must be a simple byte string. A dict awaiting a value must not
@@ -111,13 +580,37 @@ impl Decoder {
                 }
             }
 
+            if next_byte != b'e' {
+                if let Some(max_items) = self.limits.max_items {
+                    self.items += 1;
+                    if self.items > max_items {
+                        return Err(PyValueError::new_err("more than max_items objects"));
+                    }
+                }
+            }
+
+            // Find the path tree node of a value starting here, if its span
+            // is to be recorded.
+            let value_start = self.position;
+            let value_node = match &self.spans {
+                Some(tracker) if next_byte != b'e' => {
+                    span_node(&tracker.tree, self.data(), &stack, &span_nodes)
+                }
+                _ => None,
+            };
+
             // A closing 'e' finishes the innermost container; anything else
             // produces a value that we then attach to the enclosing container.
             let value = if next_byte == b'e' {
                 match stack.pop() {
                     Some(frame) => {
                         self.position += 1;
-                        frame.into_value(py, self.yield_tuples)?
+                        match preserved.pop() {
+                            Some((container, start)) => {
+                                self.finish_preserved(py, frame, container, start)?
+                            }
+                            None => frame.into_value(py, self.yield_tuples)?,
+                        }
                     }
                     None => {
                         return Err(PyValueError::new_err(format!(
@@ -128,37 +621,77 @@ impl Decoder {
                 }
             } else {
                 match next_byte {
-                    b'0'..=b'9' => self.decode_bytes(py)?,
+                    b'0'..=b'9' => {
+                        if let Some(Frame::Dict {
+                            pending_key,
+                            last_key,
+                            ..
+                        }) = stack.last_mut().filter(|frame| {
+                            matches!(
+                                frame,
+                                Frame::Dict {
+                                    pending_key: None,
+                                    ..
+                                }
+                            )
+                        }) {
+                            // This is a dict key. Its order is checked against
+                            // the previous key in place in the input, and it
+                            // is always materialised, never a view.
+                            let (start, end) = self.string_bounds()?;
+                            if let (false, Some((last_start, last_end))) = (self.trusted, *last_key)
+                            {
+                                let data = self.data();
+                                if data[last_start..last_end] >= data[start..end] {
+                                    return Err(PyValueError::new_err("dict keys disordered"));
+                                }
+                            }
+                            *last_key = Some((start, end));
+                            *pending_key = Some(self.key_object(py, start, end)?);
+                            continue;
+                        }
+                        self.decode_bytes(py, true)?
+                    }
                     b'i' => {
                         self.position += 1;
                         self.decode_int(py)?
                     }
                     b'l' => {
-                        if let Some(max) = self.max_depth {
-                            if stack.len() >= max {
-                                return Err(PyRecursionError::new_err(
-                                    "maximum bencode nesting depth exceeded",
-                                ));
-                            }
-                        }
+                        self.check_depth(stack.len())?;
                         self.position += 1;
                         stack.push(Frame::List(Vec::new()));
+                        if self.spans.is_some() {
+                            span_nodes.push((value_node, value_start));
+                        }
+                        if let Some((list_type, _)) = &self.preserve {
+                            open_preserved(
+                                &mut preserved,
+                                list_type.bind(py).call0()?,
+                                value_start,
+                            )?;
+                        }
                         continue;
                     }
                     b'd' => {
-                        if let Some(max) = self.max_depth {
-                            if stack.len() >= max {
-                                return Err(PyRecursionError::new_err(
-                                    "maximum bencode nesting depth exceeded",
-                                ));
-                            }
-                        }
+                        self.check_depth(stack.len())?;
                         self.position += 1;
+                        let dict = match &self.preserve {
+                            Some((_, dict_type)) => {
+                                let container = dict_type.bind(py).call0()?;
+                                let dict = container.extract::<Bound<PyDict>>()?;
+                                open_preserved(&mut preserved, container, value_start)?;
+                                dict
+                            }
+                            None => PyDict::new(py),
+                        };
                         stack.push(Frame::Dict {
-                            dict: PyDict::new(py),
+                            dict,
                             pending_key: None,
                             last_key: None,
                         });
+                        if self.spans.is_some() {
+                            span_nodes.push((value_node, value_start));
+                        }
                         continue;
                     }
                     _ => {
@@ -170,149 +703,954 @@ impl Decoder {
                 }
             };
 
-            match stack.last_mut() {
-                None => return Ok(value),
-                Some(Frame::List(items)) => items.push(value),
-                Some(Frame::Dict {
-                    pending_key,
-                    last_key,
-                    ..
-                }) => {
-                    if pending_key.is_none() {
-                        // This value is a key; it must be a byte string.
-                        let key_bytes = self.key_bytes(&value)?;
-                        if let Some(last) = last_key {
-                            if *last >= key_bytes {
+            if self.spans.is_some() {
+                let (node, start) = if next_byte == b'e' {
+                    span_nodes.pop().unwrap()
+                } else {
+                    (value_node, value_start)
+                };
+                self.record_span(node, start);
+            }
+
+            match stack.last_mut() {
+                None => return Ok(value),
+                Some(Frame::List(items)) => items.push(value),
+                Some(Frame::Dict {
+                    dict, pending_key, ..
+                }) => {
+                    // Keys are handled as they are read, so this is a value.
+                    let key = pending_key.take().unwrap();
+                    dict.set_item(key, value)?;
+                }
+            }
+        }
+    }
+
+    fn decode_int<'py>(&mut self, py: Python<'py>) -> PyResult<Bound<'py, PyAny>> {
+        let (start, end) = self.int_bounds()?;
+        // int_bounds has checked these are ASCII digits.
+        let digits = std::str::from_utf8(&self.data()[start..end]).unwrap();
+
+        // Parse integers of up to 128 bits natively, which covers 64-bit
+        // counters and 128-bit IDs.
+        if let Ok(n) = digits.parse::<i64>() {
+            return Ok(n.into_pyobject(py)?.into_any());
+        }
+        if let Ok(n) = digits.parse::<i128>() {
+            return Ok(n.into_pyobject(py)?.into_any());
+        }
+        if let Ok(n) = digits.parse::<u128>() {
+            return Ok(n.into_pyobject(py)?.into_any());
+        }
+        if digits.trim_start_matches('-').len() <= MIN_LIMITED_DIGITS {
+            let int_type = py.get_type::<PyInt>();
+            return int_type.call1((PyString::new(py, digits),));
+        }
+        // Very large integers are split up for sub-quadratic conversion,
+        // subject to the interpreter's int max_str_digits limit.
+        py.import("fastbencode._bigint")?
+            .getattr("decimal_to_int")?
+            .call1((PyBytes::new(py, digits.as_bytes()),))
+    }
+
+    fn decode_bytes<'py>(
+        &mut self,
+        py: Python<'py>,
+        allow_view: bool,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        let (start, end) = self.string_bounds()?;
+        self.string_object(py, start, end, allow_view)
+    }
+}
+
+impl Decoder {
+    // Apply limits to the rest of decoding. The input size is checked
+    // straight away.
+    fn set_limits(&mut self, limits: Limits) -> PyResult<()> {
+        if let Some(max_size) = limits.max_size {
+            if self.data().len() > max_size {
+                return Err(PyValueError::new_err("input is larger than max_size"));
+            }
+        }
+        self.limits = limits;
+        Ok(())
+    }
+
+    // Build the value of the byte string with contents data[start..end].
+    fn string_object<'py>(
+        &mut self,
+        py: Python<'py>,
+        start: usize,
+        end: usize,
+        allow_view: bool,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        if allow_view && self.bytestring_encoding.is_none() {
+            if let Some(threshold) = self.view_threshold {
+                if end - start >= threshold {
+                    return self.view_slice(py, start, end);
+                }
+            }
+        }
+
+        let bytes_slice = &self.data()[start..end];
+        match &self.bytestring_encoding {
+            None => Ok(PyBytes::new(py, bytes_slice).into_any()),
+            Some(Encoding::Utf8) => Ok(PyString::new(py, utf8_str(py, bytes_slice)?).into_any()),
+            Some(Encoding::Other(encoding)) => {
+                let bytes_obj = PyBytes::new(py, bytes_slice).into_any();
+                Ok(PyString::from_encoded_object(
+                    &bytes_obj,
+                    Some(encoding.as_c_str()),
+                    Some(c"strict"),
+                )?
+                .into_any())
+            }
+        }
+    }
+
+    // Build the dict key with contents data[start..end]. Keys are never
+    // views.
+    fn key_object<'py>(
+        &mut self,
+        py: Python<'py>,
+        start: usize,
+        end: usize,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        if self.str_keys {
+            let key = utf8_str(py, &self.data()[start..end])?;
+            return Ok(PyString::intern(py, key).into_any());
+        }
+        self.string_object(py, start, end, false)
+    }
+
+    // Scan the digits of an integer, with the position just past the 'i',
+    // checking they are in canonical form unless trusted. Returns the bounds of the digits
+    // and moves past the closing 'e'.
+    fn int_bounds(&mut self) -> PyResult<(usize, usize)> {
+        let data = self.data();
+        let start = self.position;
+        // Look no further for the 'e' than the longest integer allowed.
+        let scan_end = match self.limits.max_int_digits {
+            Some(max) => data.len().min(start.saturating_add(max).saturating_add(2)),
+            None => data.len(),
+        };
+        let end = match data[start..scan_end].iter().position(|&b| b == b'e') {
+            Some(offset) => start + offset,
+            None if scan_end < data.len() => return Err(too_many_int_digits()),
+            None => return Err(PyValueError::new_err("Stop character e not found")),
+        };
+        let digits = &data[start..end];
+        let magnitude = digits.strip_prefix(b"-").unwrap_or(digits);
+        if magnitude.is_empty() || !magnitude.iter().all(u8::is_ascii_digit) {
+            return Err(PyValueError::new_err("invalid integer"));
+        }
+        if let Some(max) = self.limits.max_int_digits {
+            if magnitude.len() > max {
+                return Err(too_many_int_digits());
+            }
+        }
+        if magnitude[0] == b'0' && !self.trusted {
+            if magnitude.len() > 1 {
+                return Err(PyValueError::new_err("leading zeros are not allowed"));
+            } else if magnitude.len() != digits.len() {
+                return Err(PyValueError::new_err("negative zero not allowed"));
+            }
+        }
+        self.position = end + 1;
+        Ok((start, end))
+    }
+
+    // Parse the length prefix of a byte string, returning the bounds of its
+    // contents and moving past them.
+    fn string_bounds(&mut self) -> PyResult<(usize, usize)> {
+        let data = self.data();
+        let scan_end = data.len().min(self.position + MAX_LENGTH_DIGITS + 1);
+        let len_end_pos = match data[self.position..scan_end]
+            .iter()
+            .position(|&b| b == b':')
+        {
+            Some(offset) => self.position + offset,
+            None => return Err(PyValueError::new_err("string len not terminated by \":\"")),
+        };
+        let len_str = std::str::from_utf8(&data[self.position..len_end_pos])
+            .map_err(|_| PyValueError::new_err("invalid length string"))?;
+
+        // Check for leading zeros in the length
+        if len_str.starts_with('0') && len_str.len() > 1 && !self.trusted {
+            return Err(PyValueError::new_err("leading zeros are not allowed"));
+        }
+
+        // parse() would also accept a leading '+'.
+        if len_str.is_empty() || !len_str.bytes().all(|b| b.is_ascii_digit()) {
+            return Err(PyValueError::new_err("invalid length value"));
+        }
+        let length: usize = len_str
+            .parse()
+            .map_err(|_| PyValueError::new_err("invalid length value"))?;
+        if let Some(max) = self.limits.max_string_length {
+            if length > max {
+                return Err(PyValueError::new_err(
+                    "string is longer than max_string_length",
+                ));
+            }
+        }
+
+        // Skip past the ':' character
+        let start = len_end_pos + 1;
+        if length > data.len() - start {
+            return Err(PyValueError::new_err("stream underflow"));
+        }
+        self.position = start + length;
+        Ok((start, start + length))
+    }
+
+    // Check there is room for another level of nesting at the given number
+    // of open containers.
+    fn check_depth(&self, open: usize) -> PyResult<()> {
+        if let Some(max) = self.max_depth {
+            if self.depth + open >= max {
+                return Err(PyRecursionError::new_err(
+                    "maximum bencode nesting depth exceeded",
+                ));
+            }
+        }
+        Ok(())
+    }
+
+    // Scan the value at the current position into a tree of nodes, returning
+    // them and the index of the root. Keys are not checked for order or
+    // uniqueness, and the decoder should be trusted so that numbers need not
+    // be in canonical form either.
+    fn canonical_nodes(&mut self) -> PyResult<(Vec<Node>, usize)> {
+        let mut nodes: Vec<Node> = Vec::new();
+        // The open containers, with the key awaiting a value for dicts.
+        let mut stack: Vec<(usize, Option<(usize, usize)>)> = Vec::new();
+
+        loop {
+            let next_byte = match self.data().get(self.position) {
+                Some(&b) => b,
+                None => return Err(PyValueError::new_err("stream underflow")),
+            };
+
+            if let Some((parent, pending_key)) = stack.last_mut() {
+                if matches!(nodes[*parent], Node::Dict(_)) {
+                    if pending_key.is_none() && next_byte != b'e' {
+                        if !next_byte.is_ascii_digit() {
+                            return Err(PyValueError::new_err("key was not a simple string"));
+                        }
+                        *pending_key = Some(self.string_bounds()?);
+                        continue;
+                    } else if pending_key.is_some() && next_byte == b'e' {
+                        return Err(PyValueError::new_err(format!(
+                            "unknown object type identifier {:?}",
+                            next_byte as char
+                        )));
+                    }
+                }
+            }
+
+            let node = match next_byte {
+                b'e' if !stack.is_empty() => {
+                    self.position += 1;
+                    stack.pop().unwrap().0
+                }
+                b'0'..=b'9' => {
+                    let (start, end) = self.string_bounds()?;
+                    nodes.push(Node::Bytes(start, end));
+                    nodes.len() - 1
+                }
+                b'i' => {
+                    self.position += 1;
+                    let (start, end) = self.int_bounds()?;
+                    nodes.push(Node::Int(start, end));
+                    nodes.len() - 1
+                }
+                b'l' | b'd' => {
+                    self.check_depth(stack.len())?;
+                    self.position += 1;
+                    nodes.push(if next_byte == b'l' {
+                        Node::List(Vec::new())
+                    } else {
+                        Node::Dict(Vec::new())
+                    });
+                    stack.push((nodes.len() - 1, None));
+                    continue;
+                }
+                _ => {
+                    return Err(PyValueError::new_err(format!(
+                        "unknown object type identifier {:?}",
+                        next_byte as char
+                    )));
+                }
+            };
+
+            match stack.last_mut() {
+                None => return Ok((nodes, node)),
+                Some((parent, pending_key)) => match &mut nodes[*parent] {
+                    Node::List(items) => items.push(node),
+                    Node::Dict(entries) => entries.push((pending_key.take().unwrap(), node)),
+                    _ => unreachable!(),
+                },
+            }
+        }
+    }
+
+    // Write the value at root of a tree from canonical_nodes to out in
+    // canonical form.
+    fn write_canonical(
+        &self,
+        nodes: &mut [Node],
+        root: usize,
+        duplicates: Duplicates,
+        out: &mut Vec<u8>,
+    ) -> PyResult<()> {
+        let data = self.data();
+        // The containers being written, with the index of the next child.
+        let mut stack: Vec<(usize, usize)> = Vec::new();
+        let mut next = Some(root);
+
+        loop {
+            if let Some(node) = next.take() {
+                match &mut nodes[node] {
+                    Node::Int(start, end) => write_canonical_int(&data[*start..*end], out),
+                    Node::Bytes(start, end) => write_string(&data[*start..*end], out),
+                    Node::List(_) => {
+                        out.push(b'l');
+                        stack.push((node, 0));
+                    }
+                    Node::Dict(entries) => {
+                        sort_entries(data, entries, duplicates)?;
+                        out.push(b'd');
+                        stack.push((node, 0));
+                    }
+                }
+            }
+
+            let Some((container, index)) = stack.last_mut() else {
+                return Ok(());
+            };
+            match &nodes[*container] {
+                Node::List(items) if *index < items.len() => {
+                    next = Some(items[*index]);
+                    *index += 1;
+                }
+                Node::Dict(entries) if *index < entries.len() => {
+                    let ((start, end), value) = entries[*index];
+                    write_string(&data[start..end], out);
+                    next = Some(value);
+                    *index += 1;
+                }
+                _ => {
+                    out.push(b'e');
+                    stack.pop();
+                }
+            }
+        }
+    }
+
+    // Write the value at the current position to out as JSON, and move
+    // past it. The input is checked as strictly as by decode.
+    fn write_json(&mut self, py: Python<'_>, binary: Binary, out: &mut Vec<u8>) -> PyResult<()> {
+        let mut stack: Vec<JsonFrame> = Vec::new();
+
+        loop {
+            let next_byte = match self.data().get(self.position) {
+                Some(&b) => b,
+                None => return Err(PyValueError::new_err("stream underflow")),
+            };
+
+            match stack.last_mut() {
+                Some(JsonFrame::Dict {
+                    awaiting_value,
+                    last_key,
+                    binary_keys,
+                    ..
+                }) => {
+                    if !*awaiting_value && next_byte != b'e' {
+                        if !next_byte.is_ascii_digit() {
+                            return Err(PyValueError::new_err("key was not a simple string"));
+                        }
+                        let (start, end) = self.string_bounds()?;
+                        let data = self.data();
+                        if let Some((last_start, last_end)) = *last_key {
+                            if data[last_start..last_end] >= data[start..end] {
+                                return Err(PyValueError::new_err("dict keys disordered"));
+                            }
+                            out.push(b',');
+                        }
+                        if std::str::from_utf8(&data[start..end]).is_err() {
+                            binary_keys.push((start, end));
+                        }
+                        write_json_string(&data[start..end], binary, out);
+                        out.push(b':');
+                        *last_key = Some((start, end));
+                        *awaiting_value = true;
+                        continue;
+                    } else if *awaiting_value && next_byte == b'e' {
+                        return Err(PyValueError::new_err(format!(
+                            "unknown object type identifier {:?}",
+                            next_byte as char
+                        )));
+                    }
+                }
+                Some(JsonFrame::List) if next_byte != b'e' => {
+                    if out.last() != Some(&b'[') {
+                        out.push(b',');
+                    }
+                }
+                _ => {}
+            }
+
+            match next_byte {
+                b'e' if !stack.is_empty() => {
+                    self.position += 1;
+                    match stack.pop() {
+                        Some(JsonFrame::Dict {
+                            start, binary_keys, ..
+                        }) => {
+                            if !binary_keys.is_empty() {
+                                self.check_json_keys(start, &binary_keys, binary)?;
+                            }
+                            out.push(b'}');
+                        }
+                        _ => out.push(b']'),
+                    }
+                }
+                b'0'..=b'9' => {
+                    let (start, end) = self.string_bounds()?;
+                    write_json_string(&self.data()[start..end], binary, out);
+                }
+                b'i' => {
+                    self.position += 1;
+                    let (start, end) = self.int_bounds()?;
+                    let digits = &self.data()[start..end];
+                    // The digits are copied rather than converted to an int,
+                    // so apply the interpreter's int max_str_digits limit as
+                    // the conversion would.
+                    if digits.len() > MIN_LIMITED_DIGITS {
+                        py.import("fastbencode._bigint")?
+                            .getattr("check_decimal_digits")?
+                            .call1((PyBytes::new(py, digits),))?;
+                    }
+                    out.extend_from_slice(digits);
+                }
+                b'l' => {
+                    self.check_depth(stack.len())?;
+                    self.position += 1;
+                    out.push(b'[');
+                    stack.push(JsonFrame::List);
+                    continue;
+                }
+                b'd' => {
+                    self.check_depth(stack.len())?;
+                    self.position += 1;
+                    out.push(b'{');
+                    stack.push(JsonFrame::Dict {
+                        awaiting_value: false,
+                        last_key: None,
+                        start: self.position,
+                        binary_keys: Vec::new(),
+                    });
+                    continue;
+                }
+                _ => {
+                    return Err(PyValueError::new_err(format!(
+                        "unknown object type identifier {:?}",
+                        next_byte as char
+                    )));
+                }
+            }
+
+            match stack.last_mut() {
+                None => return Ok(()),
+                Some(JsonFrame::Dict { awaiting_value, .. }) => *awaiting_value = false,
+                Some(JsonFrame::List) => {}
+            }
+        }
+    }
+
+    // Check that none of the keys of the dict whose first key is at start
+    // is written to JSON as the same string as one of binary_keys, its keys
+    // that are not valid UTF-8. Those are rare, so the dict is only scanned
+    // again when it has any.
+    fn check_json_keys(
+        &mut self,
+        start: usize,
+        binary_keys: &[(usize, usize)],
+        binary: Binary,
+    ) -> PyResult<()> {
+        let names: Vec<Vec<u8>> = binary_keys
+            .iter()
+            .map(|&(key_start, key_end)| {
+                let mut name = Vec::new();
+                binary.write(&self.data()[key_start..key_end], &mut name);
+                name
+            })
+            .collect();
+        let end = self.position;
+        self.position = start;
+        while self.data()[self.position] != b'e' {
+            let (key_start, key_end) = self.string_bounds()?;
+            let key = &self.data()[key_start..key_end];
+            if names.iter().any(|name| name.as_slice() == key) {
+                return Err(PyValueError::new_err(
+                    "dict keys collide once converted to JSON",
+                ));
+            }
+            self.skip_value()?;
+        }
+        self.position = end;
+        Ok(())
+    }
+
+    // Check the whole input, which must be a list or dict, and return the
+    // offsets of its items (of the keys, for a dict) followed by the offset
+    // of its closing 'e'.
+    fn item_offsets(&mut self) -> PyResult<Vec<usize>> {
+        let is_dict = match self.data().first() {
+            Some(b'l') => false,
+            Some(b'd') => true,
+            _ => return Err(PyValueError::new_err("value is not a list or dict")),
+        };
+        self.check_depth(0)?;
+        self.depth += 1;
+        self.position = 1;
+        let mut offsets = Vec::new();
+        let mut last_key: Option<(usize, usize)> = None;
+        loop {
+            let next_byte = match self.data().get(self.position) {
+                Some(&b) => b,
+                None => return Err(PyValueError::new_err("stream underflow")),
+            };
+            if next_byte == b'e' {
+                break;
+            }
+            offsets.push(self.position);
+            if is_dict {
+                if !next_byte.is_ascii_digit() {
+                    return Err(PyValueError::new_err("key was not a simple string"));
+                }
+                let (start, end) = self.string_bounds()?;
+                if let Some((last_start, last_end)) = last_key {
+                    let data = self.data();
+                    if data[last_start..last_end] >= data[start..end] {
+                        return Err(PyValueError::new_err("dict keys disordered"));
+                    }
+                }
+                last_key = Some((start, end));
+            }
+            self.skip_value()?;
+        }
+        offsets.push(self.position);
+        self.position += 1;
+        if self.position < self.data().len() {
+            return Err(PyValueError::new_err("junk in stream"));
+        }
+        Ok(offsets)
+    }
+
+    // Move past the value at the current position without building it. Its
+    // syntax is still checked, including dict key order.
+    fn skip_value(&mut self) -> PyResult<()> {
+        let mut stack: Vec<SkipFrame> = Vec::new();
+
+        loop {
+            let next_byte = match self.data().get(self.position) {
+                Some(&b) => b,
+                None => return Err(PyValueError::new_err("stream underflow")),
+            };
+
+            if let Some(SkipFrame::Dict {
+                awaiting_value,
+                last_key,
+            }) = stack.last_mut()
+            {
+                if !*awaiting_value && next_byte != b'e' {
+                    if !next_byte.is_ascii_digit() {
+                        return Err(PyValueError::new_err("key was not a simple string"));
+                    }
+                    let (start, end) = self.string_bounds()?;
+                    if let (false, Some((last_start, last_end))) = (self.trusted, *last_key) {
+                        let data = self.data();
+                        if data[last_start..last_end] >= data[start..end] {
+                            return Err(PyValueError::new_err("dict keys disordered"));
+                        }
+                    }
+                    *last_key = Some((start, end));
+                    *awaiting_value = true;
+                    continue;
+                } else if *awaiting_value && next_byte == b'e' {
+                    return Err(PyValueError::new_err(format!(
+                        "unknown object type identifier {:?}",
+                        next_byte as char
+                    )));
+                }
+            }
+
+            match next_byte {
+                b'e' if !stack.is_empty() => {
+                    stack.pop();
+                    self.position += 1;
+                }
+                b'0'..=b'9' => {
+                    self.string_bounds()?;
+                }
+                b'i' => {
+                    self.position += 1;
+                    self.int_bounds()?;
+                }
+                b'l' => {
+                    self.check_depth(stack.len())?;
+                    self.position += 1;
+                    stack.push(SkipFrame::List);
+                    continue;
+                }
+                b'd' => {
+                    self.check_depth(stack.len())?;
+                    self.position += 1;
+                    stack.push(SkipFrame::Dict {
+                        awaiting_value: false,
+                        last_key: None,
+                    });
+                    continue;
+                }
+                _ => {
+                    return Err(PyValueError::new_err(format!(
+                        "unknown object type identifier {:?}",
+                        next_byte as char
+                    )));
+                }
+            }
+
+            // A complete value was skipped.
+            match stack.last_mut() {
+                None => return Ok(()),
+                Some(SkipFrame::Dict { awaiting_value, .. }) => *awaiting_value = false,
+                Some(SkipFrame::List) => {}
+            }
+        }
+    }
+
+    // Decode the values below node in the path tree from the value at the
+    // current position, skipping everything not on a requested path. Found
+    // values are stored in results at the indices named by the tree.
+    fn collect_paths<'py>(
+        &mut self,
+        py: Python<'py>,
+        tree: &PathTree,
+        node: usize,
+        results: &mut [Option<Bound<'py, PyAny>>],
+        remaining: &mut usize,
+    ) -> PyResult<()> {
+        let targets = &tree.nodes[node].targets;
+        if !targets.is_empty() {
+            let start = self.position;
+            let value = self.decode_object(py)?;
+            for &target in targets {
+                results[target] = Some(value.clone());
+            }
+            *remaining -= targets.len();
+            if tree.nodes[node].children.is_empty() || *remaining == 0 {
+                return Ok(());
+            }
+            // Paths below this one are rare; go over the value again for them.
+            let end = self.position;
+            self.position = start;
+            self.collect_children(py, tree, node, results, remaining)?;
+            self.position = end;
+            return Ok(());
+        }
+        self.collect_children(py, tree, node, results, remaining)
+    }
+
+    fn collect_children<'py>(
+        &mut self,
+        py: Python<'py>,
+        tree: &PathTree,
+        node: usize,
+        results: &mut [Option<Bound<'py, PyAny>>],
+        remaining: &mut usize,
+    ) -> PyResult<()> {
+        let next_byte = self.data().get(self.position).copied();
+        if tree.nodes[node].children.is_empty()
+            || (next_byte != Some(b'd') && next_byte != Some(b'l'))
+        {
+            return self.skip_value();
+        }
+        let is_dict = next_byte == Some(b'd');
+        self.check_depth(0)?;
+        self.depth += 1;
+        self.position += 1;
+        let mut last_key: Option<(usize, usize)> = None;
+        let mut index = 0;
+
+        loop {
+            match self.data().get(self.position) {
+                None => return Err(PyValueError::new_err("stream underflow")),
+                Some(b'e') => break,
+                _ => {}
+            }
+            let child = if is_dict {
+                if !self.data()[self.position].is_ascii_digit() {
+                    return Err(PyValueError::new_err("key was not a simple string"));
+                }
+                let (start, end) = self.string_bounds()?;
+                let data = self.data();
+                if let (false, Some((last_start, last_end))) = (self.trusted, last_key) {
+                    if data[last_start..last_end] >= data[start..end] {
+                        return Err(PyValueError::new_err("dict keys disordered"));
+                    }
+                }
+                last_key = Some((start, end));
+                let key = &data[start..end];
+                tree.child(
+                    node,
+                    |k| matches!(k, PathKey::Key(name) if name.as_slice() == key),
+                )
+            } else {
+                index += 1;
+                tree.child(node, |k| *k == PathKey::Index(index - 1))
+            };
+            match child {
+                Some(child) => {
+                    self.collect_paths(py, tree, child, results, remaining)?;
+                    if *remaining == 0 {
+                        // Everything has been found; the rest is not needed.
+                        return Ok(());
+                    }
+                }
+                None => self.skip_value()?,
+            }
+        }
+
+        self.position += 1;
+        self.depth -= 1;
+        Ok(())
+    }
+
+    // Move to the value at path below the value at the current position,
+    // returning false if there is none. Only the entries before the one on
+    // the path are checked in each container passed through.
+    fn seek_path(&mut self, path: &[PathKey]) -> PyResult<bool> {
+        for key in path {
+            let next_byte = self.data().get(self.position).copied();
+            let index = match (key, next_byte) {
+                (PathKey::Key(_), Some(b'd')) => None,
+                (PathKey::Index(index), Some(b'l')) => Some(*index),
+                _ => return Ok(false),
+            };
+            self.check_depth(0)?;
+            self.depth += 1;
+            self.position += 1;
+            let mut last_key: Option<(usize, usize)> = None;
+            let mut i = 0;
+            loop {
+                let next_byte = match self.data().get(self.position) {
+                    Some(&b) => b,
+                    None => return Err(PyValueError::new_err("stream underflow")),
+                };
+                if next_byte == b'e' {
+                    return Ok(false);
+                }
+                let found = match (key, index) {
+                    (PathKey::Key(name), None) => {
+                        if !next_byte.is_ascii_digit() {
+                            return Err(PyValueError::new_err("key was not a simple string"));
+                        }
+                        let (start, end) = self.string_bounds()?;
+                        let data = self.data();
+                        if let Some((last_start, last_end)) = last_key {
+                            if data[last_start..last_end] >= data[start..end] {
                                 return Err(PyValueError::new_err("dict keys disordered"));
                             }
                         }
-                        *last_key = Some(key_bytes);
-                        *pending_key = Some(value);
-                    } else {
-                        let key = pending_key.take().unwrap();
-                        if let Some(Frame::Dict { dict, .. }) = stack.last() {
-                            dict.set_item(key, value)?;
-                        }
+                        last_key = Some((start, end));
+                        data[start..end] == name[..]
+                    }
+                    (_, index) => {
+                        i += 1;
+                        index == Some(i - 1)
                     }
+                };
+                if found {
+                    break;
                 }
+                self.skip_value()?;
             }
         }
+        Ok(true)
     }
 
-    // Extract the raw key bytes from a decoded key object for ordering checks.
-    fn key_bytes(&self, key_obj: &Bound<'_, PyAny>) -> PyResult<Vec<u8>> {
-        if let Some(encoding) = &self.bytestring_encoding {
-            if encoding == "utf-8" {
-                return Ok(key_obj.extract::<&str>()?.as_bytes().to_vec());
-            }
+    // Decode the list of dicts at the current position into one column per
+    // field, skipping all other entries of the dicts.
+    fn decode_columns<'py>(
+        &mut self,
+        py: Python<'py>,
+        fields: &[&[u8]],
+    ) -> PyResult<Vec<Column<'py>>> {
+        if self.data().get(self.position) != Some(&b'l') {
+            return Err(PyValueError::new_err("value at path is not a list"));
         }
-        Ok(key_obj.extract::<Bound<PyBytes>>()?.as_bytes().to_vec())
-    }
+        self.check_depth(0)?;
+        self.depth += 1;
+        self.position += 1;
+        let mut columns: Vec<Column<'py>> = fields.iter().map(|_| Column::Empty).collect();
+        let mut seen = vec![false; fields.len()];
 
-    fn read_digits(&mut self, stop_char: u8) -> PyResult<String> {
-        let start = self.position;
-        while self.position < self.data.len() {
-            let b = self.data[self.position];
-            if b == stop_char {
-                break;
-            }
-            if (b < b'0' || b > b'9') && b != b'-' {
-                return Err(PyValueError::new_err(format!(
-                    "Stop character {} not found: {}",
-                    stop_char as char, b as char
-                )));
+        loop {
+            match self.data().get(self.position) {
+                None => return Err(PyValueError::new_err("stream underflow")),
+                Some(b'e') => break,
+                Some(b'd') => {}
+                Some(_) => return Err(PyValueError::new_err("list item is not a dict")),
             }
+            self.check_depth(0)?;
+            self.depth += 1;
             self.position += 1;
-        }
+            seen.fill(false);
+            let mut last_key: Option<(usize, usize)> = None;
 
-        if self.position >= self.data.len() || self.data[self.position] != stop_char {
-            return Err(PyValueError::new_err(format!(
-                "Stop character {} not found",
-                stop_char as char
-            )));
-        }
+            loop {
+                let next_byte = match self.data().get(self.position) {
+                    Some(&b) => b,
+                    None => return Err(PyValueError::new_err("stream underflow")),
+                };
+                if next_byte == b'e' {
+                    break;
+                }
+                if !next_byte.is_ascii_digit() {
+                    return Err(PyValueError::new_err("key was not a simple string"));
+                }
+                let (start, end) = self.string_bounds()?;
+                let data = self.data();
+                if let Some((last_start, last_end)) = last_key {
+                    if data[last_start..last_end] >= data[start..end] {
+                        return Err(PyValueError::new_err("dict keys disordered"));
+                    }
+                }
+                last_key = Some((start, end));
+                match fields.iter().position(|name| *name == &data[start..end]) {
+                    Some(i) => {
+                        seen[i] = true;
+                        self.decode_column_value(py, &mut columns[i])?;
+                    }
+                    None => self.skip_value()?,
+                }
+            }
 
-        // Check for leading zeros
-        if self.data[start] == b'0' && self.position - start > 1 {
-            return Err(PyValueError::new_err("leading zeros are not allowed"));
-        } else if self.data[start] == b'-'
-            && self.data[start + 1] == b'0'
-            && self.position - start > 2
-        {
-            return Err(PyValueError::new_err("leading zeros are not allowed"));
+            if let Some(i) = seen.iter().position(|&s| !s) {
+                return Err(PyKeyError::new_err((PyBytes::new(py, fields[i]).unbind(),)));
+            }
+            self.depth -= 1;
+            self.position += 1;
         }
 
-        Ok(String::from_utf8_lossy(&self.data[start..self.position]).to_string())
-    }
-
-    fn decode_int<'py>(&mut self, py: Python<'py>) -> PyResult<Bound<'py, PyAny>> {
-        let digits = self.read_digits(b'e')?;
-
-        // Move past the 'e'
+        self.depth -= 1;
         self.position += 1;
-
-        // Check for negative zero
-        if digits == "-0" {
-            return Err(PyValueError::new_err("negative zero not allowed"));
-        }
-
-        // Parse the integer directly
-        let parsed_int = match digits.parse::<i64>() {
-            Ok(n) => n.into_pyobject(py)?.into_any(),
-            Err(_) => {
-                // For very large integers, fallback to Python's conversion
-                let py_str = PyString::new(py, &digits);
-
-                let int_type = py.get_type::<PyInt>();
-                int_type.call1((py_str,))?
-            }
-        };
-
-        Ok(parsed_int.into_any())
+        Ok(columns)
     }
 
-    fn decode_bytes<'py>(&mut self, py: Python<'py>) -> PyResult<Bound<'py, PyAny>> {
-        let len_end_pos = self.data[self.position..].iter().position(|&b| b == b':');
-        if len_end_pos.is_none() {
-            return Err(PyValueError::new_err("string len not terminated by \":\""));
+    // Decode the value at the current position onto the end of column.
+    fn decode_column_value<'py>(
+        &mut self,
+        py: Python<'py>,
+        column: &mut Column<'py>,
+    ) -> PyResult<()> {
+        match self.data().get(self.position) {
+            Some(b'i') => {
+                self.position += 1;
+                let (start, end) = self.int_bounds()?;
+                // int_bounds has checked these are ASCII digits.
+                let n: i64 = std::str::from_utf8(&self.data()[start..end])
+                    .unwrap()
+                    .parse()
+                    .map_err(|_| {
+                        PyOverflowError::new_err("integer field values must fit in 64 bits")
+                    })?;
+                match column {
+                    Column::Empty => *column = Column::Ints(vec![n]),
+                    Column::Ints(values) => values.push(n),
+                    Column::Bytes(_) => {
+                        return Err(PyValueError::new_err(
+                            "column mixes integers and byte strings",
+                        ))
+                    }
+                }
+            }
+            Some(b'0'..=b'9') => {
+                let (start, end) = self.string_bounds()?;
+                let value = PyBytes::new(py, &self.data()[start..end]).into_any();
+                match column {
+                    Column::Empty => *column = Column::Bytes(vec![value]),
+                    Column::Bytes(values) => values.push(value),
+                    Column::Ints(_) => {
+                        return Err(PyValueError::new_err(
+                            "column mixes integers and byte strings",
+                        ))
+                    }
+                }
+            }
+            _ => {
+                return Err(PyValueError::new_err(
+                    "field values must be integers or byte strings",
+                ))
+            }
         }
+        Ok(())
+    }
 
-        let len_end_pos = len_end_pos.unwrap() + self.position;
-        let len_str = std::str::from_utf8(&self.data[self.position..len_end_pos])
-            .map_err(|_| PyValueError::new_err("invalid length string"))?;
-
-        // Check for leading zeros in the length
-        if len_str.starts_with('0') && len_str.len() > 1 {
-            return Err(PyValueError::new_err("leading zeros are not allowed"));
+    // Fill in a preserved container from its finished frame and record its
+    // original encoding, which ends at the current position.
+    fn finish_preserved<'py>(
+        &mut self,
+        py: Python<'py>,
+        frame: Frame<'py>,
+        container: Bound<'py, PyAny>,
+        start: usize,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        // Items are added through the C API, so this does not count as a
+        // modification. Dict frames were built in the container directly.
+        if let Frame::List(items) = frame {
+            let list = container.extract::<Bound<PyList>>()?;
+            for item in items {
+                list.append(item)?;
+            }
         }
+        container.setattr("_raw", self.view_slice(py, start, self.position)?)?;
+        Ok(container)
+    }
 
-        let length: usize = len_str
-            .parse()
-            .map_err(|_| PyValueError::new_err("invalid length value"))?;
-
-        // Skip past the ':' character
-        self.position = len_end_pos + 1;
-
-        if length > self.data.len() - self.position {
-            return Err(PyValueError::new_err("stream underflow"));
+    // Record that the value at node in the path tree spans from start to the
+    // current position.
+    fn record_span(&mut self, node: Option<usize>, start: usize) {
+        let end = self.position;
+        if let (Some(node), Some(tracker)) = (node, self.spans.as_mut()) {
+            for &target in &tracker.tree.nodes[node].targets {
+                tracker.spans[target] = Some((start, end));
+            }
         }
+    }
 
-        let bytes_slice = &self.data[self.position..self.position + length];
-        self.position += length;
-
-        let bytes_obj = PyBytes::new(py, bytes_slice).into_any();
+    // The input as a byte slice. The buffer export is held for as long as the
+    // decoder, so the slice stays valid without copying the data.
+    fn data(&self) -> &[u8] {
+        buffer_bytes(&self.buffer)
+    }
 
-        // Return as bytes or decode depending on bytestring_encoding
-        if let Some(encoding) = &self.bytestring_encoding {
-            let encoding_cstr = std::ffi::CString::new(encoding.as_str())
-                .map_err(|_| PyValueError::new_err("invalid encoding string"))?;
-            Ok(
-                PyString::from_encoded_object(&bytes_obj, Some(&encoding_cstr), Some(c"strict"))?
-                    .into_any(),
-            )
-        } else {
-            Ok(bytes_obj)
+    // Return a read-only memoryview over data[start..end]. The view keeps the
+    // source object alive for as long as it is referenced.
+    fn view_slice<'py>(
+        &mut self,
+        py: Python<'py>,
+        start: usize,
+        end: usize,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        if self.view.is_none() {
+            let view = PyMemoryView::from(self.source.bind(py))?.call_method0("toreadonly")?;
+            self.view = Some(view.unbind());
         }
+        let view = self.view.as_ref().unwrap().bind(py);
+        view.get_item(PySlice::new(py, start as isize, end as isize, 1))
     }
 }
 
@@ -322,6 +1660,8 @@ struct Encoder {
     bytestring_encoding: Option<String>,
     max_depth: Option<usize>,
     depth: usize,
+    // The PreservedList and PreservedDict types, looked up on first use.
+    preserved_types: Option<(Py<PyAny>, Py<PyAny>)>,
 }
 
 // A unit of pending encoding work. Containers push their children as Encode
@@ -345,6 +1685,7 @@ impl Encoder {
             bytestring_encoding,
             max_depth,
             depth: 0,
+            preserved_types: None,
         }
     }
 
@@ -374,13 +1715,19 @@ impl Encoder {
             } else if let Ok(n) = x.extract::<Bound<PyInt>>() {
                 self.encode_long(n)?;
             } else if x.is_instance_of::<PyList>() || x.is_instance_of::<PyTuple>() {
-                self.push_list(&mut stack, x)?;
+                if !self.append_preserved(&x)? {
+                    self.push_list(&mut stack, x)?;
+                }
             } else if let Ok(d) = x.extract::<Bound<PyDict>>() {
-                self.push_dict(&mut stack, d)?;
+                if !self.append_preserved(&x)? {
+                    self.push_dict(&mut stack, d)?;
+                }
             } else if let Ok(b) = x.extract::<bool>() {
                 self.encode_int(if b { 1 } else { 0 })?;
             } else if let Ok(obj) = x.extract::<PyRef<Bencached>>() {
                 self.append_bytes(obj.as_bytes(py)?)?;
+            } else if x.is_instance_of::<PyMemoryView>() {
+                self.encode_memoryview(&x)?;
             } else if let Ok(s) = x.extract::<&str>() {
                 self.encode_string(s)?;
             } else {
@@ -397,8 +1744,23 @@ impl Encoder {
     }
 
     fn encode_long(&mut self, x: Bound<PyInt>) -> PyResult<()> {
-        let s = format!("i{}e", x.str()?);
-        self.buffer.extend(s.as_bytes());
+        if let Ok(n) = x.extract::<i128>() {
+            self.buffer.extend(format!("i{}e", n).as_bytes());
+        } else if let Ok(n) = x.extract::<u128>() {
+            self.buffer.extend(format!("i{}e", n).as_bytes());
+        } else {
+            // Shared with the Python implementation, so that very large
+            // integers are converted and limited in the same way.
+            let digits = x
+                .py()
+                .import("fastbencode._bigint")?
+                .getattr("int_to_decimal")?
+                .call1((x,))?;
+            self.buffer.push(b'i');
+            self.buffer
+                .extend(digits.extract::<Bound<PyBytes>>()?.as_bytes());
+            self.buffer.push(b'e');
+        }
         Ok(())
     }
 
@@ -407,6 +1769,18 @@ impl Encoder {
         Ok(())
     }
 
+    // Write a memoryview, as returned by bdecode with view_threshold, as a
+    // byte string. Casting checks that the view is contiguous, and makes its
+    // length count bytes.
+    fn encode_memoryview(&mut self, x: &Bound<PyAny>) -> PyResult<()> {
+        let view = PyBuffer::<u8>::get(&x.call_method1("cast", ("B",))?)?;
+        let contents = buffer_bytes(&view);
+        self.buffer
+            .extend(format!("{}:", contents.len()).as_bytes());
+        self.buffer.extend_from_slice(contents);
+        Ok(())
+    }
+
     fn encode_bytes(&mut self, bytes: Bound<PyBytes>) -> PyResult<()> {
         let len_str = format!("{}:", bytes.len()?);
         self.buffer.extend(len_str.as_bytes());
@@ -435,6 +1809,59 @@ impl Encoder {
 }
 
 impl Encoder {
+    // If x is a container from bdecode_preserving that has not been modified
+    // since, copy out its original encoding and return true.
+    fn append_preserved(&mut self, x: &Bound<PyAny>) -> PyResult<bool> {
+        if x.is_exact_instance_of::<PyList>()
+            || x.is_exact_instance_of::<PyDict>()
+            || x.is_exact_instance_of::<PyTuple>()
+        {
+            return Ok(false);
+        }
+        let py = x.py();
+        if self.preserved_types.is_none() {
+            let (list_type, dict_type) = preserved_types(py)?;
+            self.preserved_types = Some((list_type.unbind(), dict_type.unbind()));
+        }
+        let (list_type, dict_type) = self.preserved_types.as_ref().unwrap();
+        if !x.is_instance(list_type.bind(py))? && !x.is_instance(dict_type.bind(py))? {
+            return Ok(false);
+        }
+        let raw = x.getattr("_raw")?;
+        if raw.is_none() {
+            return Ok(false);
+        }
+        let raw = PyBuffer::<u8>::get(&raw)?;
+        self.buffer.extend_from_slice(buffer_bytes(&raw));
+        Ok(true)
+    }
+
+    // Start a frame, reserving space for a length header where its size is
+    // known up front. Returns the offset to pass to end_frame.
+    fn begin_frame(&mut self, netstring: bool) -> usize {
+        let start = self.buffer.len();
+        if !netstring {
+            self.buffer.extend([0; FRAME_HEADER_SIZE]);
+        }
+        start
+    }
+
+    // Finish the frame started at start by filling in its header. A
+    // netstring header's width depends on the length, so it is inserted in
+    // place instead, shifting the payload along.
+    fn end_frame(&mut self, start: usize, netstring: bool) -> PyResult<()> {
+        if netstring {
+            let header = format!("{}:", self.buffer.len() - start);
+            self.buffer.splice(start..start, header.bytes());
+            self.buffer.push(b',');
+        } else {
+            let length = u32::try_from(self.buffer.len() - start - FRAME_HEADER_SIZE)
+                .map_err(|_| PyOverflowError::new_err("frame too large"))?;
+            self.buffer[start..start + FRAME_HEADER_SIZE].copy_from_slice(&length.to_be_bytes());
+        }
+        Ok(())
+    }
+
     fn check_depth(&mut self) -> PyResult<()> {
         if let Some(max) = self.max_depth {
             if self.depth >= max {
@@ -502,38 +1929,345 @@ impl Encoder {
 }
 
 #[pyfunction]
-#[pyo3(signature = (s, max_depth=None))]
+#[pyo3(signature = (s, max_depth=None, view_threshold=None, trusted=false, max_size=None, max_items=None, max_string_length=None, max_int_digits=None))]
+#[allow(clippy::too_many_arguments)]
 fn bdecode<'py>(
     py: Python<'py>,
     s: &Bound<PyBytes>,
     max_depth: Option<usize>,
+    view_threshold: Option<usize>,
+    trusted: bool,
+    max_size: Option<usize>,
+    max_items: Option<usize>,
+    max_string_length: Option<usize>,
+    max_int_digits: Option<usize>,
 ) -> PyResult<Bound<'py, PyAny>> {
-    let mut decoder = Decoder::new(s, None, None, max_depth);
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, view_threshold, trusted)?;
+    decoder.set_limits(Limits {
+        max_size,
+        max_items,
+        max_string_length,
+        max_int_digits,
+    })?;
     decoder.decode(py)
 }
 
 #[pyfunction]
-#[pyo3(signature = (s, max_depth=None))]
+#[pyo3(signature = (s, max_depth=None, view_threshold=None, trusted=false, max_size=None, max_items=None, max_string_length=None, max_int_digits=None))]
+#[allow(clippy::too_many_arguments)]
 fn bdecode_as_tuple<'py>(
     py: Python<'py>,
     s: &Bound<PyBytes>,
     max_depth: Option<usize>,
+    view_threshold: Option<usize>,
+    trusted: bool,
+    max_size: Option<usize>,
+    max_items: Option<usize>,
+    max_string_length: Option<usize>,
+    max_int_digits: Option<usize>,
 ) -> PyResult<Bound<'py, PyAny>> {
-    let mut decoder = Decoder::new(s, Some(true), None, max_depth);
+    let mut decoder = Decoder::new(
+        s.as_any(),
+        Some(true),
+        None,
+        max_depth,
+        view_threshold,
+        trusted,
+    )?;
+    decoder.set_limits(Limits {
+        max_size,
+        max_items,
+        max_string_length,
+        max_int_digits,
+    })?;
     decoder.decode(py)
 }
 
 #[pyfunction]
-#[pyo3(signature = (s, max_depth=None))]
+#[pyo3(signature = (s, max_depth=None, trusted=false, max_size=None, max_items=None, max_string_length=None, max_int_digits=None))]
+#[allow(clippy::too_many_arguments)]
 fn bdecode_utf8<'py>(
     py: Python<'py>,
     s: &Bound<PyBytes>,
     max_depth: Option<usize>,
+    trusted: bool,
+    max_size: Option<usize>,
+    max_items: Option<usize>,
+    max_string_length: Option<usize>,
+    max_int_digits: Option<usize>,
+) -> PyResult<Bound<'py, PyAny>> {
+    let mut decoder = Decoder::new(
+        s.as_any(),
+        None,
+        Some("utf-8".to_string()),
+        max_depth,
+        None,
+        trusted,
+    )?;
+    decoder.set_limits(Limits {
+        max_size,
+        max_items,
+        max_string_length,
+        max_int_digits,
+    })?;
+    decoder.decode(py)
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, max_depth=None, view_threshold=None, trusted=false, max_size=None, max_items=None, max_string_length=None, max_int_digits=None))]
+#[allow(clippy::too_many_arguments)]
+fn bdecode_keys_utf8<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    max_depth: Option<usize>,
+    view_threshold: Option<usize>,
+    trusted: bool,
+    max_size: Option<usize>,
+    max_items: Option<usize>,
+    max_string_length: Option<usize>,
+    max_int_digits: Option<usize>,
+) -> PyResult<Bound<'py, PyAny>> {
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, view_threshold, trusted)?;
+    decoder.str_keys = true;
+    decoder.set_limits(Limits {
+        max_size,
+        max_items,
+        max_string_length,
+        max_int_digits,
+    })?;
+    decoder.decode(py)
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, duplicates="error", max_depth=None))]
+fn bcanonicalize<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    duplicates: &str,
+    max_depth: Option<usize>,
+) -> PyResult<Bound<'py, PyBytes>> {
+    let duplicates = Duplicates::new(duplicates)?;
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, None, true)?;
+    let (mut nodes, root) = decoder.canonical_nodes()?;
+    if decoder.position < decoder.data().len() {
+        return Err(PyValueError::new_err("junk in stream"));
+    }
+    let mut out = Vec::with_capacity(decoder.data().len());
+    decoder.write_canonical(&mut nodes, root, duplicates, &mut out)?;
+    Ok(PyBytes::new(py, &out))
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, binary="base64", lines=false, max_depth=None))]
+fn bencode_to_json<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    binary: &str,
+    lines: bool,
+    max_depth: Option<usize>,
+) -> PyResult<Bound<'py, PyBytes>> {
+    let binary = Binary::new(binary)?;
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, None, false)?;
+    let len = decoder.data().len();
+    let mut out = Vec::with_capacity(len + len / 4);
+    if lines {
+        while decoder.position < len {
+            decoder.write_json(py, binary, &mut out)?;
+            out.push(b'\n');
+        }
+    } else {
+        decoder.write_json(py, binary, &mut out)?;
+        if decoder.position < len {
+            return Err(PyValueError::new_err("junk in stream"));
+        }
+    }
+    Ok(PyBytes::new(py, &out))
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, max_depth=None))]
+fn bdecode_item_offsets(s: &Bound<PyBytes>, max_depth: Option<usize>) -> PyResult<Vec<usize>> {
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, None, false)?;
+    decoder.item_offsets()
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, max_depth=None, view_threshold=None, trusted=false, max_size=None, max_items=None, max_string_length=None, max_int_digits=None))]
+#[allow(clippy::too_many_arguments)]
+fn bdecode_preserving<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    max_depth: Option<usize>,
+    view_threshold: Option<usize>,
+    trusted: bool,
+    max_size: Option<usize>,
+    max_items: Option<usize>,
+    max_string_length: Option<usize>,
+    max_int_digits: Option<usize>,
 ) -> PyResult<Bound<'py, PyAny>> {
-    let mut decoder = Decoder::new(s, None, Some("utf-8".to_string()), max_depth);
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, view_threshold, trusted)?;
+    let (list_type, dict_type) = preserved_types(py)?;
+    decoder.preserve = Some((list_type.unbind(), dict_type.unbind()));
+    decoder.set_limits(Limits {
+        max_size,
+        max_items,
+        max_string_length,
+        max_int_digits,
+    })?;
     decoder.decode(py)
 }
 
+#[pyfunction]
+#[pyo3(signature = (s, paths, max_depth=None))]
+fn bdecode_paths<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    paths: &Bound<PyAny>,
+    max_depth: Option<usize>,
+) -> PyResult<Vec<Bound<'py, PyAny>>> {
+    let (tree, path_objs) = PathTree::from_paths(py, paths)?;
+    let mut results = vec![None; path_objs.len()];
+    let mut remaining = results.len();
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, None, false)?;
+    decoder.collect_paths(py, &tree, 0, &mut results, &mut remaining)?;
+    results
+        .into_iter()
+        .zip(path_objs)
+        .map(|(result, path)| result.ok_or_else(|| PyKeyError::new_err((path.unbind(),))))
+        .collect()
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, paths, algorithm="sha1", max_depth=None))]
+fn bdecode_with_digests<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    paths: &Bound<PyAny>,
+    algorithm: &str,
+    max_depth: Option<usize>,
+) -> PyResult<(Bound<'py, PyAny>, Vec<Bound<'py, PyAny>>)> {
+    let hashlib = py.import("hashlib")?;
+    // Fail on an unknown algorithm before doing any decoding.
+    hashlib.call_method1("new", (algorithm,))?;
+    let (tree, path_objs) = PathTree::from_paths(py, paths)?;
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, None, false)?;
+    decoder.spans = Some(SpanTracker {
+        spans: vec![None; path_objs.len()],
+        tree,
+    });
+    let value = decoder.decode(py)?;
+    let spans = decoder.spans.take().unwrap().spans;
+    let view = PyMemoryView::from(s.as_any())?;
+    let digests = spans
+        .into_iter()
+        .zip(path_objs)
+        .map(|(span, path)| {
+            let (start, end) = span.ok_or_else(|| PyKeyError::new_err((path.unbind(),)))?;
+            let raw = view.get_item(PySlice::new(py, start as isize, end as isize, 1))?;
+            hashlib
+                .call_method1("new", (algorithm, raw))?
+                .call_method0("digest")
+        })
+        .collect::<PyResult<Vec<_>>>()?;
+    Ok((value, digests))
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, path, fields, max_depth=None, numpy=false))]
+fn bdecode_columns<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    path: &Bound<PyAny>,
+    fields: &Bound<PyAny>,
+    max_depth: Option<usize>,
+    numpy: bool,
+) -> PyResult<Bound<'py, PyDict>> {
+    let path = PyTuple::new(py, path.try_iter()?.collect::<PyResult<Vec<_>>>()?)?;
+    let keys = extract_path(path.as_any())?;
+    let names = fields
+        .try_iter()?
+        .map(|field| {
+            field?
+                .extract::<Bound<PyBytes>>()
+                .map_err(|_| PyTypeError::new_err("field names must be bytes"))
+        })
+        .collect::<PyResult<Vec<_>>>()?;
+    let fields: Vec<&[u8]> = names.iter().map(|name| name.as_bytes()).collect();
+    for (i, field) in fields.iter().enumerate() {
+        if fields[..i].contains(field) {
+            return Err(PyValueError::new_err("duplicate field names"));
+        }
+    }
+
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, None, false)?;
+    if !decoder.seek_path(&keys)? {
+        return Err(PyKeyError::new_err((path.unbind(),)));
+    }
+    let columns = decoder.decode_columns(py, &fields)?;
+
+    let array_type = py.import("array")?.getattr("array")?;
+    let numpy = if numpy {
+        Some(py.import("numpy")?)
+    } else {
+        None
+    };
+    let result = PyDict::new(py);
+    for (name, column) in names.iter().zip(columns) {
+        let column = match column {
+            Column::Bytes(values) => {
+                let list = PyList::new(py, values)?.into_any();
+                match &numpy {
+                    Some(numpy) => {
+                        // The "S" dtype would strip trailing NUL bytes and
+                        // pad every value to the longest one.
+                        let kwargs = PyDict::new(py);
+                        kwargs.set_item("dtype", "O")?;
+                        numpy.getattr("array")?.call((list,), Some(&kwargs))?
+                    }
+                    None => list,
+                }
+            }
+            Column::Ints(values) => int_column(&array_type, numpy.as_ref(), &values)?,
+            Column::Empty => int_column(&array_type, numpy.as_ref(), &[])?,
+        };
+        result.set_item(name, column)?;
+    }
+    Ok(result)
+}
+
+// Build an array.array("q"), or a NumPy int64 array over one, of values.
+fn int_column<'py>(
+    array_type: &Bound<'py, PyAny>,
+    numpy: Option<&Bound<'py, PyModule>>,
+    values: &[i64],
+) -> PyResult<Bound<'py, PyAny>> {
+    let py = array_type.py();
+    let bytes: Vec<u8> = values.iter().flat_map(|n| n.to_ne_bytes()).collect();
+    let array = array_type.call1(("q",))?;
+    array.call_method1("frombytes", (PyBytes::new(py, &bytes),))?;
+    match numpy {
+        Some(numpy) => {
+            let kwargs = PyDict::new(py);
+            kwargs.set_item("dtype", "int64")?;
+            numpy.getattr("frombuffer")?.call((array,), Some(&kwargs))
+        }
+        None => Ok(array),
+    }
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, path, max_depth=None))]
+fn bdecode_path<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    path: &Bound<PyAny>,
+    max_depth: Option<usize>,
+) -> PyResult<Bound<'py, PyAny>> {
+    let paths = PyList::new(py, [path])?;
+    let mut results = bdecode_paths(py, s, paths.as_any(), max_depth)?;
+    Ok(results.pop().unwrap())
+}
+
 #[pyfunction]
 #[pyo3(signature = (x, max_depth=None))]
 fn bencode(py: Python, x: Bound<PyAny>, max_depth: Option<usize>) -> PyResult<Py<PyAny>> {
@@ -550,6 +2284,244 @@ fn bencode_utf8(py: Python, x: Bound<PyAny>, max_depth: Option<usize>) -> PyResu
     Ok(encoder.to_bytes(py).into())
 }
 
+#[pyfunction]
+fn bencode_columns<'py>(
+    py: Python<'py>,
+    columns: &Bound<'py, PyAny>,
+) -> PyResult<Bound<'py, PyBytes>> {
+    let mut fields: Vec<(Vec<u8>, Column<'py>)> = Vec::new();
+    for item in columns.call_method0("items")?.try_iter()? {
+        let (name, column) = item?.extract::<(Bound<PyAny>, Bound<PyAny>)>()?;
+        let name = name
+            .extract::<Bound<PyBytes>>()
+            .map_err(|_| PyTypeError::new_err("field names must be bytes"))?;
+        // Columns of 64-bit integers, such as array("q") and NumPy int64
+        // arrays, are read directly from their buffers.
+        let column = match PyBuffer::<i64>::get(&column) {
+            Ok(buffer) => Column::Ints(buffer.to_vec(py)?),
+            Err(_) => Column::Bytes(column.try_iter()?.collect::<PyResult<Vec<_>>>()?),
+        };
+        fields.push((name.as_bytes().to_vec(), column));
+    }
+    fields.sort_by(|a, b| a.0.cmp(&b.0));
+
+    let lengths: Vec<usize> = fields
+        .iter()
+        .map(|(_, column)| match column {
+            Column::Empty => 0,
+            Column::Ints(values) => values.len(),
+            Column::Bytes(values) => values.len(),
+        })
+        .collect();
+    if lengths.windows(2).any(|pair| pair[0] != pair[1]) {
+        return Err(PyValueError::new_err("columns differ in length"));
+    }
+
+    let mut encoder = Encoder::new(None, None, None);
+    encoder.buffer.push(b'l');
+    for row in 0..lengths.first().copied().unwrap_or(0) {
+        encoder.buffer.push(b'd');
+        for (name, column) in &fields {
+            encoder.buffer.extend(format!("{}:", name.len()).as_bytes());
+            encoder.buffer.extend(name);
+            match column {
+                Column::Ints(values) => encoder.encode_int(values[row])?,
+                Column::Bytes(values) => encoder.process(py, values[row].clone())?,
+                Column::Empty => {}
+            }
+        }
+        encoder.buffer.push(b'e');
+    }
+    encoder.buffer.push(b'e');
+    Ok(encoder.to_bytes(py))
+}
+
+#[pyfunction]
+#[pyo3(signature = (x, max_depth=None, netstring=false))]
+fn bencode_frame(
+    py: Python,
+    x: Bound<PyAny>,
+    max_depth: Option<usize>,
+    netstring: bool,
+) -> PyResult<Py<PyAny>> {
+    let mut encoder = Encoder::new(None, None, max_depth);
+    let start = encoder.begin_frame(netstring);
+    encoder.process(py, x)?;
+    encoder.end_frame(start, netstring)?;
+    Ok(encoder.to_bytes(py).into())
+}
+
+// Locate the payload of the frame at pos, returning its start and end, or
+// None if the frame is not complete yet.
+fn frame_bounds(data: &[u8], pos: usize, netstring: bool) -> PyResult<Option<(usize, usize)>> {
+    let rest = &data[pos..];
+    if !netstring {
+        if rest.len() < FRAME_HEADER_SIZE {
+            return Ok(None);
+        }
+        let mut header = [0; FRAME_HEADER_SIZE];
+        header.copy_from_slice(&rest[..FRAME_HEADER_SIZE]);
+        let length = u32::from_be_bytes(header) as usize;
+        if length > rest.len() - FRAME_HEADER_SIZE {
+            return Ok(None);
+        }
+        let start = pos + FRAME_HEADER_SIZE;
+        return Ok(Some((start, start + length)));
+    }
+
+    let colon = match rest
+        .iter()
+        .take(MAX_NETSTRING_DIGITS + 1)
+        .position(|&b| b == b':')
+    {
+        Some(colon) => colon,
+        None if rest.len() > MAX_NETSTRING_DIGITS => {
+            return Err(PyValueError::new_err("netstring length too long"));
+        }
+        None => return Ok(None),
+    };
+    let digits = &rest[..colon];
+    if digits.is_empty()
+        || !digits.iter().all(|b| b.is_ascii_digit())
+        || (digits[0] == b'0' && digits.len() > 1)
+    {
+        return Err(PyValueError::new_err("invalid netstring length"));
+    }
+    let length: usize = std::str::from_utf8(digits)
+        .unwrap()
+        .parse()
+        .map_err(|_| PyValueError::new_err("invalid netstring length"))?;
+    if length >= rest.len() - colon - 1 {
+        return Ok(None);
+    }
+    if rest[colon + 1 + length] != b',' {
+        return Err(PyValueError::new_err("netstring not terminated by \",\""));
+    }
+    let start = pos + colon + 1;
+    Ok(Some((start, start + length)))
+}
+
+#[pyfunction]
+#[pyo3(signature = (s, max_depth=None, netstring=false))]
+fn bdecode_frames<'py>(
+    py: Python<'py>,
+    s: &Bound<PyBytes>,
+    max_depth: Option<usize>,
+    netstring: bool,
+) -> PyResult<(Bound<'py, PyList>, usize)> {
+    let mut decoder = Decoder::new(s.as_any(), None, None, max_depth, None, false)?;
+    let values = PyList::empty(py);
+    let mut consumed = 0;
+    while let Some((start, end)) = frame_bounds(decoder.data(), consumed, netstring)? {
+        decoder.position = start;
+        let value = decoder.decode_object(py)?;
+        if decoder.position != end {
+            return Err(PyValueError::new_err(
+                "frame length does not match its contents",
+            ));
+        }
+        values.append(value)?;
+        consumed = if netstring { end + 1 } else { end };
+    }
+    Ok((values, consumed))
+}
+
+// Return a read-only mapping of the file behind fp, with the offset of fp's
+// position in it. Only regular files are mapped; other file objects (e.g.
+// pipes, or io.BytesIO) have their remaining contents read instead, with no
+// offset.
+fn map_file<'py>(
+    py: Python<'py>,
+    fp: &Bound<'py, PyAny>,
+) -> PyResult<(Bound<'py, PyAny>, Option<usize>)> {
+    let fileno = match fp.call_method0("fileno") {
+        Ok(fileno) => fileno,
+        Err(e) if e.is_instance_of::<PyAttributeError>(py) || e.is_instance_of::<PyOSError>(py) => {
+            return Ok((fp.call_method0("read")?, None));
+        }
+        Err(e) => return Err(e),
+    };
+    let st = py.import("os")?.call_method1("fstat", (&fileno,))?;
+    let regular: bool = py
+        .import("stat")?
+        .call_method1("S_ISREG", (st.getattr("st_mode")?,))?
+        .extract()?;
+    if !regular {
+        return Ok((fp.call_method0("read")?, None));
+    }
+    let offset: usize = fp.call_method0("tell")?.extract()?;
+    let size: usize = st.getattr("st_size")?.extract()?;
+    if size <= offset {
+        // Empty files cannot be mapped.
+        return Ok((fp.call_method0("read")?, None));
+    }
+    let mmap = py.import("mmap")?;
+    let kwargs = PyDict::new(py);
+    kwargs.set_item("access", mmap.getattr("ACCESS_READ")?)?;
+    let data = mmap.getattr("mmap")?.call((fileno, 0), Some(&kwargs))?;
+    Ok((data, Some(offset)))
+}
+
+#[pyfunction]
+#[pyo3(signature = (fp, max_depth=None, view_threshold=None))]
+fn bload<'py>(
+    py: Python<'py>,
+    fp: &Bound<'py, PyAny>,
+    max_depth: Option<usize>,
+    view_threshold: Option<usize>,
+) -> PyResult<Bound<'py, PyAny>> {
+    let (data, offset) = map_file(py, fp)?;
+    let result = Decoder::new(&data, None, None, max_depth, view_threshold, false).and_then(
+        |mut decoder| {
+            decoder.position = offset.unwrap_or(0);
+            decoder.decode(py)
+        },
+    );
+    if offset.is_none() {
+        return result;
+    }
+    // Leave fp after the value, as reading it would have.
+    let seeked = match &result {
+        Ok(_) => fp.call_method1("seek", (data.len()?,)).map(|_| ()),
+        Err(_) => Ok(()),
+    };
+    // Unmap the file straight away rather than waiting for the mapping to
+    // be collected, unless views returned to the caller keep it alive.
+    match data.call_method0("close") {
+        Err(e) if e.is_instance_of::<PyBufferError>(py) => {}
+        closed => {
+            closed?;
+        }
+    }
+    seeked?;
+    result
+}
+
+#[pyfunction]
+#[pyo3(signature = (path, max_depth=None, view_threshold=None))]
+fn bdecode_file<'py>(
+    py: Python<'py>,
+    path: &Bound<'py, PyAny>,
+    max_depth: Option<usize>,
+    view_threshold: Option<usize>,
+) -> PyResult<Bound<'py, PyAny>> {
+    let fp = py.import("builtins")?.call_method1("open", (path, "rb"))?;
+    let result = bload(py, &fp, max_depth, view_threshold);
+    fp.call_method0("close")?;
+    result
+}
+
+#[pyfunction]
+#[pyo3(signature = (x, fp, max_depth=None))]
+fn bdump(py: Python, x: Bound<PyAny>, fp: &Bound<PyAny>, max_depth: Option<usize>) -> PyResult<()> {
+    let mut encoder = Encoder::new(None, None, max_depth);
+    encoder.process(py, x)?;
+    for chunk in encoder.buffer.chunks(WRITE_CHUNK_SIZE) {
+        fp.call_method1("write", (PyBytes::new(py, chunk),))?;
+    }
+    Ok(())
+}
+
 #[pymodule]
 fn _bencode_rs(m: &Bound<PyModule>) -> PyResult<()> {
     m.add_class::<Bencached>()?;
@@ -558,6 +2530,21 @@ fn _bencode_rs(m: &Bound<PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(bdecode, m)?)?;
     m.add_function(wrap_pyfunction!(bdecode_as_tuple, m)?)?;
     m.add_function(wrap_pyfunction!(bdecode_utf8, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_keys_utf8, m)?)?;
+    m.add_function(wrap_pyfunction!(bcanonicalize, m)?)?;
+    m.add_function(wrap_pyfunction!(bencode_to_json, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_item_offsets, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_preserving, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_path, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_columns, m)?)?;
+    m.add_function(wrap_pyfunction!(bencode_columns, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_paths, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_with_digests, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_file, m)?)?;
+    m.add_function(wrap_pyfunction!(bload, m)?)?;
+    m.add_function(wrap_pyfunction!(bdump, m)?)?;
+    m.add_function(wrap_pyfunction!(bencode_frame, m)?)?;
+    m.add_function(wrap_pyfunction!(bdecode_frames, m)?)?;
     m.add_function(wrap_pyfunction!(bencode, m)?)?;
     m.add_function(wrap_pyfunction!(bencode_utf8, m)?)?;
     Ok(())
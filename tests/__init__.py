@@ -22,7 +22,9 @@ import unittest
 
 def test_suite():
     names = [
+        "test_aio",
         "test_bencode",
+        "test_parallel",
     ]
     module_names = ["tests." + name for name in names]
     result = unittest.TestSuite()
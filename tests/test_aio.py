@@ -0,0 +1,179 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for the asyncio stream helpers."""
+
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from fastbencode import bencode
+from fastbencode.aio import (
+    IncrementalDecoder,
+    iter_values,
+    read_value,
+    write_value,
+)
+
+VALUES = [
+    1,
+    b"abc",
+    [1, [2, b"x"]],
+    {b"a": {b"b": [b"", -5]}, b"c": b"d" * 1000},
+    [],
+]
+
+
+class TestIncrementalDecoder(TestCase):
+    def test_whole_values(self):
+        decoder = IncrementalDecoder()
+        data = b"".join(bencode(v) for v in VALUES)
+        self.assertEqual(VALUES, decoder.feed(data))
+        self.assertEqual(b"", decoder.pending)
+
+    def test_byte_at_a_time(self):
+        decoder = IncrementalDecoder()
+        data = b"".join(bencode(v) for v in VALUES)
+        values = []
+        for i in range(len(data)):
+            values.extend(decoder.feed(data[i : i + 1]))
+        self.assertEqual(VALUES, values)
+
+    def test_pending(self):
+        decoder = IncrementalDecoder()
+        self.assertEqual([1], decoder.feed(b"i1eli2e5:ab"))
+        self.assertEqual(b"li2e5:ab", decoder.pending)
+        self.assertEqual([[2, b"abcde"]], decoder.feed(b"cdee"))
+
+    def test_invalid(self):
+        decoder = IncrementalDecoder()
+        self.assertRaises(ValueError, decoder.feed, b"x")
+        decoder = IncrementalDecoder()
+        self.assertRaises(ValueError, decoder.feed, b"d1:b0:1:a0:e")
+
+    def test_max_depth(self):
+        decoder = IncrementalDecoder(max_depth=1)
+        self.assertRaises(RecursionError, decoder.feed, b"llee")
+
+    def test_needed(self):
+        # needed never asks for bytes past the end of the value.
+        for value in [*VALUES, -12, b"x" * 12, [[-1, b"ab"], {b"k": 10}]]:
+            data = bencode(value)
+            decoder = IncrementalDecoder()
+            for i in range(len(data) - 1):
+                self.assertEqual([], decoder.feed(data[i : i + 1]))
+                self.assertLessEqual(decoder.needed, len(data) - i - 1)
+            self.assertEqual([value], decoder.feed(data[-1:]))
+            self.assertEqual(1, decoder.needed)
+
+    def test_max_size(self):
+        self.assertEqual(
+            [b"abc"], IncrementalDecoder(max_size=5).feed(b"3:abc")
+        )
+        # A long string is rejected from its length prefix alone.
+        self.assertRaises(
+            ValueError, IncrementalDecoder(max_size=5).feed, b"4:"
+        )
+        self.assertRaises(
+            ValueError, IncrementalDecoder(max_size=5).feed, b"li1ei2e"
+        )
+        self.assertRaises(
+            ValueError, IncrementalDecoder(max_size=5).feed, b"i123456"
+        )
+
+    def test_long_length(self):
+        self.assertRaises(ValueError, IncrementalDecoder().feed, b"1" * 21)
+
+
+class TestStreams(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(self._echo, "127.0.0.1", 0)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _echo(self, reader, writer):
+        async for value in iter_values(reader):
+            await write_value(writer, value)
+        writer.close()
+
+    async def test_round_trip(self):
+        for value in VALUES:
+            await write_value(self.writer, value)
+        for value in VALUES:
+            self.assertEqual(value, await read_value(self.reader))
+
+    async def test_large_value(self):
+        value = [b"x" * 100000, list(range(10000))]
+        await write_value(self.writer, value)
+        self.assertEqual(value, await read_value(self.reader))
+
+    async def test_split_writes(self):
+        data = bencode(VALUES)
+        for i in range(0, len(data), 7):
+            self.writer.write(data[i : i + 7])
+            await self.writer.drain()
+        self.assertEqual(VALUES, await read_value(self.reader))
+
+    async def test_iter_values(self):
+        for value in VALUES:
+            await write_value(self.writer, value)
+        self.writer.write_eof()
+        self.assertEqual(VALUES, [v async for v in iter_values(self.reader)])
+
+    async def test_truncated(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"l3:abc")
+        reader.feed_eof()
+        with self.assertRaises(asyncio.IncompleteReadError):
+            await read_value(reader)
+
+    async def test_iter_values_truncated(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"i1eli2e")
+        reader.feed_eof()
+        values = []
+        with self.assertRaises(asyncio.IncompleteReadError):
+            async for value in iter_values(reader):
+                values.append(value)
+        self.assertEqual([1], values)
+
+    async def test_read_value_long_integer(self):
+        # Integers longer than the reader's buffer limit are read in parts.
+        reader = asyncio.StreamReader(limit=16)
+        reader.feed_data(b"li" + b"7" * 100 + b"ei1ee")
+        reader.feed_eof()
+        self.assertEqual([int("7" * 100), 1], await read_value(reader))
+
+    async def test_read_value_max_size(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"l2:abel1000000:e")
+        # The long string is rejected before its contents arrive.
+        self.assertEqual([b"ab"], await read_value(reader, max_size=6))
+        with self.assertRaises(ValueError):
+            await read_value(reader, max_size=1000)
+
+    async def test_read_value_leaves_rest(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"li1eei2etrailer")
+        reader.feed_eof()
+        self.assertEqual([1], await read_value(reader))
+        self.assertEqual(2, await read_value(reader))
+        self.assertEqual(b"trailer", await reader.read())
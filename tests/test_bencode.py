@@ -17,8 +17,19 @@
 """Tests for bencode structured encoding."""
 
 import copy
+import hashlib
+import io
+import json
+import mmap
+import os
+import pickle
 import sys
-from unittest import TestCase, TestSuite
+import tempfile
+import threading
+from array import array
+from unittest import TestCase, TestSuite, mock, skipUnless
+
+from fastbencode._preserve import PreservedDict, PreservedList
 
 
 def get_named_object(module_name, member_name=None):
@@ -247,6 +258,26 @@ class TestBencodeDecode(TestCase):
         self._check(12345678901234567890, b"i12345678901234567890e")
         self._check(-12345678901234567890, b"i-12345678901234567890e")
 
+    def test_128_bit(self):
+        for n in [2**63, 2**64 - 1, 2**127 - 1, 2**127, 2**128 - 1, 2**128]:
+            self._check(n, b"i%de" % n)
+            self._check(-n, b"i-%de" % n)
+
+    @skipUnless(
+        hasattr(sys, "set_int_max_str_digits"), "no int max_str_digits"
+    )
+    def test_max_str_digits(self):
+        old_limit = sys.get_int_max_str_digits()
+        self.addCleanup(sys.set_int_max_str_digits, old_limit)
+        sys.set_int_max_str_digits(1000)
+        self._check(int("9" * 1000), b"i" + b"9" * 1000 + b"e")
+        self._run_check_error(ValueError, b"i" + b"9" * 1001 + b"e")
+        self._run_check_error(ValueError, b"i-" + b"9" * 1001 + b"e")
+        sys.set_int_max_str_digits(0)
+        digits = b"12345" * 4000
+        self._check(int(digits), b"i" + digits + b"e")
+        self._check(-int(digits), b"i-" + digits + b"e")
+
     def test_malformed_int(self):
         self._run_check_error(ValueError, b"ie")
         self._run_check_error(ValueError, b"i-e")
@@ -258,6 +289,11 @@ class TestBencodeDecode(TestCase):
         self._run_check_error(ValueError, b"i")
         self._run_check_error(ValueError, b"i123")
         self._run_check_error(ValueError, b"i341foo382e")
+        self._run_check_error(ValueError, b"i+1e")
+        self._run_check_error(ValueError, b"i 1e")
+        self._run_check_error(ValueError, b"i1_0e")
+        self._run_check_error(ValueError, b"i-+1e")
+        self._run_check_error(ValueError, b"i--1e")
 
     def test_string(self):
         self._check(b"", b"0:")
@@ -384,6 +420,211 @@ class TestBencodeDecode(TestCase):
             self.module.bdecode(deep, max_depth=None),
         )
 
+    def test_view_threshold(self):
+        source = b"d1:a3:abc1:bl0:5:hello11:hello worldee"
+        result = self.module.bdecode(source, view_threshold=5)
+        self.assertEqual(b"abc", result[b"a"])
+        self.assertIsInstance(result[b"a"], bytes)
+        self.assertEqual(b"", result[b"b"][0])
+        for view in result[b"b"][1:]:
+            self.assertIsInstance(view, memoryview)
+            self.assertTrue(view.readonly)
+            self.assertIs(source, view.obj)
+        self.assertEqual(b"hello", bytes(result[b"b"][1]))
+        self.assertEqual(b"hello world", bytes(result[b"b"][2]))
+
+    def test_view_threshold_keys_stay_bytes(self):
+        result = self.module.bdecode(
+            b"d5:alpha0:4:beta5:gammae", view_threshold=0
+        )
+        self.assertEqual([b"alpha", b"beta"], list(result))
+        for key in result:
+            self.assertIsInstance(key, bytes)
+        self.assertIsInstance(result[b"alpha"], memoryview)
+        self.assertEqual(b"gamma", bytes(result[b"beta"]))
+
+    def test_view_threshold_keeps_source_alive(self):
+        source = b"l6:" + b"x" * 6 + b"e"
+        view = self.module.bdecode(source, view_threshold=1)[0]
+        del source
+        self.assertEqual(b"xxxxxx", view.tobytes())
+
+    def test_view_threshold_as_tuple(self):
+        result = self.module.bdecode_as_tuple(
+            b"l2:abl3:cdeee", view_threshold=3
+        )
+        self.assertEqual(b"ab", result[0])
+        self.assertIsInstance(result[1], tuple)
+        self.assertIsInstance(result[1][0], memoryview)
+        self.assertEqual(b"cde", bytes(result[1][0]))
+
+    def test_view_threshold_round_trip(self):
+        for source in [b"l5:helloe", b"d1:a5:hello1:bl3:abcee"]:
+            self.assertEqual(
+                source,
+                self.module.bencode(
+                    self.module.bdecode(source, view_threshold=1)
+                ),
+            )
+
+    def test_view_threshold_does_not_stick(self):
+        calls = [
+            (self.module.bdecode, (b"3:AAA",), b"AAA"),
+            (self.module.bdecode_path, (b"d1:a3:AAAe", [b"a"]), b"AAA"),
+            (self.module.bdecode_path, (b"d1:a3:BBBe", [b"a"]), b"BBB"),
+            (self.module.bdecode_paths, (b"d1:a3:CCCe", [[b"a"]]), [b"CCC"]),
+            (
+                self.module.bdecode_with_digests,
+                (b"l3:abce", []),
+                ([b"abc"], []),
+            ),
+            (
+                self.module.bencode_to_json,
+                (b"l3:abce",),
+                b'["abc"]',
+            ),
+        ]
+        for func, args, expected in calls:
+            self.module.bdecode(b"3:abc", view_threshold=0)
+            # A memoryview would compare equal to bytes, but not in repr.
+            self.assertEqual(repr(expected), repr(func(*args)))
+        self.module.bdecode(b"3:abc", view_threshold=0)
+        self.assertEqual(
+            b'["abc"]\n',
+            self.module.bencode_to_json(b"l3:abce", lines=True),
+        )
+
+    def test_trusted(self):
+        value = {b"a": [1, -2, b"xyz"], b"b": {b"c": 0}}
+        encoded = self.module.bencode(value)
+        self.assertEqual(value, self.module.bdecode(encoded, trusted=True))
+        self.assertEqual(
+            {b"a": (1, -2, b"xyz"), b"b": {b"c": 0}},
+            self.module.bdecode_as_tuple(encoded, trusted=True),
+        )
+        self.assertEqual(
+            {"a": [1, -2, "xyz"], "b": {"c": 0}},
+            self.module.bdecode_utf8(encoded, trusted=True),
+        )
+
+    def test_trusted_skips_canonical_checks(self):
+        self.assertEqual(1, self.module.bdecode(b"i01e", trusted=True))
+        self.assertEqual(0, self.module.bdecode(b"i-0e", trusted=True))
+        self.assertEqual(b"a", self.module.bdecode(b"01:a", trusted=True))
+        self.assertEqual(
+            {b"a": b"", b"b": b""},
+            self.module.bdecode(b"d1:b0:1:a0:e", trusted=True),
+        )
+
+    def test_trusted_rejects_malformed(self):
+        for bad in [b"ie", b"i1", b"l", b"d1:ae", b"di1e0:e", b"5:ab"]:
+            self.assertRaises(
+                ValueError, self.module.bdecode, bad, trusted=True
+            )
+
+    def test_max_size(self):
+        self.assertEqual([1], self.module.bdecode(b"li1ee", max_size=5))
+        self.assertRaises(
+            ValueError, self.module.bdecode, b"li1ee", max_size=4
+        )
+
+    def test_max_items(self):
+        # Dict keys, values and containers all count.
+        source = b"d1:ali1ei2eee"
+        self.assertEqual(
+            {b"a": [1, 2]}, self.module.bdecode(source, max_items=5)
+        )
+        self.assertRaises(ValueError, self.module.bdecode, source, max_items=4)
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode_as_tuple,
+            b"l" + b"le" * 10 + b"e",
+            max_items=10,
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode_utf8, b"l0:0:e", max_items=2
+        )
+
+    def test_max_items_does_not_stick(self):
+        self.assertRaises(
+            ValueError, self.module.bdecode, b"li1ei2ee", max_items=2
+        )
+        self.assertEqual({b"a": [1, 2]}, self.module.bdecode(b"d1:ali1ei2eee"))
+
+    def test_max_items_other_thread(self):
+        # Limits set in one thread do not apply to calls in another.
+        stop = threading.Event()
+        errors = []
+
+        def limited():
+            while not stop.is_set():
+                try:
+                    self.module.bdecode(b"li1ei2ee", max_items=3)
+                except Exception as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=limited)
+        thread.start()
+        try:
+            value = {b"k%d" % i: list(range(20)) for i in range(200)}
+            encoded = self.module.bencode(value)
+            for _ in range(20):
+                self.assertEqual(value, self.module.bdecode(encoded))
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual([], errors)
+
+    def test_max_string_length(self):
+        self.assertEqual(
+            {b"ab": b"cde"},
+            self.module.bdecode(b"d2:ab3:cdee", max_string_length=3),
+        )
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode,
+            b"d2:ab3:cdee",
+            max_string_length=2,
+        )
+        # The length prefix is checked before looking for the contents.
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode,
+            b"4294967296:ab",
+            max_string_length=10,
+        )
+
+    def test_max_int_digits(self):
+        self.assertEqual(
+            [-123, 456],
+            self.module.bdecode(b"li-123ei456ee", max_int_digits=3),
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode, b"i1234e", max_int_digits=3
+        )
+        # Scanning for the end stops once too many digits have been seen.
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode,
+            b"i" + b"1" * 10000,
+            max_int_digits=3,
+        )
+
+    def test_invalid_length(self):
+        self._run_check_error(ValueError, b"-1:")
+        self._run_check_error(ValueError, b"+1:a")
+        self._run_check_error(ValueError, b" 1:a")
+        self._run_check_error(ValueError, b"1" * 100 + b":")
+
+    def test_utf8_key_order(self):
+        self.assertEqual(
+            {"a": 1, "\xe9": 2},
+            self.module.bdecode_utf8(b"d1:ai1e2:\xc3\xa9i2ee"),
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode_utf8, b"d2:\xc3\xa9i2e1:ai1ee"
+        )
+
     def test_malformed_dict(self):
         self._run_check_error(ValueError, b"d")
         self._run_check_error(ValueError, b"defoobar")
@@ -458,6 +699,260 @@ class TestBdecodeUtf8(TestCase):
     def test_invalid_utf8(self):
         self._run_check_error(UnicodeDecodeError, b"3:\xff\xfe\xfd")
 
+    def test_invalid_utf8_key(self):
+        self._run_check_error(UnicodeDecodeError, b"d1:\xffi1ee")
+
+    def test_options(self):
+        # trusted comes straight after max_depth; there is no view_threshold,
+        # as str values cannot be views of the input.
+        self.assertEqual(1, self.module.bdecode_utf8(b"i01e", None, True))
+        self.assertRaises(
+            TypeError, self.module.bdecode_utf8, b"0:", view_threshold=0
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode_utf8, b"3:abc", max_size=4
+        )
+
+
+class TestBdecodeKeysUtf8(TestCase):
+    module = None
+
+    def test_keys_str_values_bytes(self):
+        self.assertEqual(
+            {"a": b"xyz", "\xe9": [b"\xff", {"b": 1}]},
+            self.module.bdecode_keys_utf8(
+                b"d1:a3:xyz2:\xc3\xa9l1:\xffd1:bi1eeee"
+            ),
+        )
+
+    def test_keys_interned(self):
+        result = self.module.bdecode_keys_utf8(b"ld4:namei1eed4:namei2eee")
+        first, second = (next(iter(d)) for d in result)
+        self.assertIs(first, second)
+
+    def test_view_threshold(self):
+        result = self.module.bdecode_keys_utf8(
+            b"d5:alpha5:gammae", view_threshold=5
+        )
+        self.assertEqual(["alpha"], list(result))
+        self.assertIsInstance(result["alpha"], memoryview)
+
+    def test_key_order(self):
+        self.assertRaises(
+            ValueError, self.module.bdecode_keys_utf8, b"d1:bi1e1:ai2ee"
+        )
+
+    def test_invalid_utf8_key(self):
+        self.assertRaises(
+            UnicodeDecodeError, self.module.bdecode_keys_utf8, b"d1:\xffi1ee"
+        )
+
+
+class TestBcanonicalize(TestCase):
+    module = None
+
+    def test_canonical_unchanged(self):
+        source = self.module.bencode(
+            {b"a": [1, -2, b"xyz", []], b"b": {b"c": 0, b"d": {}}}
+        )
+        self.assertEqual(source, self.module.bcanonicalize(source))
+
+    def test_sorts_keys(self):
+        self.assertEqual(
+            b"d1:ai2e1:bd1:ci3e1:di4eee",
+            self.module.bcanonicalize(b"d1:bd1:di4e1:ci3ee1:ai2ee"),
+        )
+
+    def test_normalizes_numbers(self):
+        self.assertEqual(
+            b"li7ei-7ei0ei0e3:abce",
+            self.module.bcanonicalize(b"li007ei-007ei-0ei000e03:abce"),
+        )
+
+    def test_duplicates(self):
+        source = b"d1:ai1e1:bi2e1:ai3ee"
+        self.assertRaises(ValueError, self.module.bcanonicalize, source)
+        self.assertEqual(
+            b"d1:ai1e1:bi2ee",
+            self.module.bcanonicalize(source, duplicates="first"),
+        )
+        self.assertEqual(
+            b"d1:ai3e1:bi2ee",
+            self.module.bcanonicalize(source, duplicates="last"),
+        )
+        self.assertRaises(
+            ValueError, self.module.bcanonicalize, source, duplicates="x"
+        )
+
+    def test_malformed(self):
+        for bad in [b"", b"i1", b"d1:a", b"di1ei2ee", b"d1:ae", b"i1ex"]:
+            self.assertRaises(ValueError, self.module.bcanonicalize, bad)
+
+    def test_max_depth(self):
+        self.assertEqual(
+            b"llee", self.module.bcanonicalize(b"llee", max_depth=2)
+        )
+        self.assertRaises(
+            RecursionError, self.module.bcanonicalize, b"llee", max_depth=1
+        )
+
+    def test_type_error(self):
+        self.assertRaises(TypeError, self.module.bcanonicalize, "le")
+
+
+class TestBencodeToJson(TestCase):
+    module = None
+
+    def test_value(self):
+        value = {b"a": [1, -2, b"xyz", []], b"b": {b"c": 0, b"d": {}}}
+        self.assertEqual(
+            b'{"a":[1,-2,"xyz",[]],"b":{"c":0,"d":{}}}',
+            self.module.bencode_to_json(self.module.bencode(value)),
+        )
+
+    def test_matches_json_dumps(self):
+        text = '\x01\x1f\x7f\b\f\n\r\t"\\/ \xe9\u2028\U0001f600'
+        encoded = text.encode("utf-8")
+        self.assertEqual(
+            json.dumps([text], ensure_ascii=False).encode("utf-8"),
+            self.module.bencode_to_json(self.module.bencode([encoded])),
+        )
+
+    def test_binary(self):
+        source = self.module.bencode({b"\xff": [b"\x00\xfe\xfd\xfc"]})
+        self.assertEqual(
+            b'{"/w==":["AP79/A=="]}', self.module.bencode_to_json(source)
+        )
+        self.assertEqual(
+            b'{"ff":["00fefdfc"]}',
+            self.module.bencode_to_json(source, binary="hex"),
+        )
+        self.assertRaises(
+            ValueError, self.module.bencode_to_json, source, binary="x"
+        )
+
+    def test_binary_key_collision(self):
+        # b"\xff" is written as the same string as the key b"/w==".
+        source = b"ld4:/w==i1e1:\xffi2eee"
+        self.assertRaises(ValueError, self.module.bencode_to_json, source)
+        self.assertRaises(
+            ValueError, self.module.bencode_to_json, source, lines=True
+        )
+        self.assertEqual(
+            b'[{"/w==":1,"ff":2}]',
+            self.module.bencode_to_json(source, binary="hex"),
+        )
+        self.assertRaises(
+            ValueError,
+            self.module.bencode_to_json,
+            b"d2:ff0:1:\xff0:e",
+            binary="hex",
+        )
+
+    def test_large_int(self):
+        self.assertEqual(
+            b"[%d]" % 10**50,
+            self.module.bencode_to_json(b"li%dee" % 10**50),
+        )
+
+    @skipUnless(
+        hasattr(sys, "set_int_max_str_digits"), "no int max_str_digits"
+    )
+    def test_max_str_digits(self):
+        # Integers are copied as they are, but within the same limit as
+        # when decoding them.
+        old_limit = sys.get_int_max_str_digits()
+        self.addCleanup(sys.set_int_max_str_digits, old_limit)
+        sys.set_int_max_str_digits(1000)
+        digits = b"9" * 1000
+        self.assertEqual(
+            b"[-" + digits + b"]",
+            self.module.bencode_to_json(b"li-" + digits + b"ee"),
+        )
+        self.assertRaises(
+            ValueError, self.module.bencode_to_json, b"i" + digits + b"9e"
+        )
+        self.assertRaises(
+            ValueError,
+            self.module.bencode_to_json,
+            b"li-" + digits + b"9ee",
+            lines=True,
+        )
+        sys.set_int_max_str_digits(0)
+        digits = b"12345" * 4000
+        self.assertEqual(
+            digits, self.module.bencode_to_json(b"i" + digits + b"e")
+        )
+
+    def test_lines(self):
+        source = b"".join(
+            self.module.bencode(v) for v in [{b"id": 1}, [b"a"], 2]
+        )
+        self.assertEqual(
+            b'{"id":1}\n["a"]\n2\n',
+            self.module.bencode_to_json(source, lines=True),
+        )
+        self.assertEqual(b"", self.module.bencode_to_json(b"", lines=True))
+
+    def test_malformed(self):
+        for bad in [b"", b"i01e", b"d1:bi1e1:ai2ee", b"l", b"le1"]:
+            self.assertRaises(ValueError, self.module.bencode_to_json, bad)
+        for bad in [b"lei1", b"3:ab", b"i1ee"]:
+            self.assertRaises(
+                ValueError, self.module.bencode_to_json, bad, lines=True
+            )
+
+    def test_max_depth(self):
+        self.assertEqual(
+            b"[[]]", self.module.bencode_to_json(b"llee", max_depth=2)
+        )
+        self.assertRaises(
+            RecursionError, self.module.bencode_to_json, b"llee", max_depth=1
+        )
+
+
+class TestBdecodeItemOffsets(TestCase):
+    module = None
+
+    def test_list(self):
+        self.assertEqual(
+            [1, 4, 9, 11],
+            self.module.bdecode_item_offsets(b"li1e3:abclee"),
+        )
+        self.assertEqual([1], self.module.bdecode_item_offsets(b"le"))
+
+    def test_dict(self):
+        self.assertEqual(
+            [1, 7, 12],
+            self.module.bdecode_item_offsets(b"d1:ai1e1:bdee"),
+        )
+
+    def test_checks_input(self):
+        for bad in [
+            b"i1e",
+            b"d1:bi1e1:ai2ee",
+            b"li01ee",
+            b"ld1:bi1e1:ai2eee",
+            b"li1e",
+            b"lei1e",
+            b"di1ei2ee",
+            b"d1:ae",
+        ]:
+            self.assertRaises(
+                ValueError, self.module.bdecode_item_offsets, bad
+            )
+
+    def test_max_depth(self):
+        self.assertEqual(
+            [1, 3], self.module.bdecode_item_offsets(b"llee", max_depth=2)
+        )
+        self.assertRaises(
+            RecursionError,
+            self.module.bdecode_item_offsets,
+            b"llee",
+            max_depth=1,
+        )
+
 
 class TestBencodeEncode(TestCase):
     module = None
@@ -474,6 +969,26 @@ class TestBencodeEncode(TestCase):
         self._check(b"i12345678901234567890e", 12345678901234567890)
         self._check(b"i-12345678901234567890e", -12345678901234567890)
 
+    def test_128_bit(self):
+        for n in [2**63, 2**64 - 1, 2**127 - 1, 2**127, 2**128 - 1, 2**128]:
+            self._check(b"i%de" % n, n)
+            self._check(b"i-%de" % n, -n)
+
+    @skipUnless(
+        hasattr(sys, "set_int_max_str_digits"), "no int max_str_digits"
+    )
+    def test_max_str_digits(self):
+        old_limit = sys.get_int_max_str_digits()
+        self.addCleanup(sys.set_int_max_str_digits, old_limit)
+        sys.set_int_max_str_digits(1000)
+        self._check(b"i" + b"9" * 1000 + b"e", int("9" * 1000))
+        self.assertRaises(ValueError, self.module.bencode, 10**1000)
+        self.assertRaises(ValueError, self.module.bencode, -(10**5000))
+        sys.set_int_max_str_digits(0)
+        digits = b"12345" * 4000
+        self._check(b"i" + digits + b"e", int(digits))
+        self._check(b"i-" + digits + b"e", -int(digits))
+
     def test_string(self):
         self._check(b"0:", b"")
         self._check(b"3:abc", b"abc")
@@ -565,6 +1080,17 @@ class TestBencodeEncode(TestCase):
     def test_bencached(self):
         self._check(b"i3e", self.module.Bencached(self.module.bencode(3)))
 
+    def test_memoryview(self):
+        self._check(b"3:ell", memoryview(b"hello")[1:4])
+        self._check(b"l0:e", [memoryview(b"")])
+        # Lengths count bytes, not items.
+        self._check(
+            b"4:\x01\x00\x02\x00", memoryview(b"\x01\x00\x02\x00").cast("H")
+        )
+        self.assertRaises(
+            TypeError, self.module.bencode, memoryview(b"hello")[::2]
+        )
+
     def test_invalid_dict(self):
         self.assertRaises(TypeError, self.module.bencode, {1: b"foo"})
 
@@ -601,3 +1127,707 @@ class TestBencodeEncodeUtf8(TestCase):
             b"d8:spam.mp3d6:author5:Alice6:lengthi100000eee",
             {b"spam.mp3": {b"author": b"Alice", b"length": 100000}},
         )
+
+
+class TestBdecodePath(TestCase):
+    module = None
+
+    doc = (
+        b"d4:infod6:lengthi10e4:name5:a.txt6:piecesl1:a1:bee"
+        b"8:trackers8:http://xe"
+    )
+
+    def test_path(self):
+        self.assertEqual(
+            b"a.txt", self.module.bdecode_path(self.doc, [b"info", b"name"])
+        )
+        self.assertEqual(
+            b"http://x", self.module.bdecode_path(self.doc, (b"trackers",))
+        )
+        self.assertEqual(
+            b"b", self.module.bdecode_path(self.doc, [b"info", b"pieces", 1])
+        )
+
+    def test_subtree(self):
+        self.assertEqual(
+            self.module.bdecode(self.doc)[b"info"],
+            self.module.bdecode_path(self.doc, [b"info"]),
+        )
+
+    def test_empty_path(self):
+        self.assertEqual(
+            self.module.bdecode(self.doc),
+            self.module.bdecode_path(self.doc, []),
+        )
+
+    def test_missing(self):
+        for path in [
+            [b"missing"],
+            [b"info", b"zzz"],
+            [b"info", b"pieces", 2],
+            [b"info", b"length", b"x"],
+            [0],
+        ]:
+            with self.assertRaises(KeyError) as cm:
+                self.module.bdecode_path(self.doc, path)
+            self.assertEqual((tuple(path),), cm.exception.args)
+
+    def test_paths(self):
+        self.assertEqual(
+            [b"a.txt", 10, [b"a", b"b"], b"a"],
+            self.module.bdecode_paths(
+                self.doc,
+                [
+                    [b"info", b"name"],
+                    [b"info", b"length"],
+                    [b"info", b"pieces"],
+                    [b"info", b"pieces", 0],
+                ],
+            ),
+        )
+
+    def test_truncated_target(self):
+        # The found string runs past the end of the input.
+        self.assertRaises(
+            ValueError, self.module.bdecode_path, b"d1:a10:abce", [b"a"]
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode_paths, b"l3:ab", [[0]]
+        )
+
+    def test_paths_missing(self):
+        self.assertRaises(
+            KeyError,
+            self.module.bdecode_paths,
+            self.doc,
+            [[b"info", b"name"], [b"nope"]],
+        )
+
+    def test_skipped_values_are_checked(self):
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode_path,
+            b"d1:ai01e1:bi1ee",
+            [b"b"],
+        )
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode_path,
+            b"d1:ad1:bi1e1:ai1ee1:bi1ee",
+            [b"b"],
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode_path, b"d1:bi1e1:ai1ee", [b"a"]
+        )
+
+    def test_stops_once_found(self):
+        # Nothing after the requested value is looked at.
+        self.assertEqual(
+            1, self.module.bdecode_path(b"d1:ai1e1:bgarbage", [b"a"])
+        )
+
+    def test_max_depth(self):
+        self.assertRaises(
+            RecursionError,
+            self.module.bdecode_path,
+            b"d1:ad1:bleee",
+            [b"a", b"b"],
+            max_depth=2,
+        )
+        self.assertEqual(
+            [],
+            self.module.bdecode_path(
+                b"d1:ad1:bleee", [b"a", b"b"], max_depth=3
+            ),
+        )
+        self.assertRaises(
+            RecursionError,
+            self.module.bdecode_path,
+            b"d1:alle1:bi1ee",
+            [b"b"],
+            max_depth=2,
+        )
+
+    def test_invalid_path(self):
+        self.assertRaises(
+            TypeError, self.module.bdecode_path, self.doc, ["info"]
+        )
+        self.assertRaises(TypeError, self.module.bdecode_path, self.doc, [-1])
+
+    def test_type_error(self):
+        self.assertRaises(TypeError, self.module.bdecode_path, "de", [])
+
+
+class TestBdecodeWithDigests(TestCase):
+    module = None
+
+    info = b"d6:lengthi10e4:name5:a.txt6:piecesl1:a1:bee"
+    doc = b"d8:announce1:x4:info" + info + b"e"
+
+    def test_info_hash(self):
+        value, digests = self.module.bdecode_with_digests(
+            self.doc, [[b"info"]]
+        )
+        self.assertEqual(self.module.bdecode(self.doc), value)
+        self.assertEqual([hashlib.sha1(self.info).digest()], digests)
+
+    def test_algorithm(self):
+        _, digests = self.module.bdecode_with_digests(
+            self.doc, [(b"info",)], algorithm="sha256"
+        )
+        self.assertEqual([hashlib.sha256(self.info).digest()], digests)
+
+    def test_several_paths(self):
+        _, digests = self.module.bdecode_with_digests(
+            self.doc,
+            [[], [b"announce"], [b"info", b"pieces", 1], [b"info", b"length"]],
+        )
+        self.assertEqual(
+            [
+                hashlib.sha1(self.doc).digest(),
+                hashlib.sha1(b"1:x").digest(),
+                hashlib.sha1(b"1:b").digest(),
+                hashlib.sha1(b"i10e").digest(),
+            ],
+            digests,
+        )
+
+    def test_nested_list(self):
+        value, _ = self.module.bdecode_with_digests(b"ll1:aee", [[0, 0]])
+        self.assertEqual([[b"a"]], value)
+
+    def test_missing(self):
+        with self.assertRaises(KeyError) as cm:
+            self.module.bdecode_with_digests(self.doc, [[b"info", b"x"]])
+        self.assertEqual(((b"info", b"x"),), cm.exception.args)
+
+    def test_invalid(self):
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode_with_digests,
+            self.doc + b"junk",
+            [[b"info"]],
+        )
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode_with_digests,
+            self.doc,
+            [[b"info"]],
+            algorithm="no-such-hash",
+        )
+
+    def test_max_depth(self):
+        self.assertRaises(
+            RecursionError,
+            self.module.bdecode_with_digests,
+            self.doc,
+            [[b"info"]],
+            max_depth=1,
+        )
+
+
+class TestBdecodePreserving(TestCase):
+    module = None
+
+    doc = (
+        b"d4:infod6:lengthi10e4:name5:a.txte"
+        b"5:peersl2:p12:p2e4:tagsli1ed1:ki-3eeee"
+    )
+
+    def test_types(self):
+        value = self.module.bdecode_preserving(self.doc)
+        self.assertIsInstance(value, PreservedDict)
+        self.assertIsInstance(value[b"info"], PreservedDict)
+        self.assertIsInstance(value[b"peers"], PreservedList)
+        self.assertIsInstance(value[b"tags"][1], PreservedDict)
+        self.assertEqual(self.module.bdecode(self.doc), value)
+
+    def test_unchanged(self):
+        value = self.module.bdecode_preserving(self.doc)
+        self.assertEqual(self.doc, self.module.bencode(value))
+        self.assertEqual(
+            b"d6:lengthi10e4:name5:a.txte", bytes(value[b"info"]._raw)
+        )
+
+    def test_unchanged_is_spliced(self):
+        value = self.module.bdecode_preserving(b"li1ee")
+        value._raw = memoryview(b"li2ee")
+        self.assertEqual(b"lli2eee", self.module.bencode([value]))
+
+    def test_modified(self):
+        value = self.module.bdecode_preserving(self.doc)
+        value[b"tags"][1][b"k"] = 4
+        self.assertIsNone(value[b"tags"][1]._raw)
+        self.assertIsNone(value[b"tags"]._raw)
+        self.assertIsNone(value._raw)
+        self.assertIsNotNone(value[b"info"]._raw)
+        self.assertIsNotNone(value[b"peers"]._raw)
+        expected = self.module.bdecode(self.doc)
+        expected[b"tags"][1][b"k"] = 4
+        self.assertEqual(
+            self.module.bencode(expected), self.module.bencode(value)
+        )
+
+    def test_list_mutators(self):
+        mutations = [
+            lambda v: v.__setitem__(0, b"x"),
+            lambda v: v.__delitem__(0),
+            lambda v: v.__iadd__([b"x"]),
+            lambda v: v.__imul__(2),
+            lambda v: v.append(b"x"),
+            lambda v: v.clear(),
+            lambda v: v.extend([b"x"]),
+            lambda v: v.insert(0, b"x"),
+            lambda v: v.pop(),
+            lambda v: v.remove(b"p1"),
+            lambda v: v.reverse(),
+            lambda v: v.sort(reverse=True),
+        ]
+        for mutate in mutations:
+            value = self.module.bdecode_preserving(self.doc)
+            mutate(value[b"peers"])
+            self.assertIsNone(value._raw)
+            expected = self.module.bdecode(self.doc)
+            mutate(expected[b"peers"])
+            self.assertEqual(
+                self.module.bencode(expected), self.module.bencode(value)
+            )
+
+    def test_dict_mutators(self):
+        mutations = [
+            lambda v: v.__setitem__(b"name", b"b.txt"),
+            lambda v: v.__delitem__(b"name"),
+            lambda v: v.__ior__({b"x": 1}),
+            lambda v: v.clear(),
+            lambda v: v.pop(b"name"),
+            lambda v: v.popitem(),
+            lambda v: v.setdefault(b"x", 1),
+            lambda v: v.update(x=1),
+        ]
+        for mutate in mutations:
+            value = self.module.bdecode_preserving(self.doc)
+            mutate(value[b"info"])
+            self.assertIsNone(value._raw)
+            self.assertIsNotNone(value[b"peers"]._raw)
+
+    def test_copy(self):
+        # Copies lose the original encoding, but encode the same.
+        value = self.module.bdecode_preserving(self.doc)
+        for copied in [
+            pickle.loads(pickle.dumps(value)),
+            copy.deepcopy(value),
+            copy.copy(value),
+        ]:
+            self.assertIsInstance(copied, PreservedDict)
+            self.assertIsInstance(copied[b"peers"], PreservedList)
+            self.assertIsNone(copied._raw)
+            self.assertEqual(value, copied)
+            self.assertEqual(self.doc, self.module.bencode(copied))
+        copied = copy.deepcopy(value)
+        copied[b"peers"].append(b"p3")
+        self.assertEqual(self.doc, self.module.bencode(value))
+        self.assertEqual(
+            [b"p1", b"p2", b"p3"],
+            self.module.bdecode(self.module.bencode(copied))[b"peers"],
+        )
+
+    def test_inside_plain_container(self):
+        value = self.module.bdecode_preserving(self.doc)
+        self.assertEqual(b"l" + self.doc + b"e", self.module.bencode([value]))
+
+    def test_options(self):
+        # The same options as bdecode are accepted.
+        value = self.module.bdecode_preserving(self.doc, view_threshold=5)
+        self.assertIsInstance(value[b"info"][b"name"], memoryview)
+        self.assertEqual(self.doc, self.module.bencode(value))
+        # Views are written out again once their container has changed.
+        value = self.module.bdecode_preserving(
+            b"d1:a5:hello1:bi1ee", view_threshold=3
+        )
+        value[b"b"] = 2
+        self.assertEqual(b"d1:a5:hello1:bi2ee", self.module.bencode(value))
+        self.assertEqual(
+            {b"b": [1], b"a": 2},
+            self.module.bdecode_preserving(b"d1:bli01ee1:ai2ee", trusted=True),
+        )
+        for limit in [
+            {"max_size": 10},
+            {"max_items": 10},
+            {"max_string_length": 4},
+            {"max_int_digits": 1},
+        ]:
+            self.assertRaises(
+                ValueError, self.module.bdecode_preserving, self.doc, **limit
+            )
+
+    def test_invalid(self):
+        self.assertRaises(
+            ValueError, self.module.bdecode_preserving, b"d1:b0:1:a0:e"
+        )
+        self.assertRaises(ValueError, self.module.bdecode_preserving, b"l")
+        self.assertRaises(
+            RecursionError,
+            self.module.bdecode_preserving,
+            b"llee",
+            max_depth=1,
+        )
+
+
+class TestColumns(TestCase):
+    module = None
+
+    records = [
+        {b"id": 1, b"name": b"a", b"tags": [b"x"], b"ts": -5},
+        {b"id": 2, b"name": b"bb", b"tags": [], b"ts": 2**40},
+        {b"id": 3, b"name": b"", b"tags": [b"y"], b"ts": 0},
+    ]
+
+    def test_bdecode_columns(self):
+        data = self.module.bencode({b"data": {b"records": self.records}})
+        columns = self.module.bdecode_columns(
+            data, [b"data", b"records"], [b"ts", b"name", b"id"]
+        )
+        self.assertEqual([b"ts", b"name", b"id"], list(columns))
+        self.assertEqual(array("q", [-5, 2**40, 0]), columns[b"ts"])
+        self.assertEqual(array("q", [1, 2, 3]), columns[b"id"])
+        self.assertEqual([b"a", b"bb", b""], columns[b"name"])
+
+    def test_list_index_path(self):
+        data = self.module.bencode([b"x", self.records])
+        columns = self.module.bdecode_columns(data, [1], [b"id"])
+        self.assertEqual(array("q", [1, 2, 3]), columns[b"id"])
+
+    def test_empty(self):
+        columns = self.module.bdecode_columns(b"le", [], [b"id"])
+        self.assertEqual({b"id": array("q")}, columns)
+
+    def test_missing_path(self):
+        data = self.module.bencode({b"data": self.records})
+        with self.assertRaises(KeyError) as cm:
+            self.module.bdecode_columns(data, [b"nope"], [b"id"])
+        self.assertEqual(((b"nope",),), cm.exception.args)
+        self.assertRaises(
+            KeyError, self.module.bdecode_columns, data, [b"data", 3], [b"id"]
+        )
+
+    def test_missing_field(self):
+        data = self.module.bencode([{b"a": 1, b"b": 2}, {b"a": 3}])
+        with self.assertRaises(KeyError) as cm:
+            self.module.bdecode_columns(data, [], [b"a", b"b"])
+        self.assertEqual((b"b",), cm.exception.args)
+
+    def test_invalid(self):
+        bad = [
+            (b"d1:ai1ee", ValueError),
+            (b"li1ee", ValueError),
+            (b"ld1:ali1eeee", ValueError),
+            (b"ld1:ai1eed1:a1:xee", ValueError),
+            (b"ld1:bi1e1:ai1eee", ValueError),
+            (b"ld1:ai1e", ValueError),
+            (b"ld1:ai99999999999999999999eee", OverflowError),
+        ]
+        for data, exc in bad:
+            self.assertRaises(
+                exc, self.module.bdecode_columns, data, [], [b"a"]
+            )
+        self.assertRaises(
+            TypeError, self.module.bdecode_columns, b"le", [], ["a"]
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode_columns, b"le", [], [b"a", b"a"]
+        )
+
+    def test_max_depth(self):
+        data = self.module.bencode({b"r": self.records})
+        self.assertRaises(
+            RecursionError,
+            self.module.bdecode_columns,
+            data,
+            [b"r"],
+            [b"id"],
+            max_depth=2,
+        )
+        self.assertEqual(
+            array("q", [1, 2, 3]),
+            self.module.bdecode_columns(data, [b"r"], [b"id"], max_depth=4)[
+                b"id"
+            ],
+        )
+
+    def test_numpy(self):
+        try:
+            import numpy
+        except ModuleNotFoundError:
+            self.skipTest("numpy is not installed")
+        data = self.module.bencode(self.records)
+        columns = self.module.bdecode_columns(
+            data, [], [b"id", b"name"], numpy=True
+        )
+        self.assertEqual(numpy.int64, columns[b"id"].dtype)
+        self.assertEqual(object, columns[b"name"].dtype)
+        self.assertEqual([1, 2, 3], columns[b"id"].tolist())
+        self.assertEqual([b"a", b"bb", b""], columns[b"name"].tolist())
+        self.assertEqual(
+            self.module.bencode(
+                [{k: r[k] for k in (b"id", b"name")} for r in self.records]
+            ),
+            self.module.bencode_columns(columns),
+        )
+
+    def test_numpy_binary(self):
+        try:
+            import numpy
+        except ModuleNotFoundError:
+            self.skipTest("numpy is not installed")
+        # Trailing NUL bytes are kept, and values are not padded.
+        data = self.module.bencode(
+            [{b"hash": b"ab\x00\x00"}, {b"hash": b"\x00"}, {b"hash": b""}]
+        )
+        columns = self.module.bdecode_columns(data, [], [b"hash"], numpy=True)
+        self.assertEqual(object, columns[b"hash"].dtype)
+        self.assertEqual(
+            [b"ab\x00\x00", b"\x00", b""], columns[b"hash"].tolist()
+        )
+        self.assertEqual(data, self.module.bencode_columns(columns))
+        # Object arrays built by the caller are encoded the same way.
+        hashes = numpy.array([b"ab\x00\x00", b"\x00", b""], dtype=object)
+        self.assertEqual(data, self.module.bencode_columns({b"hash": hashes}))
+
+    def test_bencode_columns(self):
+        columns = {
+            b"name": [b"a", b"bb"],
+            b"id": array("q", [1, 2]),
+            b"tags": [[b"x"], []],
+        }
+        self.assertEqual(
+            self.module.bencode(
+                [
+                    {b"id": 1, b"name": b"a", b"tags": [b"x"]},
+                    {b"id": 2, b"name": b"bb", b"tags": []},
+                ]
+            ),
+            self.module.bencode_columns(columns),
+        )
+        self.assertEqual(b"le", self.module.bencode_columns({}))
+
+    def test_bencode_columns_round_trip(self):
+        fields = [b"id", b"name", b"ts"]
+        data = self.module.bencode(
+            [{k: r[k] for k in fields} for r in self.records]
+        )
+        columns = self.module.bdecode_columns(data, [], fields)
+        self.assertEqual(data, self.module.bencode_columns(columns))
+
+    def test_bencode_columns_invalid(self):
+        self.assertRaises(
+            ValueError,
+            self.module.bencode_columns,
+            {b"a": [1, 2], b"b": [1]},
+        )
+        self.assertRaises(TypeError, self.module.bencode_columns, {"a": [1]})
+
+
+class TestFrames(TestCase):
+    module = None
+
+    def test_bencode_frame(self):
+        self.assertEqual(
+            b"\x00\x00\x00\x08li1ei2ee", self.module.bencode_frame([1, 2])
+        )
+        self.assertEqual(
+            b"8:li1ei2ee,", self.module.bencode_frame([1, 2], netstring=True)
+        )
+        self.assertEqual(
+            b"12:d1:a5:helloe,",
+            self.module.bencode_frame({b"a": b"hello"}, netstring=True),
+        )
+
+    def test_bencode_frame_max_depth(self):
+        self.assertRaises(
+            RecursionError, self.module.bencode_frame, [[1]], max_depth=1
+        )
+
+    def test_bdecode_frames(self):
+        values = [1, b"abc", [1, [2]], {b"a": b"b"}]
+        for netstring in (False, True):
+            data = b"".join(
+                self.module.bencode_frame(v, netstring=netstring)
+                for v in values
+            )
+            self.assertEqual(
+                (values, len(data)),
+                self.module.bdecode_frames(data, netstring=netstring),
+            )
+
+    def test_partial(self):
+        for netstring in (False, True):
+            first = self.module.bencode_frame(b"abc", netstring=netstring)
+            second = self.module.bencode_frame([1, 2], netstring=netstring)
+            data = first + second
+            for i in range(len(first), len(data)):
+                self.assertEqual(
+                    ([b"abc"], len(first)),
+                    self.module.bdecode_frames(data[:i], netstring=netstring),
+                )
+
+    def test_empty(self):
+        self.assertEqual(([], 0), self.module.bdecode_frames(b""))
+        self.assertEqual(
+            ([], 0), self.module.bdecode_frames(b"", netstring=True)
+        )
+
+    def test_length_mismatch(self):
+        self.assertRaises(
+            ValueError, self.module.bdecode_frames, b"\x00\x00\x00\x04i1ee"
+        )
+        self.assertRaises(
+            ValueError, self.module.bdecode_frames, b"\x00\x00\x00\x02i1e"
+        )
+        self.assertRaises(
+            ValueError,
+            self.module.bdecode_frames,
+            b"4:i1ee,",
+            netstring=True,
+        )
+
+    def test_malformed_netstring(self):
+        for bad in [b"3:i1e;", b"x:", b"03:i1e,", b":i1e,", b"1" * 30]:
+            self.assertRaises(
+                ValueError, self.module.bdecode_frames, bad, netstring=True
+            )
+
+    def test_max_depth(self):
+        self.assertRaises(
+            RecursionError,
+            self.module.bdecode_frames,
+            self.module.bencode_frame([[1]]),
+            max_depth=1,
+        )
+
+    def test_type_error(self):
+        self.assertRaises(TypeError, self.module.bdecode_frames, "abc")
+
+
+class TestBencodeFile(TestCase):
+    module = None
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def _write(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def test_bdecode_file(self):
+        self._write(b"d1:ai1e1:bl3:abcee")
+        self.assertEqual(
+            {b"a": 1, b"b": [b"abc"]}, self.module.bdecode_file(self.path)
+        )
+
+    def test_bload(self):
+        self._write(b"li1ei2ee")
+        with open(self.path, "rb") as f:
+            self.assertEqual([1, 2], self.module.bload(f))
+
+    def test_bload_without_fileno(self):
+        self.assertEqual([1, 2], self.module.bload(io.BytesIO(b"li1ei2ee")))
+
+    def test_bload_pipe(self):
+        r, w = os.pipe()
+        with os.fdopen(r, "rb") as f:
+            with os.fdopen(w, "wb") as wf:
+                wf.write(b"li1ei2ee")
+            self.assertEqual([1, 2], self.module.bload(f))
+
+    def test_bload_from_position(self):
+        # Decoding starts at the file's position, and leaves it at the end.
+        self._write(b"HEADERl3:abc10:0123456789e")
+        with open(self.path, "rb") as f:
+            f.read(6)
+            self.assertEqual([b"abc", b"0123456789"], self.module.bload(f))
+            self.assertEqual(26, f.tell())
+        with open(self.path, "rb") as f:
+            f.read(6)
+            result = self.module.bload(f, view_threshold=4)
+            self.assertEqual(b"0123456789", bytes(result[1]))
+            self.assertEqual(26, f.tell())
+        f = io.BytesIO(b"HEADERli1ee")
+        f.read(6)
+        self.assertEqual([1], self.module.bload(f))
+        self.assertEqual(11, f.tell())
+
+    def test_bload_at_end(self):
+        self._write(b"i1e")
+        with open(self.path, "rb") as f:
+            f.read()
+            self.assertRaises(ValueError, self.module.bload, f)
+
+    def test_empty_file(self):
+        self._write(b"")
+        self.assertRaises(ValueError, self.module.bdecode_file, self.path)
+
+    def test_junk(self):
+        self._write(b"i1ejunk")
+        self.assertRaises(ValueError, self.module.bdecode_file, self.path)
+
+    def test_max_depth(self):
+        self._write(b"llee")
+        self.assertRaises(
+            RecursionError, self.module.bdecode_file, self.path, max_depth=1
+        )
+
+    def test_view_threshold(self):
+        self._write(b"l3:abc10:0123456789e")
+        result = self.module.bdecode_file(self.path, view_threshold=4)
+        self.assertEqual(b"abc", result[0])
+        self.assertIsInstance(result[0], bytes)
+        # The view outlives the file being closed.
+        self.assertIsInstance(result[1], memoryview)
+        self.assertTrue(result[1].readonly)
+        self.assertEqual(b"0123456789", bytes(result[1]))
+
+    def test_mapping_closed_without_views(self):
+        # The mapping is only left open for views returned to the caller.
+        mappings = []
+        real_mmap = mmap.mmap
+
+        def record(*args, **kwargs: object):
+            mappings.append(real_mmap(*args, **kwargs))
+            return mappings[-1]
+
+        self._write(b"l3:abc10:0123456789e")
+        with mock.patch.object(mmap, "mmap", record):
+            for view_threshold in [None, 20]:
+                result = self.module.bdecode_file(
+                    self.path, view_threshold=view_threshold
+                )
+                self.assertEqual([b"abc", b"0123456789"], result)
+                self.assertTrue(mappings.pop().closed)
+            result = self.module.bdecode_file(self.path, view_threshold=4)
+            self.assertFalse(mappings.pop().closed)
+            self.assertEqual(b"0123456789", bytes(result[1]))
+
+    def test_bdump(self):
+        value = {b"a": [1, b"xyz"], b"b": {b"c": -3}}
+        with open(self.path, "wb") as f:
+            self.module.bdump(value, f)
+        with open(self.path, "rb") as f:
+            self.assertEqual(self.module.bencode(value), f.read())
+        self.assertEqual(value, self.module.bdecode_file(self.path))
+
+    def test_bdump_large(self):
+        value = [b"x" * 100000] * 30
+        f = io.BytesIO()
+        self.module.bdump(value, f)
+        self.assertEqual(self.module.bencode(value), f.getvalue())
+
+    def test_bdump_max_depth(self):
+        self.assertRaises(
+            RecursionError,
+            self.module.bdump,
+            [[1]],
+            io.BytesIO(),
+            max_depth=1,
+        )
@@ -0,0 +1,121 @@
+# Copyright (C) 2026 Breezy Developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Tests for multi-process encoding and decoding."""
+
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase
+
+from fastbencode import bdecode, bencode, parallel
+from fastbencode.parallel import bdecode_parallel, bencode_parallel
+
+RECORDS = [
+    {b"id": i, b"name": b"n%d" % i, b"tags": [i, b"x"]} for i in range(500)
+]
+
+TABLE = {b"key%05d" % i: [i, b"v" * (i % 7)] for i in range(500)}
+
+
+class TestParallel(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.executor = ProcessPoolExecutor(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.executor.shutdown()
+
+    def setUp(self):
+        # Split even small values up, so the tests stay quick.
+        for name in ["MIN_DECODE_SIZE", "MIN_ENCODE_ITEMS"]:
+            self.addCleanup(setattr, parallel, name, getattr(parallel, name))
+            setattr(parallel, name, 0)
+
+    def test_encode_list(self):
+        for value in [RECORDS, tuple(RECORDS)]:
+            self.assertEqual(
+                bencode(value),
+                bencode_parallel(value, workers=2, executor=self.executor),
+            )
+
+    def test_encode_dict(self):
+        # Items are encoded in key order whatever order they were added in.
+        value = dict(reversed(TABLE.items()))
+        self.assertEqual(
+            bencode(value),
+            bencode_parallel(value, workers=2, executor=self.executor),
+        )
+
+    def test_encode_bad_key(self):
+        self.assertRaises(
+            TypeError,
+            bencode_parallel,
+            {b"a": 1, "b": 2},
+            workers=2,
+            executor=self.executor,
+        )
+
+    def test_encode_own_pool(self):
+        self.assertEqual(
+            bencode(RECORDS), bencode_parallel(RECORDS, workers=2)
+        )
+
+    def test_decode(self):
+        for value in [RECORDS, TABLE, [1, 2], {b"a": 1, b"b": 2}]:
+            self.assertEqual(
+                value,
+                bdecode_parallel(
+                    bencode(value), workers=2, executor=self.executor
+                ),
+            )
+
+    def test_decode_own_pool(self):
+        self.assertEqual(
+            RECORDS, bdecode_parallel(bencode(RECORDS), workers=2)
+        )
+
+    def test_decode_small(self):
+        # Values other than lists and dicts, and ones with a single item, are
+        # decoded here.
+        for value in [1, b"abc", [], {}, [[1, 2]]]:
+            self.assertEqual(value, bdecode_parallel(bencode(value)))
+
+    def test_decode_checks_input(self):
+        for bad in [b"d1:bi1e1:ai2ee", b"li1ei2ei01ee", b"li1ei2e", b"lei1e"]:
+            self.assertRaises(
+                ValueError,
+                bdecode_parallel,
+                bad,
+                workers=2,
+                executor=self.executor,
+            )
+
+    def test_max_depth(self):
+        data = bencode([[1], [2]])
+        self.assertEqual(
+            bdecode(data),
+            bdecode_parallel(
+                data, workers=2, max_depth=2, executor=self.executor
+            ),
+        )
+        self.assertRaises(
+            RecursionError,
+            bdecode_parallel,
+            data,
+            workers=2,
+            max_depth=1,
+            executor=self.executor,
+        )